@@ -0,0 +1,62 @@
+# Shared setup of bench_gradient, bench_racing and bench_solver: the random-start search on the GM series,
+# then every start optimized by some method, timed and counted in passes of the recursion.
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from functools import partial
+from time import perf_counter
+from caviar import CaviarModel
+from caviar._instrument import CountCalls
+from caviar._kernels import get_caviar_function, rq_loss_grad
+from caviar._quantreg import initialize_betas
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'poc', 'dataCAViaR.txt')
+
+
+def paper_returns():
+    """
+    :returns: the GM returns the paper fits (the first 2892)
+    """
+    return np.loadtxt(DATA)[:2892, 0]
+
+
+def starting_betas(returns, model, quantile=0.05, backend='auto'):
+    """
+    :returns: caviar_model (unfitted), VaR0, the starting betas of the random-start search (seed 0),
+              with the kernels compiled
+    """
+    caviar_model = CaviarModel(quantile, model, backend=backend)
+    caviar = get_caviar_function(model, caviar_model.backend)
+    VaR0 = caviar_model.get_empirical_quantile(returns, quantile)
+
+    np.random.seed(0)
+    initial_betas = initialize_betas(returns, model, caviar, caviar_model.obj, quantile, VaR0,
+                                     backend=caviar_model.backend)
+
+    # compile the kernels before timing
+    caviar_model.obj(initial_betas[0]['beta'], returns[:10], quantile, caviar, VaR0)
+    rq_loss_grad(initial_betas[0]['beta'], returns[:10], model, quantile, VaR0, backend=caviar_model.backend)
+    return caviar_model, VaR0, initial_betas
+
+
+def counted(caviar_model, VaR0):
+    """
+    :returns: the caviar function, the RQ criterion and the fused loss and gradient, each wrapped in CountCalls
+    """
+    model, quantile, backend = caviar_model.model, caviar_model.quantile, caviar_model.backend
+    return (CountCalls(get_caviar_function(model, backend)), CountCalls(caviar_model.obj),
+            CountCalls(partial(rq_loss_grad, model=model, quantile=quantile, VaR0=VaR0, backend=backend)))
+
+
+def timed(optimize_starts, initial_betas):
+    """
+    :param: optimize_starts (callable): takes the starting betas, returns [(beta, loss)]
+    :returns: (beta, loss) of the lowest loss, wall time in seconds
+    """
+    s = perf_counter()
+    results = optimize_starts(initial_betas)
+    elapsed = perf_counter() - s
+    return min(results, key=lambda x: x[1]), elapsed
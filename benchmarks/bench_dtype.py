@@ -0,0 +1,135 @@
+# Usage: python benchmarks/bench_dtype.py [--lengths 1000000] [--models ...] [--backends numba numpy]
+# float32 against float64 (the dtype option of CaviarModel).
+#
+# Speed: the batched random-start search (rq_loss_batch, with the search size of fit) on the paper's GM series,
+# and the VaR recursion, the smoothed RQ criterion with its gradient and variance_covariance on synthetic GARCH
+# series of the given lengths.
+# Accuracy: every specification at 1% and 5% on the paper's three series, fitted in both precisions from the
+# same random starts: the difference of the betas in float64 standard errors, the relative difference of the RQ
+# criterion (both betas evaluated in float64), of the out-of-sample VaRs and the DQ p-values.
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import argparse
+import warnings
+import numpy as np
+from time import perf_counter
+from bench_suite import MODELS, SERIES, best_of, load_paper_data, synthetic_returns
+from caviar import CaviarModel
+from caviar._dq_test import variance_covariance
+from caviar._kernels import get_caviar_function, rq_loss_batch, rq_loss_grad
+from caviar._quantreg import search_size
+
+DTYPES = ['float64', 'float32']
+QUANTILES = [0.01, 0.05]
+
+
+def bench_speed(in_samples, returns, model, backend, repeat):
+    """
+    :param: in_samples (np.array): series of the candidate search
+    :param: returns (np.array): long series of the recursion, the criterion and variance_covariance
+    :returns: {dtype: {operation: seconds}}
+    """
+    quantile = 0.05
+    n, _, p = search_size(model)
+    random_betas = np.random.default_rng(0).uniform(0, 1, (n, p))
+    caviar_model = CaviarModel(quantile, model, backend=backend, random_state=0)
+    caviar_model.fit(in_samples)
+    beta, VaR0 = caviar_model.beta, caviar_model.VaR0_in
+
+    timings = {}
+    for dtype in DTYPES:
+        search_returns = in_samples.astype(dtype)
+        long_returns = returns.astype(dtype)
+        caviar = get_caviar_function(model, backend, dtype)
+        # compile the kernels of this dtype before timing
+        rq_loss_batch(search_returns[:10], random_betas[:2], model, quantile, VaR0, backend=backend, dtype=dtype)
+        rq_loss_grad(beta, long_returns[:10], model, quantile, VaR0, backend=backend, dtype=dtype)
+        VaRs = caviar(long_returns, beta, quantile, VaR0)
+        variance_covariance(beta, model, 1000, long_returns[:1000], quantile, VaRs[:1000], caviar_model.G, backend,
+                            dtype=dtype)
+
+        timings[dtype] = {
+            f'search ({n} x {len(in_samples)})': best_of(lambda: rq_loss_batch(
+                search_returns, random_betas, model, quantile, VaR0, backend=backend, dtype=dtype), repeat)[1],
+            'recursion': best_of(lambda: caviar(long_returns, beta, quantile, VaR0), repeat)[1],
+            'criterion + gradient': best_of(lambda: rq_loss_grad(
+                beta, long_returns, model, quantile, VaR0, backend=backend, dtype=dtype), repeat)[1],
+            'variance_covariance': best_of(lambda: variance_covariance(
+                beta, model, len(long_returns), long_returns, quantile, VaRs[:-1], caviar_model.G, backend,
+                dtype=dtype), repeat)[1],
+        }
+    return timings
+
+
+def check_accuracy(in_samples, out_samples, model, quantile, backend):
+    """
+    :returns: accuracy of the float32 fit against the float64 fit (dict)
+    """
+    fitted = {}
+    for dtype in DTYPES:
+        caviar_model = CaviarModel(quantile, model, backend=backend, random_state=0, dtype=dtype)
+        s = perf_counter()
+        caviar_model.fit(in_samples)
+        fitted[dtype] = (caviar_model, perf_counter() - s)
+    (m64, seconds64), (m32, seconds32) = fitted['float64'], fitted['float32']
+
+    # both betas on the float64 criterion
+    loss64 = m64.obj(m64.beta, in_samples, quantile, m64.caviar, m64.VaR0_in)
+    loss32 = m64.obj(m32.beta, in_samples, quantile, m64.caviar, m64.VaR0_in)
+    VaRs64 = m64.predict(out_samples, 'out')
+    VaRs32 = m32.predict(out_samples, 'out')
+    return {
+        'beta z': np.max(np.abs(m32.beta - m64.beta) / m64.beta_standard_errors),
+        'SE rel': np.max(np.abs(m32.beta_standard_errors / m64.beta_standard_errors - 1)),
+        'RQ rel': (loss32 - loss64) / loss64,
+        'VaR rel': np.max(np.abs(VaRs32 - VaRs64)) / np.max(np.abs(VaRs64)),
+        'DQ in 64': m64.dq_test(in_samples, 'in'),
+        'DQ in 32': m32.dq_test(in_samples, 'in'),
+        'DQ out 64': m64.dq_test(out_samples, 'out'),
+        'DQ out 32': m32.dq_test(out_samples, 'out'),
+        'fit s 64': seconds64,
+        'fit s 32': seconds32,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='+', default=[1000000])
+    parser.add_argument('--models', nargs='+', default=MODELS)
+    parser.add_argument('--backends', nargs='+', default=['numba', 'numpy'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-accuracy', action='store_true')
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    data = load_paper_data()
+    print(f'{"backend":<8}{"model":<12}{"T":>9}  {"operation":<24}{"float64 s":>11}{"float32 s":>11}{"speedup":>9}')
+    for length in args.lengths:
+        returns = np.concatenate(synthetic_returns(length))
+        for backend in args.backends:
+            for model in args.models:
+                timings = bench_speed(data['GM'][0], returns, model, backend, args.repeat)
+                for operation in timings['float64']:
+                    t64, t32 = timings['float64'][operation], timings['float32'][operation]
+                    print(f'{backend:<8}{model:<12}{length:>9}  {operation:<24}{t64:>11.4f}{t32:>11.4f}'
+                          f'{t64 / t32:>8.2f}x')
+
+    if not args.skip_accuracy:
+        columns = ['beta z', 'SE rel', 'RQ rel', 'VaR rel', 'DQ in 64', 'DQ in 32', 'DQ out 64', 'DQ out 32',
+                   'fit s 64', 'fit s 32']
+        print()
+        print(f'{"series":<7}{"q":>5}  {"model":<12}' + ''.join(f'{column:>11}' for column in columns))
+        worst = {'beta z': 0., 'RQ rel': 0., 'VaR rel': 0.}
+        for series in SERIES:
+            in_samples, out_samples = data[series]
+            for quantile in QUANTILES:
+                for model in args.models:
+                    row = check_accuracy(in_samples, out_samples, model, quantile, args.backends[0])
+                    for column in worst:
+                        worst[column] = max(worst[column], abs(row[column]))
+                    print(f'{series:<7}{quantile:>5}  {model:<12}' + ''.join(f'{row[column]:>11.3g}'
+                                                                           for column in columns))
+        print('worst: ' + ', '.join(f'{column} {value:.3g}' for column, value in worst.items()))
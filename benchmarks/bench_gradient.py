@@ -0,0 +1,33 @@
+# Usage: python benchmarks/bench_gradient.py
+# Compares L-BFGS-B with finite differences against the analytic gradient of the
+# smoothed RQ criterion, starting every specification from the same initial betas.
+
+from _bench import counted, paper_returns, starting_betas, timed
+from caviar._quantreg import optimize
+
+
+def run(returns, model, quantile=0.05, backend='auto'):
+    caviar_model, VaR0, initial_betas = starting_betas(returns, model, quantile, backend)
+
+    rows = []
+    for label in ['finite difference', 'analytic gradient']:
+        caviar, obj, loss_grad = counted(caviar_model, VaR0)
+        if label == 'finite difference':
+            loss_grad = None
+
+        (_, loss), elapsed = timed(lambda starts: [
+            optimize(initial_beta, returns, model, quantile, obj, caviar, caviar_model.tol, VaR0, loss_grad)
+            for initial_beta in starts
+        ], initial_betas)
+
+        passes = obj.n_calls + (loss_grad.n_calls if loss_grad is not None else 0)
+        rows.append((label, passes, elapsed / len(initial_betas), loss))
+    return rows
+
+
+if __name__ == '__main__':
+    returns = paper_returns()
+    print(f'{"model":<12}{"mode":<20}{"passes":>8}{"s/start":>10}{"best loss":>12}')
+    for model in ['adaptive', 'symmetric', 'asymmetric', 'igarch']:
+        for label, passes, seconds, loss in run(returns, model):
+            print(f'{model:<12}{label:<20}{passes:>8}{seconds:>10.4f}{loss:>12.6f}')
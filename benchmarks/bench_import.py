@@ -0,0 +1,49 @@
+# Usage: python benchmarks/bench_import.py [--repeat 7] [--max-seconds 1.5]
+# Times `import caviar` in fresh interpreters and fails (exit code 1) if the import pulls in
+# pandas or matplotlib again, or takes longer than --max-seconds (median).
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# modules that batch workers should not pay for; they are imported by the functions that need them
+DEFERRED = ['pandas', 'matplotlib', 'matplotlib.pyplot']
+
+PROBE = f'''
+import sys, json
+from time import perf_counter
+s = perf_counter()
+import caviar
+elapsed = perf_counter() - s
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {DEFERRED!r} if m in sys.modules]}}))
+'''
+
+
+def probe():
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--max-seconds', type=float, default=None)
+    args = parser.parse_args()
+
+    # the first run warms the bytecode and numba caches
+    probe()
+    runs = [probe() for _ in range(args.repeat)]
+    seconds = median(run['seconds'] for run in runs)
+    loaded = sorted({module for run in runs for module in run['loaded']})
+
+    print(f'import caviar: median {seconds:.3f}s over {args.repeat} fresh interpreters')
+    print(f'deferred modules loaded at import: {loaded or "none"}')
+
+    failed = bool(loaded) or (args.max_seconds is not None and seconds > args.max_seconds)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,40 @@
+# Usage: python benchmarks/bench_mle.py
+# Compares the MLE fit on the full likelihood (tau and beta) against the profiled likelihood of
+# profile_tau=True (beta only, tau at its closed form), from the same random starts (seeds 0 to 5).
+
+import numpy as np
+from _bench import paper_returns
+from caviar import CaviarModel
+
+SEEDS = range(6)
+
+
+def run(returns, model, quantile=0.05, backend='auto'):
+    # compile the kernels before timing
+    for profile_tau in [False, True]:
+        CaviarModel(quantile, model, method='mle', backend=backend, profile_tau=profile_tau,
+                    random_state=0).fit(returns[:300])
+
+    rows = []
+    for label, profile_tau in [('full', False), ('profiled', True)]:
+        # every evaluation of the likelihood (or of the smoothed criterion) is one pass of the recursion
+        attempts = []
+        losses = []
+        for seed in SEEDS:
+            caviar_model = CaviarModel(quantile, model, method='mle', backend=backend, profile_tau=profile_tau,
+                                       random_state=seed, callback=attempts.append)
+            caviar_model.fit(returns)
+            losses.append(caviar_model.training_loss * caviar_model.T)
+        attempts = [record for record in attempts if record['event'] == 'mle_attempt']
+        evaluations = sum(record['evaluations'] for record in attempts)
+        seconds = sum(record['seconds'] for record in attempts)
+        rows.append((label, evaluations / len(SEEDS), seconds / len(SEEDS), np.min(losses), np.max(losses)))
+    return rows
+
+
+if __name__ == '__main__':
+    returns = paper_returns()
+    print(f'{"model":<12}{"likelihood":<12}{"passes/fit":>12}{"s/fit":>10}{"best loss":>12}{"worst loss":>12}')
+    for model in ['adaptive', 'symmetric', 'asymmetric', 'igarch']:
+        for label, passes, seconds, best, worst in run(returns, model):
+            print(f'{model:<12}{label:<12}{passes:>12.1f}{seconds:>10.4f}{best:>12.4f}{worst:>12.4f}')
@@ -0,0 +1,38 @@
+# Usage: python benchmarks/bench_racing.py
+# Compares optimizing every one of the m best starts to convergence against racing them
+# by successive halving, from the same initial betas (m = 15 for the asymmetric model).
+
+import numpy as np
+from _bench import counted, paper_returns, starting_betas, timed
+from caviar._quantreg import optimize, race
+
+
+def run(returns, model, quantile=0.05, backend='auto'):
+    caviar_model, VaR0, initial_betas = starting_betas(returns, model, quantile, backend)
+
+    rows = []
+    for label in ['all starts', 'racing']:
+        caviar, obj, loss_grad = counted(caviar_model, VaR0)
+
+        if label == 'racing':
+            (beta, loss), elapsed = timed(lambda starts: [
+                race(starts, returns, model, quantile, obj, caviar, caviar_model.tol, VaR0, loss_grad)
+            ], initial_betas)
+        else:
+            (beta, loss), elapsed = timed(lambda starts: [
+                optimize(initial_beta, returns, model, quantile, obj, caviar, caviar_model.tol, VaR0, loss_grad)
+                for initial_beta in starts
+            ], initial_betas)
+
+        rows.append((label, obj.n_calls + loss_grad.n_calls, elapsed, loss, beta))
+    return len(initial_betas), rows
+
+
+if __name__ == '__main__':
+    returns = paper_returns()
+    print(f'{"model":<12}{"m":>4}  {"mode":<12}{"passes":>8}{"seconds":>10}{"best loss":>12}{"max |dbeta|":>13}')
+    for model in ['adaptive', 'symmetric', 'asymmetric', 'igarch']:
+        m, rows = run(returns, model)
+        for label, passes, seconds, loss, beta in rows:
+            dbeta = np.max(abs(beta - rows[0][4]))
+            print(f'{model:<12}{m:>4}  {label:<12}{passes:>8}{seconds:>10.4f}{loss:>12.6f}{dbeta:>13.2e}')
@@ -0,0 +1,40 @@
+# Usage: python benchmarks/bench_solver.py
+# Compares the L-BFGS-B solver against the iterated linear-programming solver
+# from the same initial betas, for the linear specifications.
+
+from _bench import counted, paper_returns, starting_betas, timed
+from caviar._quantreg import optimize, optimize_lp
+
+
+def run(returns, model, quantile=0.05, backend='auto'):
+    caviar_model, VaR0, initial_betas = starting_betas(returns, model, quantile, backend)
+
+    rows = []
+    for label in ['L-BFGS-B', 'lp']:
+        # every pass of the recursion goes through caviar, except the fused loss and gradient of L-BFGS-B
+        caviar, obj, loss_grad = counted(caviar_model, VaR0)
+
+        if label == 'lp':
+            (_, loss), elapsed = timed(lambda starts: [
+                optimize_lp(initial_beta, returns, model, quantile, obj, caviar, caviar_model.tol, VaR0,
+                            backend=caviar_model.backend)
+                for initial_beta in starts
+            ], initial_betas)
+        else:
+            (_, loss), elapsed = timed(lambda starts: [
+                optimize(initial_beta, returns, model, quantile, obj, caviar, caviar_model.tol, VaR0, loss_grad)
+                for initial_beta in starts
+            ], initial_betas)
+
+        # lp: one gradient recursion per linearisation, i.e. per direct call of caviar
+        passes = caviar.n_calls + loss_grad.n_calls + (caviar.n_calls - obj.n_calls if label == 'lp' else 0)
+        rows.append((label, passes / len(initial_betas), elapsed / len(initial_betas), loss))
+    return rows
+
+
+if __name__ == '__main__':
+    returns = paper_returns()
+    print(f'{"model":<12}{"solver":<10}{"passes/start":>14}{"s/start":>10}{"best loss":>14}')
+    for model in ['symmetric', 'asymmetric']:
+        for label, passes, seconds, loss in run(returns, model):
+            print(f'{model:<12}{label:<10}{passes:>14.1f}{seconds:>10.4f}{loss:>14.8f}')
@@ -0,0 +1,398 @@
+# Usage: python benchmarks/bench_suite.py [--lengths 100000 1000000] [--models ...] [--methods RQ mle]
+#                                         [--output results.json] [--compare baseline.json]
+# Times fit, predict, variance_covariance, both DQ tests and every var_tests function for every specification
+# and method, on the paper's GM series (poc/dataCAViaR.txt) and on synthetic GARCH series of the given lengths,
+# measures the memory of predict on a memory-mapped series (--memory-length) and checks the RQ betas of the
+# paper's Table 1 (Engle & Manganelli, 2004). The results are written to a JSON
+# file; --compare prints the speedup against an earlier one.
+#
+# The fit on the paper series runs the full random-start search. The random-start search costs
+# n candidates x T steps (about 10 minutes for the asymmetric model at 1M rows), so the synthetic series are
+# fitted from the beta of the paper series instead (fit_mode "warm") unless --cold is given.
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import json
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import platform
+import subprocess
+import warnings
+import numpy as np
+from datetime import datetime, timezone
+from time import perf_counter
+import var_tests
+from caviar import CaviarModel
+from caviar._dq_test import variance_covariance
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DATA = os.path.join(ROOT, 'poc', 'dataCAViaR.txt')
+SERIES = ['GM', 'IBM', 'SP500']
+# the paper fits the first 2892 returns and tests on the last 500
+TEST_SIZE = 500
+MODELS = ['adaptive', 'symmetric', 'asymmetric', 'igarch']
+METHODS = ['RQ', 'mle']
+
+# Table 1 of Engle & Manganelli (2004): (betas, standard errors, RQ criterion) per (quantile, model, series).
+# The paper reports the VaR as a positive number; the models here return the negative quantile, see PAPER_SIGNS.
+PAPER = {
+    (0.01, 'symmetric', 'GM'): ((.4511, .8263, .3305), (.2028, .0826, .1685), 172.04),
+    (0.01, 'symmetric', 'IBM'): ((.1261, .9476, .1134), (.0929, .0501, .1185), 182.32),
+    (0.01, 'symmetric', 'SP500'): ((.2039, .8732, .3819), (.0604, .0507, .2772), 109.68),
+    (0.01, 'asymmetric', 'GM'): ((.3734, .7995, .2779, .4569), (.2418, .0869, .1398, .1787), 169.22),
+    (0.01, 'asymmetric', 'IBM'): ((.0558, .9423, .0499, .2512), (.0540, .0247, .0563, .0848), 179.40),
+    (0.01, 'asymmetric', 'SP500'): ((.1476, .8729, -.0139, .4969), (.0456, .0302, .1148, .1342), 105.82),
+    (0.01, 'igarch', 'GM'): ((1.4959, .7804, .9356), (.9252, .0590, 1.2619), 170.99),
+    (0.01, 'igarch', 'IBM'): ((1.3289, .8740, .3374), (1.9488, .1133, .0953), 183.43),
+    (0.01, 'igarch', 'SP500'): ((.2328, .8350, 1.0582), (.1191, .0225, 1.0983), 108.34),
+    (0.01, 'adaptive', 'GM'): ((.2968,), (.1109,), 179.61),
+    (0.01, 'adaptive', 'IBM'): ((.1626,), (.0736,), 192.20),
+    (0.01, 'adaptive', 'SP500'): ((.5562,), (.1150,), 117.42),
+    (0.05, 'symmetric', 'GM'): ((.1812, .8953, .1133), (.0833, .0361, .0122), 550.83),
+    (0.05, 'symmetric', 'IBM'): ((.1191, .9053, .1481), (.0839, .0500, .0348), 522.43),
+    (0.05, 'symmetric', 'SP500'): ((.0511, .9369, .1341), (.0083, .0224, .0517), 306.68),
+    (0.05, 'asymmetric', 'GM'): ((.0760, .9326, .0398, .1218), (.0249, .0194, .0322, .0405), 548.31),
+    (0.05, 'asymmetric', 'IBM'): ((.0953, .8892, .0617, .2187), (.0532, .0385, .0272, .0465), 515.58),
+    (0.05, 'asymmetric', 'SP500'): ((.0378, .9025, .0377, .2871), (.0135, .0144, .0224, .0258), 300.82),
+    (0.05, 'igarch', 'GM'): ((.3336, .9042, .1220), (.1039, .0134, .1149), 552.12),
+    (0.05, 'igarch', 'IBM'): ((.5387, .8259, .1591), (.1569, .0294, .1152), 524.79),
+    (0.05, 'igarch', 'SP500'): ((.0262, .9287, .1407), (.0100, .0061, .6198), 305.93),
+    (0.05, 'adaptive', 'GM'): ((.2871,), (.0506,), 553.79),
+    (0.05, 'adaptive', 'IBM'): ((.3969,), (.0812,), 527.72),
+    (0.05, 'adaptive', 'SP500'): ((.3700,), (.0767,), 312.06),
+}
+# cases of Table 1 the betas do not reproduce within the default --z-tol 2 (max |z| on this tree in brackets):
+# SP500 symmetric has a flat ridge of near-equal RQ criteria (3.23 at 1%, 5.15 at 5%, both with a lower RQ than
+# the paper's); the 1% adaptive fits are not identified well enough (GM 3.13, IBM 12.94). They are reported as
+# expected, so that only a new miss fails the check.
+KNOWN_PAPER_MISSES = {(0.01, 'symmetric', 'SP500'), (0.05, 'symmetric', 'SP500'), (0.01, 'adaptive', 'GM'),
+                      (0.01, 'adaptive', 'IBM')}
+
+# operations not timed, with the reason
+SKIPPED = {'var_tests.dq_test': 'var_tests.dq_test reads y before assigning it (UnboundLocalError)'}
+
+# VaR_t = -f_t: the intercept and the |y| / y+ terms flip sign, y- = -min(y, 0) does not;
+# igarch squares the VaR and the adaptive step is taken on the negative quantile
+PAPER_SIGNS = {'adaptive': (-1,), 'symmetric': (-1, 1, -1), 'asymmetric': (-1, 1, -1, 1), 'igarch': (1, 1, 1)}
+
+
+def load_paper_data():
+    """
+    :returns: {series: (in-sample returns, out-of-sample returns)}
+    """
+    data = np.loadtxt(DATA)
+    return {name: (data[:-TEST_SIZE, i].copy(), data[-TEST_SIZE:, i].copy()) for i, name in enumerate(SERIES)}
+
+
+def synthetic_returns(length, seed=0):
+    """
+    GARCH(1, 1) returns with Student-t(5) innovations, in percent, about as volatile as the paper's series
+
+    :param: length (int): number of returns
+    :returns: (in-sample returns, out-of-sample returns), the last tenth (at least 500) out of sample
+    """
+    rng = np.random.default_rng(seed)
+    z = rng.standard_t(5, length) / np.sqrt(5 / 3)
+    omega, alpha, beta = 0.05, 0.08, 0.9
+    returns = np.empty(length)
+    variance = omega / (1 - alpha - beta)
+    for t in range(length):
+        returns[t] = np.sqrt(variance) * z[t]
+        variance = omega + alpha * returns[t] ** 2 + beta * variance
+    test_size = max(TEST_SIZE, length // 10)
+    return returns[:-test_size], returns[-test_size:]
+
+
+def best_of(func, repeat):
+    """
+    :returns: result of the last call, the fastest of repeat wall times in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        s = perf_counter()
+        result = func()
+        times.append(perf_counter() - s)
+    return result, min(times)
+
+
+def bench_specification(series, in_samples, out_samples, model, method, quantile, initial_beta, repeat,
+                        backend):
+    """
+    :param: initial_beta (np.array): warm start of the fit, or None for the full random-start search
+    :returns: rows (list of dict) of one timed operation each, and the fitted beta (None if the fit failed)
+    """
+    base = {'series': series, 'T': len(in_samples), 'model': model, 'method': method, 'quantile': quantile,
+            'fit_mode': 'cold' if initial_beta is None else 'warm'}
+    rows = []
+
+    def timed(operation, func, n=repeat):
+        row = dict(base, operation=operation, status='ok', error=None, seconds=None, repeat=n)
+        if operation in SKIPPED:
+            row.update(status='skipped', error=SKIPPED[operation], repeat=0)
+            rows.append(row)
+            return None
+        try:
+            result, row['seconds'] = best_of(func, n)
+        except Exception as e:
+            result = None
+            row['status'] = 'failed'
+            row['error'] = f'{type(e).__name__}: {e}'
+        rows.append(row)
+        return result
+
+    caviar_model = CaviarModel(quantile, model, method, backend=backend, random_state=0)
+    timed('fit', lambda: caviar_model.fit(in_samples, initial_beta=initial_beta), n=1)
+    if caviar_model.beta is None:
+        return rows, None
+    rows[-1]['loss'] = caviar_model.training_loss
+
+    # the series passed to fit would only copy the cached in-sample pass: time the recursion from VaR0_in on a
+    # series of the same length instead, as predict (in) did before the cache
+    reversed_samples = np.ascontiguousarray(in_samples[::-1])
+    timed('predict (in)', lambda: caviar_model.predict(reversed_samples, 'in'))
+    VaRs = timed('predict (out)', lambda: caviar_model.predict(out_samples, 'out'))
+    if VaRs is None:
+        return rows, caviar_model.beta
+    VaRs = VaRs[:-1]
+    timed('variance_covariance', lambda: variance_covariance(
+        caviar_model.beta, model, caviar_model.T, in_samples, quantile, caviar_model.VaRs_in[:-1], caviar_model.G,
+        caviar_model.backend, caviar_model.residuals_in))
+    timed('dq_test (in)', lambda: caviar_model.dq_test(in_samples, 'in'))
+    timed('dq_test (out)', lambda: caviar_model.dq_test(out_samples, 'out'))
+
+    timed('var_tests.hit_rate', lambda: var_tests.hit_rate(out_samples, VaRs))
+    timed('var_tests.binomial_test', lambda: var_tests.binomial_test(out_samples, VaRs, quantile))
+    timed('var_tests.traffic_light_test', lambda: var_tests.traffic_light_test(out_samples, VaRs, quantile))
+    timed('var_tests.kupiec_pof_test', lambda: var_tests.kupiec_pof_test(out_samples, VaRs, quantile))
+    timed('var_tests.christoffersen_test', lambda: var_tests.christoffersen_test(out_samples, VaRs))
+    timed('var_tests.dq_test', lambda: var_tests.dq_test(out_samples, VaRs, quantile))
+    return rows, caviar_model.beta
+
+
+def streaming_memory(length, model, backend, chunk_size):
+    """
+    Run in a fresh process (see measure_memory): fit on the paper's GM series, write length synthetic returns
+    to a raw float64 file block by block, then predict their VaRs from the memory-mapped file into a
+    memory-mapped output, chunk_size returns at a time.
+    The peak RSS also counts the pages of the two mapped files the kernel keeps resident, which grow with
+    length whatever the library does; the traced heap peak is what predict allocates itself (numpy arrays
+    and python objects) and should stay of the order of chunk_size.
+
+    :returns: {'peak RSS growth MiB', 'peak heap MiB', 'series MiB'}
+    """
+    caviar_model = CaviarModel(0.05, model, backend=backend, random_state=0)
+    caviar_model.fit(load_paper_data()['GM'][0])
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'returns.f8')
+        rng = np.random.default_rng(0)
+        with open(path, 'wb') as f:
+            for start in range(0, length, 2 ** 20):
+                f.write(rng.standard_t(5, min(2 ** 20, length - start)).tobytes())
+
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        caviar_model.predict(path, 'out', out=os.path.join(directory, 'VaRs.f8'), chunk_size=chunk_size)
+        heap = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux
+    return {'peak RSS growth MiB': (after - before) / 2 ** 10, 'peak heap MiB': heap / 2 ** 20,
+            'series MiB': length * 8 / 2 ** 20}
+
+
+def measure_memory(length, model, backend, chunk_size):
+    """
+    :returns: streaming_memory in a spawned process, so the peak RSS is not the one of earlier benchmarks
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+        return pool.submit(streaming_memory, length, model, backend, chunk_size).result()
+
+
+def check_paper(data, models, z_tol, rq_tol, backend):
+    """
+    Refit the RQ models of Table 1. A case passes if every beta is within z_tol paper standard errors;
+    "expected" marks the KNOWN_PAPER_MISSES.
+    The RQ criterion is compared separately ("RQ ok": at most rq_tol relative above the paper's), since a
+    lower criterion than the paper's is a better optimum, not a regression, but does not make the betas match.
+
+    :returns: rows (list of dict), one per (quantile, model, series)
+    """
+    rows = []
+    for (quantile, model, series), (betas, standard_errors, rq) in PAPER.items():
+        if model not in models:
+            continue
+        in_samples = data[series][0]
+        caviar_model = CaviarModel(quantile, model, backend=backend, random_state=0)
+        caviar_model.fit(in_samples)
+
+        paper_beta = np.array(betas) * PAPER_SIGNS[model]
+        z = (caviar_model.beta - paper_beta) / np.array(standard_errors)
+        # the paper's RQ criterion is the sum of the check losses, training_loss is their mean
+        fitted_rq = caviar_model.training_loss * len(in_samples)
+        rq_diff = fitted_rq / rq - 1
+        rows.append({'series': series, 'model': model, 'quantile': quantile,
+                     'beta': caviar_model.beta.tolist(), 'paper beta': paper_beta.tolist(),
+                     'max |z|': float(np.max(np.abs(z))), 'RQ': fitted_rq, 'paper RQ': rq, 'RQ diff': rq_diff,
+                     'RQ ok': bool(rq_diff <= rq_tol), 'passed': bool(np.all(np.abs(z) <= z_tol)),
+                     'expected miss': (quantile, model, series) in KNOWN_PAPER_MISSES})
+    return rows
+
+
+def paper_check_flag(row):
+    """
+    :returns: suffix of a row of the paper check, empty if it passed as expected
+    """
+    if row['passed']:
+        return '  (known miss, now passes)' if row['expected miss'] else ''
+    return '  <- known miss' if row['expected miss'] else '  <- failed'
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+
+    versions = {}
+    for module in ['numpy', 'scipy', 'pandas', 'numba']:
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {'commit': commit, 'dirty': dirty, 'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'versions': versions}
+
+
+def compare(results, baseline_path, max_slowdown):
+    """
+    print the speedup of every operation timed in both files
+    :returns: whether an operation taking at least 1 ms is more than max_slowdown times slower
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def key(row):
+        return row['series'], row['T'], row['model'], row['method'], row['quantile'], row['fit_mode'], \
+            row['operation']
+    old = {key(row): row['seconds'] for row in baseline['timings'] if row['seconds'] is not None}
+
+    print(f'\nagainst {baseline_path} (commit {baseline["meta"]["commit"]})')
+    print(f'{"series":<12}{"model":<12}{"method":<6}{"operation":<32}{"before":>10}{"after":>10}{"speedup":>9}')
+    regressed = False
+    for row in results['timings']:
+        before = old.get(key(row))
+        if before is None or row['seconds'] is None:
+            continue
+        speedup = before / row['seconds'] if row['seconds'] > 0 else float('inf')
+        flag = ''
+        if max_slowdown is not None and max(before, row['seconds']) >= 1e-3 and speedup < 1 / max_slowdown:
+            regressed = True
+            flag = '  <- slower'
+        print(f'{row["series"]:<12}{row["model"]:<12}{row["method"]:<6}{row["operation"]:<32}'
+              f'{before:>10.4f}{row["seconds"]:>10.4f}{speedup:>8.2f}x{flag}')
+    return regressed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lengths', type=int, nargs='*', default=[100_000, 1_000_000],
+                        help='lengths of the synthetic series, besides the paper series')
+    parser.add_argument('--models', nargs='+', default=MODELS, choices=MODELS)
+    parser.add_argument('--methods', nargs='+', default=METHODS, choices=METHODS)
+    parser.add_argument('--quantile', type=float, default=0.05)
+    parser.add_argument('--series', default='GM', choices=SERIES, help='paper series to time')
+    parser.add_argument('--repeat', type=int, default=3, help='best of, for everything but fit')
+    parser.add_argument('--backend', default='auto')
+    parser.add_argument('--cold', action='store_true', help='run the random-start search on the synthetic series')
+    parser.add_argument('--memory-length', type=int, default=4_000_000,
+                        help='length of the memory-mapped series of the streaming memory check, 0 to skip it')
+    parser.add_argument('--memory-chunk-size', type=int, default=2 ** 16)
+    parser.add_argument('--skip-paper-check', action='store_true')
+    parser.add_argument('--z-tol', type=float, default=2.)
+    parser.add_argument('--rq-tol', type=float, default=0.005)
+    parser.add_argument('--output', default=None, help='default: benchmarks/results/suite-<commit>.json')
+    parser.add_argument('--compare', default=None, help='earlier output to compare against')
+    parser.add_argument('--max-slowdown', type=float, default=None,
+                        help='with --compare, exit with 1 if an operation is this many times slower')
+    parser.add_argument('--fail-on-check', action='store_true',
+                        help='exit with 1 if a paper check fails that is not a known miss')
+    args = parser.parse_args()
+
+    # the overflow of exp in the adaptive model is harmless
+    warnings.simplefilter('ignore')
+    data = load_paper_data()
+    results = {'meta': metadata(), 'timings': [], 'memory': [], 'paper_check': []}
+    results['meta']['args'] = vars(args)
+
+    # compile the kernels of every specification before anything is timed
+    for model in args.models:
+        for method in args.methods:
+            CaviarModel(args.quantile, model, method, backend=args.backend, random_state=0).fit(
+                data[args.series][0][:400])
+
+    series = [(args.series, *data[args.series])] + \
+             [(f'garch-{length}', *synthetic_returns(length)) for length in args.lengths]
+    print(f'{"series":<16}{"T":>9}  {"model":<12}{"method":<6}{"operation":<32}{"seconds":>10}')
+    for model in args.models:
+        for method in args.methods:
+            paper_beta = None
+            for name, in_samples, out_samples in series:
+                initial_beta = None if name == args.series or args.cold else paper_beta
+                rows, beta = bench_specification(name, in_samples, out_samples, model, method, args.quantile,
+                                                 initial_beta, args.repeat, args.backend)
+                if name == args.series:
+                    paper_beta = beta
+                results['timings'] += rows
+                for row in rows:
+                    seconds = row['status'] if row['seconds'] is None else f'{row["seconds"]:.4f}'
+                    print(f'{name:<16}{row["T"]:>9}  {model:<12}{method:<6}{row["operation"]:<32}{seconds:>10}')
+
+    if args.memory_length:
+        print(f'\npredict from a memory-mapped file into a memory-mapped output, {args.memory_length} returns, '
+              f'chunk_size {args.memory_chunk_size}')
+        print(f'{"backend":<8}{"model":<12}{"peak RSS growth MiB":>21}{"peak heap MiB":>15}{"series MiB":>12}')
+        for backend in sorted({args.backend, 'numpy'}):
+            for model in args.models:
+                row = dict(measure_memory(args.memory_length, model, backend, args.memory_chunk_size),
+                           backend=backend, model=model, T=args.memory_length, chunk_size=args.memory_chunk_size)
+                results['memory'].append(row)
+                print(f'{backend:<8}{model:<12}{row["peak RSS growth MiB"]:>21.1f}{row["peak heap MiB"]:>15.1f}'
+                      f'{row["series MiB"]:>12.1f}')
+
+    failed_checks = []
+    if not args.skip_paper_check:
+        results['paper_check'] = check_paper(data, args.models, args.z_tol, args.rq_tol, args.backend)
+        print(f'\n{"quantile":<10}{"model":<12}{"series":<8}{"max |z|":>9}{"RQ":>10}{"paper RQ":>10}{"RQ diff":>9}'
+              f'{"RQ ok":>7}')
+        for row in results['paper_check']:
+            print(f'{row["quantile"]:<10}{row["model"]:<12}{row["series"]:<8}{row["max |z|"]:>9.2f}'
+                  f'{row["RQ"]:>10.2f}{row["paper RQ"]:>10.2f}{row["RQ diff"]:>+9.4f}'
+                  f'{"yes" if row["RQ ok"] else "no":>7}{paper_check_flag(row)}')
+        failed_checks = [row for row in results['paper_check'] if not row['passed'] and not row['expected miss']]
+        n_passed = sum(row['passed'] for row in results['paper_check'])
+        n_expected = sum(not row['passed'] and row['expected miss'] for row in results['paper_check'])
+        print(f'{n_passed}/{len(results["paper_check"])} match the paper, {n_expected} known misses, '
+              f'{len(failed_checks)} new failures (z_tol {args.z_tol})')
+
+    output = args.output
+    if output is None:
+        commit = (results['meta']['commit'] or 'unknown')[:8]
+        output = os.path.join(ROOT, 'benchmarks', 'results', f'suite-{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print(f'\nresults written to {output}')
+
+    regressed = args.compare is not None and compare(results, args.compare, args.max_slowdown)
+    sys.exit(1 if regressed or (args.fail_on_check and failed_checks) else 0)
@@ -3,5 +3,13 @@
 
 # from ._arch_model import GarchModel
 from ._caviar_model import CaviarModel
+from ._multi_quantile import MultiQuantileCaviarModel
+from ._walk_forward import walk_forward
+from ._panel import fit_panel
+from ._grid_search import grid_search
+from ._cache import FitCache
+from ._io import save_models, load_models
+from ._instrument import FitRecorder
 
-__all__ = ['CaviarModel']
\ No newline at end of file
+__all__ = ['CaviarModel', 'MultiQuantileCaviarModel', 'walk_forward', 'fit_panel', 'grid_search', 'FitCache', 'save_models',
+           'load_models', 'FitRecorder']
\ No newline at end of file
@@ -3,14 +3,16 @@
 
 import numpy as np
 from scipy.optimize import minimize
+from ._parallel import check_random_state
 
 
 class GarchModel:
-    def __init__(self, p, q=0):
+    def __init__(self, p, q=0, random_state=None):
         if q != 0:
             raise Exception('Currently only support ARCH model. q must be equal to 0.')
         self.p = p
         self.q = q
+        self.random_state = random_state
 
     def arch(self, params, returns):
         """return a series of sigma2"""
@@ -66,7 +68,7 @@ class GarchModel:
 
     def fit(self, returns):
         """return scipy optimize result"""
-        params = np.random.uniform(0, 1, self.p + 1)
+        params = check_random_state(self.random_state).uniform(0, 1, self.p + 1)
         bounds = [(0, None)] + [(0, 1) for _ in range(self.p)]
         returns = np.array(returns)
         self.res = minimize(self.neg_log_likelihood, params, args=(returns), bounds=bounds)
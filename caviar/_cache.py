@@ -0,0 +1,171 @@
+# Author: Lee Yat Shun, Jasper
+# Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
+
+import os
+import copy
+import hashlib
+import numpy as np
+from collections import OrderedDict, namedtuple
+from ._io import as_returns, load_models, save_models
+from ._kernels import get_caviar_function
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'disk_hits', 'misses', 'currsize', 'disk_bytes'])
+
+# everything that changes the fitted beta besides __repr__; n_jobs does not (see random_state)
+_FIT_PARAMS = ['backend', 'jac', 'racing', 'solver', 'profile_tau', 'max_attempts', 'timeout', 'random_state',
+               'dtype']
+
+
+def _fitted_attributes(caviar_model):
+    """
+    :returns: names of the attributes fit sets (those _reset_fitted_state clears), except the phase timings
+              of profile=True, which belong to the call that ran the fit
+    """
+    blank = type(caviar_model).__new__(type(caviar_model))
+    blank._reset_fitted_state()
+    return [name for name in blank.__dict__ if name != 'profile_phases']
+
+
+class FitCache:
+    def __init__(self, maxsize=32, directory=None, max_bytes=256 * 2 ** 20):
+        """
+        Content-addressed cache of fitted CaviarModels.
+
+        The key is a hash of the return buffer, the model config (__repr__ and the other fitting parameters)
+        and the seed. Recent fits are kept in memory (least recently used are dropped first), every fit is also
+        written to directory with save_models (no pickle), where the least recently used files are removed once
+        they exceed max_bytes.
+
+        Only a model with an int random_state is cached: with None (the global numpy RNG) or a
+        np.random.Generator, the same config does not give the same fit, so it is always refitted.
+
+        :param: maxsize (int): number of fits kept in memory. Default is 32.
+        :param: directory (str): where fits are stored on disk. Default is None (memory only).
+        :param: max_bytes (int): disk budget in bytes. Default is 256 MiB.
+        """
+        self.maxsize = maxsize
+        self.directory = None if directory is None else os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self.hits = self.disk_hits = self.misses = 0
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return f"FitCache(maxsize={self.maxsize}, directory={self.directory}, max_bytes={self.max_bytes})"
+
+    def key(self, caviar_model, returns, initial_beta=None):
+        """
+        :param: caviar_model (CaviarModel): an unfitted or fitted model; only its config is used
+        :param: returns (array-like): a series of returns
+        :param: initial_beta (array-like): warm start passed to fit. Default is None.
+        :returns: hex digest (str), or None if the fit cannot be cached
+        """
+        if caviar_model.random_state is None or isinstance(caviar_model.random_state,
+                                                           (np.random.Generator, np.random.RandomState)):
+            return None
+
+        config = repr(caviar_model) + repr([(name, getattr(caviar_model, name)) for name in _FIT_PARAMS])
+        digest = hashlib.sha256(config.encode())
+        # hashed through the buffer: a memory-mapped series is not copied
+        digest.update(np.ascontiguousarray(as_returns(returns)).data)
+        if initial_beta is not None:
+            digest.update(np.ascontiguousarray(initial_beta, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    def fit(self, caviar_model, returns, initial_beta=None):
+        """
+        Same as caviar_model.fit(returns, initial_beta), unless the same fit is in the cache.
+
+        :param: caviar_model (CaviarModel): the model to fit
+        :param: returns (array-like): a series of returns (100x)
+        :param: initial_beta (array-like): warm start. Default is None.
+        :returns: caviar_model, fitted
+        """
+        key = self.key(caviar_model, returns, initial_beta)
+        if key is None:
+            caviar_model.fit(returns, initial_beta)
+            return caviar_model
+
+        state = self._get(key)
+        if state is None:
+            self.misses += 1
+            caviar_model.fit(returns, initial_beta)
+            self._put(key, caviar_model)
+        else:
+            # only the fitted state: n_jobs, profile, the callback, ... stay those of the caller
+            caviar_model._reset_fitted_state()
+            caviar_model.__dict__.update(copy.deepcopy(state))
+            caviar_model.caviar = get_caviar_function(caviar_model.model, caviar_model.backend,
+                                                      caviar_model.dtype)
+        return caviar_model
+
+    def info(self):
+        """
+        :returns: CacheInfo(hits, disk_hits, misses, currsize, disk_bytes)
+        """
+        return CacheInfo(self.hits, self.disk_hits, self.misses, len(self._memory), self._disk_usage()[0])
+
+    def clear(self):
+        """drop every fit, in memory and on disk"""
+        self._memory.clear()
+        for path in self._disk_usage()[1]:
+            os.remove(path)
+
+    def _get(self, key):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            # read into memory: the file may be evicted while the state is in use
+            cached_model = load_models(path, mmap=False)
+            state = {name: getattr(cached_model, name) for name in _fitted_attributes(cached_model)}
+        except (OSError, ValueError, KeyError, AttributeError, ImportError):
+            return None
+        # mark as recently used for the disk eviction
+        os.utime(path)
+        self.disk_hits += 1
+        self._remember(key, state)
+        return state
+
+    def _put(self, key, caviar_model):
+        state = {name: getattr(caviar_model, name) for name in _fitted_attributes(caviar_model)}
+        self._remember(key, copy.deepcopy(state))
+        path = self._path(key)
+        if path is None:
+            return
+        # save_models writes then renames, so a reader never sees a partial file
+        save_models(path, caviar_model)
+        self._evict_disk()
+
+    def _remember(self, key, state):
+        self._memory[key] = state
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return None if self.directory is None else os.path.join(self.directory, key + '.caviar')
+
+    def _disk_usage(self):
+        """
+        :returns: total bytes, paths of the cached fits from least to most recently used
+        """
+        if self.directory is None:
+            return 0, []
+        entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.caviar')]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        return sum(entry.stat().st_size for entry in entries), [entry.path for entry in entries]
+
+    def _evict_disk(self):
+        total, paths = self._disk_usage()
+        for path in paths:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
@@ -4,17 +4,18 @@
 import numpy as np
     
 
-def adaptive(returns, beta, quantile, VaR0, G=10):
+def adaptive(returns, beta, quantile, VaR0, G=10, dtype=np.float64):
     """
     :param: returns (array): a series of daily returns from day 0 to day T
     :param: beta (array): a series of coefficients
     :param: quantile (float): a value between 0 and 1
     :param: G (int): some positive number for the smoothen version of indicator function
+    :param: dtype (np.dtype): dtype of the VaRs. Default is np.float64.
     :returns: VaR from day 0 to day T + 1
     """
     b1 = beta[0]
 #     VaRs = np.zeros_like(returns)
-    VaRs = np.zeros(returns.shape[0] + 1)
+    VaRs = np.zeros(returns.shape[0] + 1, dtype)
     
     VaRs[0] = VaR0
     for t in range(len(returns)):
@@ -28,16 +29,17 @@ def adaptive(returns, beta, quantile, VaR0, G=10):
     return VaRs
 
 
-def symmetric_abs_val(returns, beta, quantile, VaR0, G=0):
+def symmetric_abs_val(returns, beta, quantile, VaR0, G=0, dtype=np.float64):
     """
     :param: returns (array): a series of daily returns from day 0 to day T
     :param: beta (array): a series of coefficients
     :param: quantile (float): a value between 0 and 1
+    :param: dtype (np.dtype): dtype of the VaRs. Default is np.float64.
     :returns: VaR from day 0 to day T + 1
     """
     b1, b2, b3 = beta
 #     VaRs = np.zeros_like(returns)
-    VaRs = np.zeros(returns.shape[0] + 1)
+    VaRs = np.zeros(returns.shape[0] + 1, dtype)
     
     VaRs[0] = VaR0
     for t in range(len(returns)):
@@ -47,16 +49,17 @@ def symmetric_abs_val(returns, beta, quantile, VaR0, G=0):
     return VaRs
 
 
-def asymmetric_slope(returns, beta, quantile, VaR0, G=0):
+def asymmetric_slope(returns, beta, quantile, VaR0, G=0, dtype=np.float64):
     """
     :param: returns (array): a series of daily returns from day 0 to day T
     :param: beta (array): a series of coefficients
     :param: quantile (float): a value between 0 and 1
+    :param: dtype (np.dtype): dtype of the VaRs. Default is np.float64.
     :returns: VaR from day 0 to day T + 1
     """
     b1, b2, b3, b4 = beta
 #     VaR = np.zeros_like(returns)
-    VaRs = np.zeros(returns.shape[0] + 1)
+    VaRs = np.zeros(returns.shape[0] + 1, dtype)
     
     VaRs[0] = VaR0
     for t in range(len(returns)):
@@ -66,18 +69,19 @@ def asymmetric_slope(returns, beta, quantile, VaR0, G=0):
     return VaRs
 
 
-def igarch(returns, beta, quantile, VaR0, G=0):
+def igarch(returns, beta, quantile, VaR0, G=0, dtype=np.float64):
     """
     Notice that the sigma here is negative root of the sqrt term
     
     :param: returns (array): a series of daily returns from day 0 to day T
     :param: beta (array): a series of coefficients
     :param: quantile (float): a value between 0 and 1
+    :param: dtype (np.dtype): dtype of the VaRs. Default is np.float64.
     :returns: VaR from day 0 to day T + 1
     """
     b1, b2, b3 = beta
 #     VaRs = np.zeros_like(returns)
-    VaRs = np.zeros(returns.shape[0] + 1)
+    VaRs = np.zeros(returns.shape[0] + 1, dtype)
     
     VaRs[0] = - VaR0
     for t in range(len(returns)):
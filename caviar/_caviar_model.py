@@ -2,20 +2,23 @@
 # Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
 
 import numpy as np
-import pandas as pd
-from ._quantreg import rq_fit
+from functools import partial
+from ._quantreg import rq_criterion, rq_fit
 from ._frequentist import mle_fit
-from ._caviar_function import adaptive, symmetric_abs_val, asymmetric_slope, igarch
-from ._dq_test import compute_se_pval, variance_covariance, dq_test
+from ._kernels import get_caviar_function, resolve_backend, resolve_dtype, warn_float32_fit
+from ._dq_test import compute_se_pval, variance_covariance, dq_test, hit_func
 from ._utils import plot_caviar, plot_news_impact_curve
 from ._exceptions import InputSizeError, NotFittedError
-from scipy.stats import norm
-from time import time
+from ._io import as_returns, load_models, open_output, returns_digest, save_models
+from ._instrument import PhaseProfiler, make_sink, phase, report
+from time import perf_counter
 import warnings
 
 
 class CaviarModel:
-    def __init__(self, quantile=0.05, model='symmetric', method='RQ', G=10, tol=1e-10, LAGS=4, verbose=False):
+    def __init__(self, quantile=0.05, model='symmetric', method='RQ', G=10, tol=1e-10, LAGS=4, verbose=False,
+                 backend='auto', n_jobs=1, jac=True, profile_tau=False, max_attempts=20, timeout=None,
+                 random_state=None, racing=False, solver='L-BFGS-B', callback=None, profile=False, dtype='float64'):
         """
         CaviarModel is a class for estimating Conditional Autoregressive Value at Risk (CAViaR) models.
         
@@ -28,20 +31,53 @@ class CaviarModel:
         :param: G (int): Smoothen version of the indicator function. Some positive number. Default is 10.
         :param: tol (float): Tolerance level for optimization. Default is 1e-10.
         :param: LAGS (int): Default is 4.
-        :param: verbose (bool): Default is False.
+        :param: verbose (bool): If True, print the records of fit (see callback). Default is False.
+        :param: backend (str): Kernel used for the VaR recursion. Must be one of {"auto", "numba", "numpy", "python"}.
+                               "numba" JIT-compiles the recursions, "numpy" uses linear filters for the linear
+                               specifications, "python" is the reference loop. "auto" picks numba if it is installed,
+                               otherwise numpy. Default is "auto".
+        :param: n_jobs (int): Number of processes the RQ starting betas (or the MLE restarts) are optimized on.
+                              -1 means all cores. MLE keeps the first start with a finite likelihood, so it only
+                              gains from n_jobs > 1 when starts fail. Default is 1.
+        :param: jac (bool): If True, the RQ optimizer (and the profiled MLE search of profile_tau) uses the
+                            analytic gradient of a smoothed RQ criterion (one pass of the recursion per
+                            iteration). If False, scipy finite-differences the RQ criterion. Default is True.
+        :param: profile_tau (bool): For method "mle", replace tau by its closed form given beta so the likelihood
+                                    is searched over beta only. Default is False.
+        :param: max_attempts (int): For method "mle", maximum number of random restarts. Default is 20.
+        :param: timeout (float): For method "mle", wall-clock budget of the restarts in seconds. Default is None.
+        :param: random_state (None, int or np.random.Generator): Seed of the RQ random-start search and the MLE
+                                                                 random starts. With an int, every fit draws the same
+                                                                 starts, whatever n_jobs is. Default is None
+                                                                 (global numpy RNG).
+        :param: racing (bool): For method "RQ", race the starting betas by successive halving: every start gets
+                               a few iterations, the worse half is dropped and the survivors get more, until one
+                               is left and optimized to convergence. Default is False.
+        :param: solver (str): For method "RQ", either "L-BFGS-B" or "lp". "lp" linearises the VaR recursion around
+                              the current beta and solves the quantile regression exactly by linear programming,
+                              repeating until convergence. Only for the "symmetric" and "asymmetric" models,
+                              and not with racing. Default is "L-BFGS-B".
+        :param: callback (callable): Called by fit with every structured record (dict with an "event" key):
+                                     "search" (candidate search), "update" and "start" (per starting beta:
+                                     iterations, objective evaluations, seconds), "race_round"/"race",
+                                     "mle_attempt" and finally "fit" (optimize and covariance seconds).
+                                     The records are also logged to the "caviar" logger. Default is None,
+                                     i.e. fit is silent.
+        :param: profile (bool): If True, fit records the wall time and call counts of each of its phases,
+                                see profile_report. Default is False.
+        :param: dtype (str): Precision of the returns, the VaR paths and the RQ criterion, "float64" or "float32".
+                             "float32" halves the memory of the returns, VaRs, residuals and the (T, p) gradient,
+                             e.g. to predict on long memory-mapped series; it is not faster with numba and a fit
+                             may end in another minimum (fit warns for the adaptive and symmetric models at
+                             extreme quantiles). The criterion, the likelihood and the matrices A and D of the
+                             covariance are still accumulated in float64. Default is "float64".
         """
         if G != 10:
             raise ValueError('Currently only support G = 10')
         
-        self.beta = None
         self.p = None
         self.caviar = None
-        self.VaR0_in = None
-        self.VaR0_out = None
-        
-        self.vc_matrix = None
-        self.D = None
-        self.gradient = None
+        self._reset_fitted_state()
 
         self.G = G
         self.tol = tol
@@ -65,11 +101,68 @@ class CaviarModel:
             )
         
         self.verbose = verbose
+        self.backend = resolve_backend(backend)
+        self.n_jobs = n_jobs
+        self.jac = jac
+        self.profile_tau = profile_tau
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.random_state = random_state
+        self.racing = racing
+        self.callback = callback
+        self.profile = profile
+        self.dtype = resolve_dtype(dtype)
+        
+        if solver not in ['L-BFGS-B', 'lp']:
+            raise ValueError('solver must be either "L-BFGS-B" or "lp".')
+        if solver == 'lp' and model not in ['symmetric', 'asymmetric']:
+            raise ValueError('The lp solver only supports the "symmetric" and "asymmetric" models.')
+        if solver == 'lp' and racing:
+            raise ValueError('racing is only available with the L-BFGS-B solver.')
+        self.solver = solver
             
     def __repr__(self):
         return (f"CaviarModel(quantile={self.quantile}, model={self.model}, "
                 f"method={self.method}, G={self.G}, tol={self.tol}, LAGS={self.LAGS})")
     
+    def _reset_fitted_state(self):
+        """
+        Invalidate everything fit produces, so a refit (or a failed refit) never mixes with a stale state.
+        """
+        self.beta = None
+        self.T = None
+        self.training_loss = None
+        self.VaR0_in = None
+        self.VaR0_out = None
+        
+        # in-sample pass of the recursion, shared by predict, dq_test and plot_caviar
+        self.VaRs_in = None
+        self.residuals_in = None
+        self.hit_in = None
+        # digest of the series passed to fit, which the in-sample pass belongs to
+        self.returns_in_digest = None
+        
+        self.vc_matrix = None
+        self.D = None
+        self.gradient = None
+        self.beta_standard_errors = None
+        self.beta_pvals = None
+        
+        # online forecasting state, advanced by update
+        self.VaR_next = None
+        self.n_updates = 0
+        
+        # [{'phase', 'calls', 'seconds'}] of the last fit if profile is True
+        self.profile_phases = None
+    
+    def _is_in_sample(self, returns):
+        """
+        :param: returns (np.array): a series of returns, as converted by as_returns
+        :returns: whether the cached in-sample pass applies, i.e. returns is the series passed to fit
+        """
+        return (self.VaRs_in is not None and len(returns) == self.T
+                and returns_digest(returns) == self.returns_in_digest)
+    
     def get_empirical_quantile(self, returns, quantile, until_first=300):
         """
         :param: returns (array): a series of daily returns
@@ -89,47 +182,59 @@ class CaviarModel:
         :param: caviar (callable function): a CAVIAR function
         :return: quantile regression loss
         """
-        # VaR from day 0 to T+1
-        VaRs = caviar(returns, beta, quantile, VaR0, self.G)
-        residuals = returns - VaRs[:-1]
-        hit = self.quantile - (returns < VaRs[:-1])
-        T = len(returns)
-        return residuals @ hit / T
+        return rq_criterion(beta, returns, quantile, caviar, VaR0, self.G)
 
-    def fit(self, returns):
+    def fit(self, returns, initial_beta=None):
         """
-        :param: returns (array-like): a series of returns (100x)
+        :param: returns (array-like or str): a series of returns (100x). An array of dtype, e.g. a np.memmap, is
+                                             not copied; a path of a .npy or raw float64 file is memory-mapped.
+        :param: initial_beta (array-like): warm start, e.g. the beta of the previous window, or a (k, p) array
+                                           of starting betas. If given, the random-start search is skipped.
+                                           Default is None.
         """
+        returns = as_returns(returns, self.dtype)
         if len(returns) < 300:
             raise InputSizeError('The size of return array must not be less than 300.')
         
-        returns = np.array(returns)
-        if np.max(abs(returns)) < 1:
+        self._reset_fitted_state()
+        warn_float32_fit(self.dtype, self.model, self.quantile)
+        # max |return| without a temporary of the size of returns
+        if max(np.max(returns), -np.min(returns)) < 1:
             warnings.warn("The maximum absolute value is less than 1. Remember that the log return has to be multiplied by 100 before fitting")
         
+        s = perf_counter()
+        profiler = PhaseProfiler() if self.profile else None
+        # None unless a callback, the profiler, verbose or the "caviar" logger listens: then no record is built
+        sink = make_sink(self.callback, self.verbose, profiler)
+        
         # starting point VaR_0 = unconditional sampling quantile
-        self.VaR0_in = self.get_empirical_quantile(returns, self.quantile)
+        with phase(profiler, 'empirical_quantile'):
+            self.VaR0_in = self.get_empirical_quantile(returns, self.quantile)
         
         # select the CAViaR function
         # symmetric and igarch: 3 betas; asymmetric: 4 betas; adaptive: 1 beta
-        if self.model == 'adaptive':
-            self.caviar = adaptive
-        elif self.model == 'symmetric':
-            self.caviar = symmetric_abs_val
-        elif self.model == 'asymmetric':
-            self.caviar = asymmetric_slope
-        else:  # IGARCH
-            self.caviar = igarch
+        self.caviar = get_caviar_function(self.model, self.backend, self.dtype)
             
-        s = time()
+        o = perf_counter()
         if self.method == 'RQ':
             self.beta = rq_fit(returns,
                                self.model,
                                self.quantile,
                                self.caviar,
-                               self.obj,
+                               # not the bound self.obj: the starts may be pickled to other processes
+                               partial(rq_criterion, G=self.G),
                                self.tol,
-                               self.VaR0_in)
+                               self.VaR0_in,
+                               self.G,
+                               self.backend,
+                               self.n_jobs,
+                               self.jac,
+                               initial_beta=initial_beta,
+                               racing=self.racing,
+                               solver=self.solver,
+                               random_state=self.random_state,
+                               sink=sink,
+                               dtype=self.dtype)
 
         elif self.method == 'mle':
             self.beta = mle_fit(returns, 
@@ -137,31 +242,81 @@ class CaviarModel:
                                 self.quantile, 
                                 self.caviar,
                                 self.VaR0_in,
-                                self.G)
+                                self.G,
+                                self.profile_tau,
+                                self.max_attempts,
+                                self.timeout,
+                                self.random_state,
+                                self.n_jobs,
+                                initial_beta,
+                                sink,
+                                self.dtype,
+                                self.tol,
+                                self.jac,
+                                self.backend)
         
-        # print statistics
-        self.training_loss = self.obj(self.beta,
-                                      returns,
-                                      self.quantile,
-                                      self.caviar,
-                                      self.VaR0_in)
-                                      
-        print('Final loss:', self.training_loss)
+        optimize_seconds = perf_counter() - o
+        if profiler is not None:
+            # spent inside the starts above
+            profiler.add('obj', profiler.objective_seconds, profiler.objective_calls)
         
-        # To compute the variance and covariance matrix
-        self.T = len(returns)
-        VaRs = self.predict(returns, predict_mode='in')
-        self.VaR0_out = VaRs[-1]
+        # one pass of the recursion over the in-sample data, reused by every in-sample accessor
+        with phase(profiler, 'in-sample pass'):
+            self.T = len(returns)
+            self.returns_in_digest = returns_digest(returns)
+            self.VaRs_in = self.caviar(returns, self.beta, self.quantile, self.VaR0_in, self.G)
+            self.VaR0_out = self.VaRs_in[-1]
+            self.VaR_next = self.VaR0_out
+            self.residuals_in = returns - self.VaRs_in[:-1]
+            self.hit_in = hit_func(returns, self.VaRs_in[:-1], self.quantile)
+            
+            # print statistics
+            # same as self.obj: residuals @ (quantile - I(y < VaR)) / T
+            self.training_loss = - self.residuals_in @ self.hit_in / self.T
         
-        self.vc_matrix, self.D, self.gradient = variance_covariance(
-            self.beta, self.model, self.T, returns, self.quantile, VaRs[:-1], self.G
-        )
+        # To compute the variance and covariance matrix
+        c = perf_counter()
+        with phase(profiler, 'variance_covariance'):
+            self.vc_matrix, self.D, self.gradient = variance_covariance(
+                self.beta, self.model, self.T, returns, self.quantile, self.VaRs_in[:-1], self.G, self.backend,
+                self.residuals_in, self.dtype
+            )
         
         # To compute the standard errors of betas as well as the p values
-        self.beta_standard_errors, self.beta_pvals = compute_se_pval(self.beta, self.vc_matrix)
+        with phase(profiler, 'compute_se_pval'):
+            self.beta_standard_errors, self.beta_pvals = compute_se_pval(self.beta, self.vc_matrix)
+        
+        seconds = perf_counter() - s
+        if profiler is not None:
+            profiler.add('total', seconds)
+            self.profile_phases = profiler.phases
         
-        print(f'Time taken(s): {time() - s:.2f}')
+        report(sink, 'fit', model=self.model, method=self.method, quantile=self.quantile, T=self.T,
+               loss=self.training_loss, optimize_seconds=optimize_seconds, covariance_seconds=perf_counter() - c,
+               seconds=seconds)
         
+    def profile_report(self):
+        """
+        Wall time and call counts of every phase of the last fit, which must have been run with profile=True.
+        The obj row (RQ criterion or likelihood evaluations) is part of the optimize starts,
+        the other rows do not overlap.
+        
+        :returns: phases (pd.DataFrame): calls, seconds, seconds per call and share of the total, indexed by phase
+        """
+        if self.beta is None:
+            msg = ('This CaviarModel instance is not fitted yet. '
+                   'Call "fit" with appropriate arguments before using this estimator.')
+            raise NotFittedError(msg)
+        if self.profile_phases is None:
+            raise ValueError('This fit was not profiled. Set profile=True and call "fit" again.')
+        
+        import pandas as pd
+        
+        phases = pd.DataFrame(self.profile_phases).set_index('phase')
+        phases['seconds per call'] = phases['seconds'] / phases['calls'].where(phases['calls'] > 0)
+        phases['share'] = phases['seconds'] / phases.loc['total', 'seconds']
+        return phases
+    
     def beta_summary(self):
         """
         showing the pvalue and standard error of beta
@@ -172,6 +327,8 @@ class CaviarModel:
                    'Call "fit" with appropriate arguments before using this estimator.')
             raise NotFittedError(msg)
             
+        import pandas as pd
+        
         beta_df = pd.DataFrame({
             'coefficient': self.beta,
             'S.E. of beta': self.beta_standard_errors,
@@ -181,32 +338,155 @@ class CaviarModel:
         beta_df.index = [f'beta{i+1}' for i in range(len(self.beta))]
         return beta_df
         
-    def predict(self, returns, predict_mode='out'):
+    def predict(self, returns, predict_mode='out', out=None, chunk_size=2 ** 20):
         """
-        :param: returns (array-like): a series of returns
+        :param: returns (array-like or str): a series of returns, e.g. a np.memmap, or the path of a .npy or raw
+                                             float64 file, which is memory-mapped
         :param: predict_mode (str): either 'in' or 'out'
-        :param: VaR0 (float): Initial VaR0. Default is the VaR0 (out-of-samples)
-        :returns: negative VaRs (array-like): including the predicted realization and forecast
+        :param: out (np.array or str): if given, the VaRs are written into out, an array (e.g. a np.memmap) of
+                                       len(returns) + 1 or the path of a .npy (or raw float64) file to create,
+                                       chunk_size returns at a time, so memory does not grow with the length
+                                       of returns. Default is None.
+        :param: chunk_size (int): number of returns per chunk if out is given. With dtype "float32", every chunk
+                                  restarts from the float32 VaR, so the VaRs equal one pass up to float32 rounding.
+                                  Default is 2 ** 20.
+        :returns: negative VaRs (array-like of dtype): including the predicted realization and forecast; out if given
         """
         if self.beta is None:
             msg = ('This CaviarModel instance is not fitted yet. '
                    'Call "fit" with appropriate arguments before using this estimator.')
             raise NotFittedError(msg)
         
+        returns = as_returns(returns, self.dtype)
         if predict_mode == 'out':
             VaR0 = self.VaR0_out
         elif predict_mode == 'in':
+            if self.VaR0_in is None:
+                raise NotFittedError('This CaviarModel instance only holds a restored online state. '
+                                     'Call "fit" before predicting in sample.')
+            if self._is_in_sample(returns):
+                if out is None:
+                    return self.VaRs_in.copy()
+                out = open_output(out, self.T + 1)
+                out[:] = self.VaRs_in
+                return out
             VaR0 = self.VaR0_in
         else:
             raise ValueError("predict_mode either 'in' or 'out'")
-            
-        returns = np.array(returns)
-        VaRs = self.caviar(returns, self.beta, self.quantile, VaR0, self.G)
-        return VaRs
+        
+        if out is None:
+            return self.caviar(returns, self.beta, self.quantile, VaR0, self.G)
+        
+        out = open_output(out, len(returns) + 1)
+        # every chunk continues from the last VaR of the previous one, as update does
+        VaR = VaR0
+        for start in range(0, max(len(returns), 1), chunk_size):
+            VaRs = self.caviar(returns[start:start + chunk_size], self.beta, self.quantile, VaR, self.G)
+            if start == 0:
+                out[0] = VaRs[0]
+            out[start + 1:start + len(VaRs)] = VaRs[1:]
+            VaR = VaRs[-1]
+        if isinstance(out, np.memmap):
+            out.flush()
+        return out
+    
+    def update(self, new_returns):
+        """
+        Advance the online state by the newly observed returns, in constant time per return.
+        The first call after fit starts from VaR0_out, i.e. new_returns continue the in-sample data.
+        
+        :param: new_returns (float or array-like): return(s) observed since the last update
+        :returns: VaR forecast (float) of the period after the last new return
+        """
+        if self.beta is None:
+            msg = ('This CaviarModel instance is not fitted yet. '
+                   'Call "fit" with appropriate arguments before using this estimator.')
+            raise NotFittedError(msg)
+        
+        new_returns = np.atleast_1d(np.asarray(new_returns, dtype=np.float64))
+        if new_returns.shape[0] == 0:
+            return self.VaR_next
+        
+        # the caviar functions take the current VaR as VaR0 (igarch flips its sign back internally)
+        self.VaR_next = float(self.caviar(new_returns, self.beta, self.quantile, self.VaR_next, self.G)[-1])
+        self.n_updates += new_returns.shape[0]
+        return self.VaR_next
+    
+    def forecast(self):
+        """
+        :returns: VaR forecast (float) of the next period given everything passed to fit and update
+        """
+        if self.beta is None:
+            msg = ('This CaviarModel instance is not fitted yet. '
+                   'Call "fit" with appropriate arguments before using this estimator.')
+            raise NotFittedError(msg)
+        return self.VaR_next
+    
+    def get_online_state(self):
+        """
+        :returns: state (dict): JSON-serialisable state of update/forecast
+        """
+        if self.beta is None:
+            msg = ('This CaviarModel instance is not fitted yet. '
+                   'Call "fit" with appropriate arguments before using this estimator.')
+            raise NotFittedError(msg)
+        
+        return {
+            'model': self.model,
+            'quantile': self.quantile,
+            'G': self.G,
+            'beta': [float(b) for b in self.beta],
+            # igarch: the recursion runs on the positive root, the VaR is its negative if quantile < 0.5
+            'sign': -1 if (self.model == 'igarch' and self.quantile < 0.5) else 1,
+            'VaR_next': float(self.VaR_next),
+            'n_updates': int(self.n_updates),
+        }
+    
+    def set_online_state(self, state):
+        """
+        Restore the state of update/forecast, e.g. in another process. Only beta and the last VaR are needed,
+        so an unfitted instance with the same model and quantile can resume forecasting. On an unfitted instance,
+        predict(..., 'out') then continues from the restored forecast; the in-sample accessors still need fit.
+        
+        :param: state (dict): output of get_online_state
+        """
+        if state['model'] != self.model or state['quantile'] != self.quantile:
+            raise ValueError(f'The state belongs to a {state["model"]} model at quantile {state["quantile"]}, '
+                             f'not {self.model} at {self.quantile}.')
+        
+        self.beta = np.array(state['beta'])
+        self.G = state['G']
+        if self.caviar is None:
+            self.caviar = get_caviar_function(self.model, self.backend, self.dtype)
+        self.VaR_next = state['VaR_next']
+        self.n_updates = state['n_updates']
+        if self.VaR0_out is None:
+            self.VaR0_out = self.VaR_next
+        
+    def save(self, path):
+        """
+        Save the config and the fitted state (see caviar.save_models for several models in one file).
+        
+        :param: path (str): file path, e.g. "model.caviar"
+        """
+        save_models(path, self)
+    
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        :param: path (str): a file written by save
+        :param: mmap (bool): if True, large arrays such as gradient are memory-mapped instead of read.
+                             Default is True.
+        :returns: the saved CaviarModel
+        """
+        caviar_model = load_models(path, mmap)
+        if not isinstance(caviar_model, cls):
+            raise ValueError(f'{path} holds several models; use caviar.load_models.')
+        return caviar_model
         
     def dq_test(self, returns, test_mode):
         """
-        :param: returns (array-like): a series of returns
+        :param: returns (array-like or str): a series of returns, or the path of a .npy or raw float64 file
         :param: test_mode (str): either 'in' or 'out' => 'in samples' or 'out of samples'
         :returns: dq_test (callable): which gives the p-value of Dynamic Quantile test.
         """
@@ -214,8 +494,13 @@ class CaviarModel:
             msg = ('This CaviarModel instance is not fitted yet. '
                    'Call "fit" with appropriate arguments before using this estimator.')
             raise NotFittedError(msg)
-            
+        
+        returns = as_returns(returns, self.dtype)
         if test_mode == 'in':
+            # the in-sample VaR path, hits and residuals are cached by fit
+            if self._is_in_sample(returns):
+                return dq_test(True, self.model, returns, self.quantile, self.VaRs_in[:-1], self.D, self.gradient,
+                               self.T, self.LAGS, self.hit_in, self.residuals_in)
             VaRs = self.predict(returns, predict_mode='in')
             return dq_test(True, self.model, returns, self.quantile, VaRs[:-1], self.D, self.gradient, self.T, self.LAGS)
         elif test_mode == 'out':
@@ -239,16 +524,13 @@ class CaviarModel:
             x_axis = returns.index
         except:
             x_axis = None
-        returns = np.array(returns)
+        returns = as_returns(returns, self.dtype)
         
-        if mode == 'in':
-            VaR0 = self.VaR0_in
-        elif mode == 'out':
-            VaR0 = self.VaR0_out
-        else:
+        if mode not in ['in', 'out']:
             raise ValueError('mode must be either "in" or "out".')
         
-        VaRs = self.caviar(returns, self.beta, self.quantile, VaR0, self.G)
+        # the cached in-sample pass if returns is the fitted series; NotFittedError in sample for a restored state
+        VaRs = self.predict(returns, mode)
         plot_caviar(returns, VaRs[:-1], self.quantile, self.model, x_axis)
         
     def plot_news_impact_curve(self, VaR=-1.645):
@@ -2,15 +2,19 @@
 # Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
 
 import numpy as np
-from numpy.linalg import inv
-from scipy.stats import chi2, norm
+from numpy.linalg import solve
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.linalg import cho_factor, cho_solve
+# the distribution functions of scipy.special: scipy.stats takes about half a second to import
+from scipy.special import chdtrc, ndtr
+from ._kernels import caviar_gradient
 
 def compute_se_pval(beta, vc_matrix):
     """
     To compute the standard errors of betas as well as the p values
     """
     beta_standard_errors = np.diag(vc_matrix) ** 0.5
-    beta_pvals = norm.cdf(-abs(beta) / beta_standard_errors)
+    beta_pvals = ndtr(-abs(beta) / beta_standard_errors)
     return beta_standard_errors, beta_pvals
 
 def hit_func(returns, VaRs, quantile):
@@ -19,7 +23,7 @@ def hit_func(returns, VaRs, quantile):
     """
     return (returns < VaRs) - quantile
 
-def dq_test(in_sample_mode, model, returns, quantile, VaRs, D, gradient, in_T, LAGS=4):
+def dq_test(in_sample_mode, model, returns, quantile, VaRs, D, gradient, in_T, LAGS=4, hit=None, residuals=None):
     """
     Use Manganelli's matlab code as a reference
     
@@ -32,22 +36,28 @@ def dq_test(in_sample_mode, model, returns, quantile, VaRs, D, gradient, in_T, L
     :param: gradient (np.array): gradient vector for out-of-sample mode
     :param: in_T (int). Default is the size of training samples based on Rubia, A., & Sanchis-Marco, L. (2013)
     :param: LAGS (int). Default is 4.
+    :param: hit (np.array): hit_func(returns, VaRs, quantile) if already computed. Default is None.
+    :param: residuals (np.array): returns - VaRs if already computed. Default is None.
     """
     T = len(returns)
-    returns = np.array(returns)
-    hit = hit_func(returns, VaRs, quantile)
+    returns = np.asarray(returns)
+    if hit is None:
+        hit = hit_func(returns, VaRs, quantile)
     
     # Compute the quantile residuals
-    residuals = returns - VaRs
+    if residuals is None:
+        residuals = returns - VaRs
 
     # Set up the bandwidth for the KNN algorithm
-    sorted_result = np.sort(abs(residuals))
     # k = 40 if quantile == 0.01 else 60
     # following this approach:
     # Rubia, A., & Sanchis-Marco, L. (2013). On downside risk predictability through liquidity and trading activity: A dynamic quantile approach
     # k = int(np.sqrt(in_T))
     k = int(np.sqrt(T))
-    bandwidth = sorted_result[k]
+    abs_residuals = np.abs(residuals)
+    abs_residuals.partition(k)
+    bandwidth = float(abs_residuals[k])
+    del abs_residuals
     
     constant = np.ones(T - LAGS)
     HIT = hit[LAGS:]
@@ -59,36 +69,49 @@ def dq_test(in_sample_mode, model, returns, quantile, VaRs, D, gradient, in_T, L
     #      [ ...      ][ ...      ][ ... ][ ...      ]
     #      [ T-LAGS-1 ][ T-LAGS   ][ ... ][ T-2      ], where these are the indices
     
-    Z = np.zeros((T - LAGS, LAGS))
-    for i in range(LAGS):
-        Z[:, i] = hit[i:T-LAGS+i]
+    Z = sliding_window_view(hit[:T-1], LAGS)
     
     # estimate the matrices for in-sample DQ test
     if in_sample_mode:
         X_in = Z
-        XHNABLA = np.zeros((X_in.shape[1], gradient.shape[1]))
         NABLA = gradient[LAGS:, :]
-        for i in range(1, X_in.shape[0]):
-            if abs(residuals[i]) > bandwidth:
-                continue
-            XHNABLA += X_in[[i], :].T @ gradient[[i], :]
-    
-        XHNABLA = XHNABLA / (2 * bandwidth * T)
+        
+        # sum of X_in[i]' gradient[i] over the rows 1, ..., T-LAGS-1 within the bandwidth
+        n = X_in.shape[0]
+        within = np.flatnonzero(abs(residuals[1:n]) <= bandwidth) + 1
+        XHNABLA = X_in[within].T @ gradient[within] / (2 * bandwidth * T)
 
-        M = X_in.T - XHNABLA @ inv(D) @ NABLA.T
+        M = X_in.T - XHNABLA @ solve(D, NABLA.T)
 
         # compute the DQ tests
-        DQ_stat_in = HIT.T @ X_in @ inv(M @ M.T) @ X_in.T @ HIT / (quantile * (1 - quantile))
-        DQ_pval_in = chi2.sf(DQ_stat_in, df=X_in.shape[1])
+        XHIT = X_in.T @ HIT
+        DQ_stat_in = XHIT @ cho_solve(cho_factor(M @ M.T), XHIT) / (quantile * (1 - quantile))
+        DQ_pval_in = chdtrc(X_in.shape[1], DQ_stat_in)
         return DQ_pval_in 
         
     else:
         X_out = np.c_[constant, VaRs_forecast, Z]
-        DQ_stat_out = HIT.T @ X_out @ inv(X_out.T @ X_out) @ X_out.T @ HIT / (quantile * (1 - quantile))
-        DQ_pval_out = chi2.sf(DQ_stat_out, df=X_out.shape[1])
+        XHIT = X_out.T @ HIT
+        DQ_stat_out = XHIT @ cho_solve(cho_factor(X_out.T @ X_out), XHIT) / (quantile * (1 - quantile))
+        DQ_pval_out = chdtrc(X_out.shape[1], DQ_stat_out)
         return DQ_pval_out
 
-def variance_covariance(beta, model, T, returns, quantile, VaRs, G):
+def gram(X, chunk_size=2 ** 16):
+    """
+    :param: X (np.array): (T, p) matrix, e.g. the gradient
+    :param: chunk_size (int): rows cast to float64 at a time if X is float32. Default is 2 ** 16.
+    :returns: X' X accumulated in float64
+    """
+    if X.dtype == np.float64:
+        return X.T @ X
+    XX = np.zeros((X.shape[1], X.shape[1]))
+    for start in range(0, X.shape[0], chunk_size):
+        chunk = X[start:start + chunk_size].astype(np.float64)
+        XX += chunk.T @ chunk
+    return XX
+
+def variance_covariance(beta, model, T, returns, quantile, VaRs, G, backend='auto', residuals=None,
+                        dtype='float64'):
     """
     Use Manganelli's matlab code as a reference
     
@@ -99,118 +122,36 @@ def variance_covariance(beta, model, T, returns, quantile, VaRs, G):
     :param: quantile (float): fitted quantile
     :param: VaRs (np.array): estimated value at risk
     :param: G (positive integer): for the sigmoid function in the adaptive CAViaR model
+    :param: backend (str): kernel backend of the gradient recursion. Default is "auto".
+    :param: residuals (np.array): returns - VaRs if already computed. Default is None.
+    :param: dtype (str): "float64" or "float32", the dtype of the gradient. A and D are accumulated in float64.
+                         Default is "float64".
     """
     # Compute the quantile residuals
-    residuals = returns - VaRs
+    if residuals is None:
+        residuals = returns - VaRs
     
     # Set up the bandwidth for the KNN algorithm by Engle and  Manganelli (2004)
-    sorted_result = np.sort(abs(residuals))
     # k = 40 if quantile == 0.01 else 60
     # following this approach:
     # Rubia, A., & Sanchis-Marco, L. (2013). On downside risk predictability through liquidity and trading activity: A dynamic quantile approach
     k = int(np.sqrt(T))
-    bandwidth = sorted_result[k]
-    t = 0
-    
-    # initialize vectors
-    derivative1 = np.zeros((T, 1))
-    derivative2 = np.zeros((T, 1))
-    derivative3 = np.zeros((T, 1))
-    derivative4 = np.zeros((T, 1))
+    # one T-length buffer: partitioned in place for the bandwidth, then refilled for the mask
+    abs_residuals = np.abs(residuals)
+    abs_residuals.partition(k)
+    bandwidth = float(abs_residuals[k])
+    within = np.abs(residuals, out=abs_residuals) <= bandwidth
+    within[0] = False
+    del abs_residuals
     
-    D = np.zeros((beta.shape[0], beta.shape[0]))
-    A = np.copy(D)
+    # (T, p) gradient of VaR_t w.r.t. beta, the first row is zero
+    gradient = caviar_gradient(returns, beta, model, quantile, VaRs, G, backend, dtype)
     
-    if model == 'adaptive':
-        # f_t = f_t-1 + b1 * ([1 + exp(G * (y_t-1 - f_t-1))]^-1 - quantile)
-        gradient = np.zeros((T, beta.shape[0]))
-        for i in range(1, T):
-            # let sigmoid(x) = 1 / (1 + e^x)
-            # d(sigmoid(x)) / dbeta = (sigmoid(x) ** 2 - sigmoid(x)) * dx/dx
-            sigmoid = 1 / (1 + np.exp(G * (returns[i-1] - VaRs[i-1])))
-            derivative1[i] = derivative1[i-1] + (
-                (sigmoid - quantile) +
-                beta[0] * (sigmoid ** 2 - sigmoid) * G * (- derivative1[i-1])
-            )
-            
-            gradient[i, 0] = derivative1[i]
-            
-            A = A + gradient[[i], :].T @ gradient[[i], :]
-            
-            if abs(residuals[i]) <= bandwidth:
-                t += 1
-                D = D + gradient[[i], :].T @ gradient[[i], :]
+    # A = sum_t g_t g_t' and D = sum_{|residual_t| <= bandwidth} g_t g_t'
+    A = gram(gradient) / T
+    D = gram(gradient[within]) / (2 * bandwidth * T)
     
-    elif model == 'asymmetric':
-        # f_t = b1 + b2 * f_t-1 + b3 * max(y_t-1, 0) + b4 * min(y_t-1, 0)
-        gradient = np.zeros((T, beta.shape[0]))
-        for i in range(1, T):
-            derivative1[i] = 1 + beta[1] * derivative1[i-1]
-            derivative2[i] = VaRs[i-1] + beta[1] * derivative2[i-1]
-            derivative3[i] = max(returns[i-1], 0) + beta[1] * derivative3[i-1]
-            derivative4[i] = min(returns[i-1], 0) + beta[1] * derivative4[i-1]
-            
-            gradient[i, 0] = derivative1[i]
-            gradient[i, 1] = derivative2[i]
-            gradient[i, 2] = derivative3[i]
-            gradient[i, 3] = derivative4[i]
-            
-            A = A + gradient[[i], :].T @ gradient[[i], :] # this one should be a matrix
-            
-            if abs(residuals[i]) <= bandwidth:
-                t += 1
-                D = D + gradient[[i], :].T @ gradient[[i], :] # this one should be a matrix
-    
-    elif model == 'symmetric':
-        gradient = np.zeros((T, beta.shape[0]))
-        
-        for i in range(1, T):
-            derivative1[i] = 1 + beta[1] * derivative1[i-1]
-            derivative2[i] = VaRs[i-1] + beta[1] * derivative2[i-1]
-            derivative3[i] = abs(returns[i-1]) + beta[1] * derivative3[i-1]
-            
-            gradient[i, 0] = derivative1[i]
-            gradient[i, 1] = derivative2[i]
-            gradient[i, 2] = derivative3[i]
-            
-            A = A + gradient[[i], :].T @ gradient[[i], :] # this one should be a matrix
-            
-            if abs(residuals[i]) <= bandwidth:
-                t += 1
-                D = D + gradient[[i], :].T @ gradient[[i], :] # this one should be a matrix
-                
-    elif model == 'igarch':
-        # f_t = (b1 + b2 * f_t-1 ** 2 + b3 * y_t-1 ** 2) ** 0.5
-        gradient = np.zeros((T, beta.shape[0]))
-        
-        for i in range(1, T):
-            derivative1[i] = (
-                (1 + beta[1] * 2 * VaRs[i-1] * derivative1[i-1]) / (2 * VaRs[i])
-            )
-            derivative2[i] = (
-                (VaRs[i-1] ** 2 + beta[1] * 2 * VaRs[i-1] * derivative2[i-1]) / (2 * VaRs[i])
-            )
-            derivative3[i] = (
-                (returns[i-1] ** 2 + beta[1] * 2 * VaRs[i-1] * derivative3[i-1]) / (2 * VaRs[i])
-            )
-            
-            gradient[i, 0] = derivative1[i]
-            gradient[i, 1] = derivative2[i]
-            gradient[i, 2] = derivative3[i]
-            
-            A = A + gradient[[i], :].T @ gradient[[i], :] # this one should be a matrix
-            
-            if abs(residuals[i]) <= bandwidth:
-                t += 1
-                D = D + gradient[[i], :].T @ gradient[[i], :] # this one should be a matrix
-                
-    else:
-        raise ValueError('Wrong model!')
-        
-    t_std_err = t # check the bandwidth
-    A = A / T
-    D = D / (2 * bandwidth * T)
-
-    vc_matrix = (quantile * (1 - quantile) / T) * (inv(D) @ A @ inv(D))
+    # inv(D) @ A @ inv(D) without forming the inverse
+    vc_matrix = (quantile * (1 - quantile) / T) * solve(D, solve(D, A).T)
     
-    return vc_matrix, D, gradient
\ No newline at end of file
+    return vc_matrix, D, gradient
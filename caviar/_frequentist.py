@@ -2,50 +2,210 @@
 # Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
 
 import numpy as np
+from contextlib import ExitStack
+from functools import partial
 from scipy.optimize import minimize
+from time import perf_counter, time
+from ._exceptions import ConvergenceError
+from ._instrument import CountCalls, report
+from ._kernels import finite_difference_step, rq_loss_grad
+from ._parallel import check_random_state, effective_n_jobs, shared_returns_pool
 
 
-def mle_fit(returns, model, quantile, caviar, VaR0, G):
+def mle_fit(returns, model, quantile, caviar, VaR0, G, profile_tau=False, max_attempts=20, timeout=None,
+            random_state=None, n_jobs=1, initial_beta=None, sink=None, dtype='float64', tol=1e-10, jac=True,
+            backend='auto'):
     """
     :param: returns (array): a series of daily returns
     :param: model (str): Type of CAViaR model. Model must be one of {"adaptive", "symmetric", "asymmetric", "igarch"}.
     :param: quantile (float): a value between 0 and 1
     :param: caviar (callable function): a CAViaR function that returns VaR
     :param: VaR0 (float): initial estimate of VaR_0
+    :param: profile_tau (bool): if True, every start searches beta only, with tau replaced by its closed-form
+                                maximiser given beta. The start is the same beta as without profiling.
+                                Default is False.
+    :param: max_attempts (int): maximum number of random starts. Default is 20.
+    :param: timeout (float): wall-clock budget in seconds. Default is None (no deadline).
+    :param: random_state (None, int or np.random.Generator): source of the random starts.
+                                                             Default is None (global numpy RNG).
+    :param: n_jobs (int): number of starts run at once in worker processes. -1 means all cores.
+                          The first start with a finite likelihood is kept, in the order the starts were drawn,
+                          so the result does not depend on n_jobs (unless timeout cuts the search). Only the first
+                          finite start is used, so n_jobs > 1 saves wall time only when starts fail (NaN
+                          likelihood); if the first start succeeds, the other k - 1 are wasted. Default is 1.
+    :param: initial_beta (array-like): warm start tried before any random start, with tau at its closed form.
+                                       Default is None.
+    :param: sink (callable): receives an "mle_attempt" record per start, with its rounds, iterations,
+                             likelihood evaluations and seconds (see make_sink). Default is None (silent).
+    :param: dtype (str): "float64" or "float32", the dtype of the returns; caviar must match it.
+                         The check loss is summed in float64. Default is "float64".
+    :param: tol (float): with profile_tau, the profiled search stops once a round improves the profiled
+                         likelihood by less than tol. Default is 1e-10.
+    :param: jac (bool): with profile_tau, if True the profiled likelihood of the smoothed RQ criterion is
+                        minimized with its analytic gradient (one pass of the recursion per iteration),
+                        otherwise scipy finite-differences the profiled likelihood. Default is True.
+    :param: backend (str): kernel of the smoothed RQ criterion, see jac. Default is "auto".
     :returns: estimated beta
     """
     # compute the daily returns as 100 times the difference of the log of the prices.
-    returns = np.array(returns)
+    # no copy of an array of dtype, e.g. a np.memmap
+    returns = np.asarray(returns, dtype=dtype)
     
-    params, bounds = initiate_params(model)
+    rng = check_random_state(random_state)
+    deadline = None if timeout is None else time() + timeout
+    n_jobs = effective_n_jobs(n_jobs, max_attempts)
     
-    count = 0
+    loss_grad = None
+    if profile_tau and jac:
+        loss_grad = partial(rq_loss_grad, model=model, quantile=quantile, VaR0=VaR0, G=G, backend=backend,
+                            dtype=dtype)
+    options = (profile_tau, loss_grad, tol, quantile, caviar, VaR0, deadline)
+    
+    result = None
+    attempts = 0
+    with ExitStack() as stack:
+        pool_map = None
+        while attempts < max_attempts:
+            if deadline is not None and time() > deadline:
+                break
+            
+            # a batch of k random starts, each refined by up to 5 rounds of L-BFGS-B
+            if attempts == 0 and initial_beta is not None:
+                k = 1
+                tasks = [warm_start_params(initial_beta, model, returns, quantile, caviar, VaR0) + options]
+            else:
+                k = min(n_jobs, max_attempts - attempts)
+                tasks = [initiate_params(model, random_state=rng) + options for _ in range(k)]
+            if k > 1:
+                if pool_map is None:
+                    # started at the first parallel batch and kept for the following ones
+                    pool_map = stack.enter_context(shared_returns_pool(returns, n_jobs))
+                results = pool_map(_mle_attempt, tasks)
+            else:
+                results = [_mle_attempt(returns, *tasks[0])]
+            for i, (res, stats) in enumerate(results):
+                report(sink, 'mle_attempt', attempt=attempts + i + 1, nll=None if res is None else res.fun, **stats)
+            attempts += k
+            
+            # NaN likelihood means a bad start: draw new ones
+            results = [res for res, _ in results if res is not None]
+            if results:
+                # the first finite start, as a serial run would have stopped there
+                result = results[0]
+                break
+    
+    if result is None:
+        raise ConvergenceError(f'MLE did not reach a finite likelihood after {attempts} attempts '
+                               f'(max_attempts={max_attempts}, timeout={timeout}).')
+    
+    tau = result.x[0]
+    beta = result.x[1:]
+    return beta
+
+
+def _mle_attempt(returns, params, bounds, profile_tau, loss_grad, tol, quantile, caviar, VaR0, deadline):
+    """
+    :param: params (array): starting tau and beta
+    :param: profile_tau (bool): if True, only beta is searched from params[1:], on the profiled likelihood
+    :param: loss_grad (callable): with profile_tau, the smoothed RQ criterion and its gradient, or None to
+                                  finite-difference the profiled likelihood
+    :returns: scipy optimize result of one start (x = tau, beta), or None if the likelihood is NaN
+    :returns: stats (dict): rounds, iterations, likelihood evaluations and their seconds, and seconds of the start
+    """
+    s = perf_counter()
+    args = (returns, quantile, caviar, VaR0)
+    if not profile_tau:
+        func = CountCalls(neg_log_likelihood)
+        result, rounds, iterations = _mle_rounds(func, params, bounds, args, deadline)
+    elif loss_grad is None:
+        func = CountCalls(profile_neg_log_likelihood)
+        result, rounds, iterations = _mle_rounds(func, params[1:], bounds[1:], args, deadline)
+    else:
+        func = CountCalls(loss_grad)
+        result, rounds, iterations = _profile_rounds(func, params[1:], bounds[1:], tol, args, deadline)
+    if profile_tau and result is not None:
+        # the same optimum of the full likelihood: tau at its closed form, and -llh(beta, tau(beta)) = result.fun
+        tau = max(closed_form_tau(result.x, *args), bounds[0][0])
+        result.x = np.r_[tau, result.x]
+    
+    stats = {'rounds': rounds, 'iterations': iterations, 'evaluations': func.n_calls,
+             'objective_seconds': func.seconds, 'seconds': perf_counter() - s}
+    return result, stats
+
+
+def _mle_rounds(func, params, bounds, args, deadline):
+    """
+    up to 5 rounds of L-BFGS-B, each from the end of the previous one
+
+    :returns: scipy optimize result, or None if the likelihood is NaN
+    :returns: rounds (int), iterations (int)
+    """
+    rounds = iterations = 0
     while True:
         # scipy optimize default for bounds: method=L-BFGS-B
-        result = minimize(neg_log_likelihood, params,
-                          args=(returns, quantile, caviar, VaR0), bounds=bounds)
+        result = minimize(func, params, args=args, bounds=bounds,
+                          options={'eps': finite_difference_step(args[0].dtype)})
         
-        count += 1
+        rounds += 1
+        iterations += result.nit
         
         if np.isnan(result.fun):
-            # generate new starting point again
-            params, bounds = initiate_params(model)
-            count = 0
-            continue
+            return None, rounds, iterations
             
-        if result.success or count >= 5:
-            break
+        if result.success or rounds >= 5:
+            return result, rounds, iterations
+        
+        if deadline is not None and time() > deadline:
+            return result, rounds, iterations
         
         params = result.x
+
+
+def _profile_rounds(loss_grad, beta, bounds, tol, args, deadline):
+    """
+    up to 5 rounds of L-BFGS-B on the profiled likelihood of the smoothed RQ criterion, with its analytic
+    gradient, as optimize does for the RQ criterion; the stopping rule uses the exact profiled likelihood
+
+    :returns: scipy optimize result (fun = exact profiled likelihood), or None if the likelihood is NaN
+    :returns: rounds (int), iterations (int)
+    """
+    returns = args[0]
+    current_nll = profile_neg_log_likelihood(beta, *args)
+    rounds = iterations = 0
+    while True:
+        result = minimize(smoothed_profile_neg_log_likelihood, beta, args=(returns, loss_grad), jac=True,
+                          bounds=bounds, method='L-BFGS-B')
+        result.fun = profile_neg_log_likelihood(result.x, *args)
         
-    
-    params = result.x
-    tau = params[0]
-    beta = params[1:]
-    return beta
+        rounds += 1
+        iterations += result.nit
+        
+        if np.isnan(result.fun):
+            return None, rounds, iterations
+        
+        if current_nll - result.fun < tol or rounds >= 5:
+            return result, rounds, iterations
+        
+        if deadline is not None and time() > deadline:
+            return result, rounds, iterations
+        
+        current_nll = result.fun
+        beta = result.x
 
 
-def initiate_params(model):
+def warm_start_params(beta, model, returns, quantile, caviar, VaR0):
+    """
+    :param: beta (array-like): starting beta, e.g. the estimate of a previous window
+    :returns: parameters (tau at its closed form, beta), corresponding bounds for the parameters
+    """
+    _, bounds = initiate_params(model)
+    # a (k, p) array of warm starts: the MLE path only uses the first one
+    beta = np.atleast_2d(np.array(beta, dtype=np.float64))[0]
+    tau = max(closed_form_tau(beta, returns, quantile, caviar, VaR0), bounds[0][0])
+    return np.r_[tau, beta], bounds
+
+
+def initiate_params(model, random_state=None):
     """
     Generate the initial estimate of tau and beta.
     All three are mean-reverting in the sense that the coefficient on the lagged VaR is not constrained to be 1.
@@ -53,6 +213,7 @@ def initiate_params(model):
     β ∈ Rp
     
     :param: model (str): Type of CAViaR model. Model must be one of {"adaptive", "symmetric", "asymmetric", "igarch"}.
+    :param: random_state (None, int or np.random.Generator): Default is None (global numpy RNG).
     :returns: parameters, corresponding bounds for the parameters
     """
     if model == 'igarch':
@@ -70,11 +231,24 @@ def initiate_params(model):
 
     # number of parameters
     p = len(bounds)
-    params = np.random.uniform(0, 1, p)
+    params = check_random_state(random_state).uniform(0, 1, p)
 
     return params, bounds
 
 
+def check_loss_sum(beta, returns, quantile, caviar, VaR0):
+    """
+    :param: beta (array): a series of coefficients
+    :param: returns (array): a series of daily returns
+    :param: quantile (float): a value between 0 and 1
+    :param: caviar (callable function): a CAViaR function that returns VaR
+    :returns: sum over t = 1, ..., T-1 of the check loss max((quantile - 1) * u_t, quantile * u_t), u_t = y_t - VaR_t
+    """
+    VaRs = caviar(returns, beta, quantile, VaR0)
+    residuals = returns[1:] - VaRs[1:-1]
+    return np.maximum((quantile - 1) * residuals, quantile * residuals).sum(dtype=np.float64)
+
+
 def neg_log_likelihood(params, returns, quantile, caviar, VaR0):
     """
     :param: params (array): a series of tau and coefficients
@@ -88,11 +262,45 @@ def neg_log_likelihood(params, returns, quantile, caviar, VaR0):
     tau = params[0]
     beta = params[1:]
 
-    VaRs = caviar(returns, beta, quantile, VaR0)
-    
-    llh = (1 - T) * np.log(tau)
-    for t in range(1, T):
-        llh -= 1 / tau * max((quantile - 1) * (returns[t] - VaRs[t]),
-                             quantile * (returns[t] - VaRs[t]))
+    llh = (1 - T) * np.log(tau) - check_loss_sum(beta, returns, quantile, caviar, VaR0) / tau
 
     return -llh
+
+
+def closed_form_tau(beta, returns, quantile, caviar, VaR0):
+    """
+    maximiser of the asymmetric Laplace likelihood in tau for a fixed beta,
+    from d llh / d tau = (1 - T) / tau + S / tau^2 = 0
+
+    :returns: tau = S / (T - 1), S being the check loss sum
+    """
+    return check_loss_sum(beta, returns, quantile, caviar, VaR0) / (len(returns) - 1)
+
+
+def profile_neg_log_likelihood(beta, returns, quantile, caviar, VaR0):
+    """
+    negative log likelihood with tau profiled out,
+    -llh(beta, tau(beta)) = (T - 1) * (log(S / (T - 1)) + 1)
+
+    :param: beta (array): a series of coefficients
+    :param: returns (array): a series of daily returns
+    :param: quantile (float): a value between 0 and 1
+    :param: caviar (callable function): a CAViaR function that returns VaR
+    :returns: profiled negative log likelihood
+    """
+    n = len(returns) - 1
+    return n * (np.log(check_loss_sum(beta, returns, quantile, caviar, VaR0) / n) + 1)
+
+
+def smoothed_profile_neg_log_likelihood(beta, returns, loss_grad):
+    """
+    profile_neg_log_likelihood of the smoothed RQ criterion, up to a constant, and its gradient
+
+    :param: beta (array): a series of coefficients
+    :param: returns (array): a series of daily returns
+    :param: loss_grad (callable): loss_grad(beta, returns) -> smoothed RQ criterion and its gradient (rq_loss_grad)
+    :returns: (profiled negative log likelihood, gradient)
+    """
+    n = len(returns) - 1
+    loss, grad = loss_grad(beta, returns)
+    return n * np.log(loss), n * grad / loss
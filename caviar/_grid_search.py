@@ -0,0 +1,205 @@
+# Author: Lee Yat Shun, Jasper
+# Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
+
+import numpy as np
+from functools import partial
+from time import perf_counter
+from ._caviar_model import CaviarModel
+from ._exceptions import InputSizeError
+from ._instrument import make_sink, report
+from ._kernels import get_caviar_function, resolve_dtype, rq_loss_batch, warn_float32_fit
+from ._parallel import check_random_state, draw_entropy, effective_n_jobs, shared_returns_pool, spawn_seeds
+from ._quantreg import rq_criterion, rq_fit, search_size, select_best
+
+MODELS = ('adaptive', 'symmetric', 'asymmetric', 'igarch')
+METHODS = ('RQ', 'mle')
+COLUMNS = ['model', 'method', 'quantile', 'status', 'error', 'screen loss', 'loss (in)', 'loss (out)',
+           'hit rate (out)', 'DQ pval (out)', 'Kupiec pval (out)', 'beta', 'seconds']
+
+
+def grid_search(returns, test_size=250, models=MODELS, methods=METHODS, quantiles=(0.05,), cut_tol=0.1,
+                alpha=0.05, n_jobs=-1, **model_params):
+    """
+    Fit every combination of specification x method x quantile on the same returns and rank them
+    out of sample.
+
+    The returns are converted to one contiguous float64 buffer, shared by every worker of one process pool.
+    The search runs in two rounds:
+    1. screening: per specification, the random betas are scored at every quantile in one pass and the best one
+       is optimized. A specification whose screened loss is worse than the best one at the same quantile by
+       more than cut_tol (relative) has clearly lost and is not fitted.
+    2. fitting: the remaining combinations are fitted concurrently (RQ starts from the screened candidates)
+       and evaluated on the last test_size returns.
+
+    :param: returns (array-like): a series of returns (100x), in-sample followed by out-of-sample
+    :param: test_size (int or float): number (or fraction if < 1) of out-of-sample returns. Default is 250.
+    :param: models (iterable): specifications among {"adaptive", "symmetric", "asymmetric", "igarch"}. Default is all.
+    :param: methods (iterable): estimation methods among {"RQ", "mle"}. Default is both.
+    :param: quantiles (iterable): quantile values. Default is (0.05,).
+    :param: cut_tol (float): relative screening loss beyond which a specification is cut. None keeps all.
+                             Default is 0.1.
+    :param: alpha (float): significance level of the DQ and Kupiec tests. Default is 0.05.
+    :param: n_jobs (int): number of processes. -1 means all cores. Default is -1.
+    :param: model_params: passed to CaviarModel, e.g. G, tol, backend. A callback is not passed on: it receives
+                          a "combination" record per combination and a "grid" summary instead.
+    :returns: results (pd.DataFrame): one row per combination, ranked within each quantile: combinations
+                                      passing both tests first, then by out-of-sample RQ loss. Cut and failed
+                                      combinations are listed last with their status.
+    """
+    import pandas as pd
+
+    for model in models:
+        if model not in MODELS:
+            raise ValueError('Model must be one of {"adaptive", "symmetric", "asymmetric", "igarch"}')
+    for method in methods:
+        if method not in METHODS:
+            raise ValueError('Method must be either "RQ" or "mle".')
+
+    returns = np.ascontiguousarray(returns, dtype=np.float64)
+    if 0 < test_size < 1:
+        test_size = int(round(len(returns) * test_size))
+    in_size = len(returns) - test_size
+    if in_size < 300:
+        raise InputSizeError('The size of in-sample return array must not be less than 300.')
+    if test_size < 1:
+        raise ValueError('test_size must be positive.')
+
+    quantiles = sorted(quantiles)
+    G = model_params.get('G', 10)
+    tol = model_params.get('tol', 1e-10)
+    backend = model_params.get('backend', 'auto')
+    dtype = resolve_dtype(model_params.get('dtype', 'float64'))
+    jac = model_params.get('jac', True)
+    solver = model_params.get('solver', 'L-BFGS-B')
+    # the fits run in worker processes, whose warnings are not shown
+    for model in models:
+        for quantile in quantiles:
+            warn_float32_fit(dtype, model, quantile)
+    # one seed per task (see spawn_seeds)
+    n_combinations = len(models) * len(methods) * len(quantiles)
+    seeds = spawn_seeds(len(models) + n_combinations,
+                        draw_entropy(check_random_state(model_params.pop('random_state', None))))
+    screen_seeds, fit_seeds = seeds[:len(models)], seeds[len(models):]
+    sink = make_sink(model_params.pop('callback', None), model_params.get('verbose', False))
+    screen_tasks = [(in_size, model, quantiles, G, tol, backend, dtype, jac, solver, seed)
+                    for model, seed in zip(models, screen_seeds)]
+
+    s = perf_counter()
+    n_jobs = effective_n_jobs(n_jobs, n_combinations)
+    if n_jobs > 1:
+        with shared_returns_pool(returns, n_jobs) as pool_map:
+            screens = pool_map(_screen, screen_tasks)
+            fit_tasks, records = _plan_fits(models, methods, quantiles, screens, cut_tol, in_size, model_params,
+                                            fit_seeds)
+            fitted = pool_map(_fit_combination, fit_tasks)
+    else:
+        screens = [_screen(returns, *task) for task in screen_tasks]
+        fit_tasks, records = _plan_fits(models, methods, quantiles, screens, cut_tol, in_size, model_params,
+                                        fit_seeds)
+        fitted = [_fit_combination(returns, *task) for task in fit_tasks]
+    elapsed = perf_counter() - s
+
+    results = pd.DataFrame(records + fitted).reindex(columns=COLUMNS)
+    results['passed'] = (results['status'] == 'ok') & (results['DQ pval (out)'] > alpha) & \
+                        (results['Kupiec pval (out)'] > alpha)
+    results['fitted'] = results['status'] == 'ok'
+    results = results.sort_values(['quantile', 'fitted', 'passed', 'loss (out)', 'screen loss'],
+                                  ascending=[True, False, False, True, True], kind='stable')
+    results['rank'] = results.groupby('quantile').cumcount() + 1
+    results = results.drop(columns='fitted').set_index(['quantile', 'rank'])
+
+    if sink is not None:
+        for record in fitted:
+            report(sink, 'combination', model=record['model'], method=record['method'],
+                   quantile=record['quantile'], status=record['status'], loss=record.get('loss (out)'),
+                   seconds=record['seconds'])
+        report(sink, 'grid', fitted=len(fitted), cut=len(records), seconds=elapsed)
+    return results
+
+
+def _screen(returns, in_size, model, quantiles, G, tol, backend, dtype, jac, solver, seed):
+    """
+    Random-start search of one specification at every quantile, plus one optimization of its best start,
+    with the jac and solver of the fit.
+
+    :returns: list over quantiles of {'loss': screened loss, 'starts': m best candidates, the first one
+              replaced by its optimum so that the fit does not optimize it again}
+    """
+    returns = returns[:in_size].astype(dtype, copy=False)
+    caviar = get_caviar_function(model, backend, dtype)
+    VaR0s = np.quantile(returns[:300], quantiles)
+
+    # every candidate is scored at every quantile in one pass over the returns
+    n, m, p = search_size(model)
+    random_betas = np.random.default_rng(seed).uniform(0, 1, (n, p))
+    losses = rq_loss_batch(returns, random_betas, model, quantiles, VaR0s, G, backend, dtype=dtype)
+
+    # the lp solver only supports the linear specifications; the fit of the others fails with it anyway
+    if model not in ['symmetric', 'asymmetric']:
+        solver = 'L-BFGS-B'
+    screens = []
+    for quantile, VaR0, quantile_losses in zip(quantiles, VaR0s, losses):
+        obj = partial(rq_criterion, G=G)
+        starts = np.array([candidate['beta'] for candidate in select_best(random_betas, quantile_losses, m)])
+        beta = rq_fit(returns, model, quantile, caviar, obj, tol, VaR0, G, backend, jac=jac, initial_beta=starts[0],
+                      solver=solver, dtype=dtype)
+        starts[0] = beta
+        screens.append({'loss': obj(beta, returns, quantile, caviar, VaR0), 'starts': starts})
+    return screens
+
+
+def _plan_fits(models, methods, quantiles, screens, cut_tol, in_size, model_params, seeds):
+    """
+    :param: seeds (list of int): random_state of every combination
+    :returns: fit_tasks (list of tuple): arguments of _fit_combination for the surviving combinations
+    :returns: records (list of dict): one record per combination cut after screening
+    """
+    fit_tasks, records = [], []
+    seeds = iter(seeds)
+    for i, quantile in enumerate(quantiles):
+        screened = np.array([screen[i]['loss'] for screen in screens])
+        best = np.nanmin(screened)
+        for model, screen, loss in zip(models, screens, screened):
+            cut = cut_tol is not None and not loss <= best * (1 + cut_tol)
+            for method in methods:
+                seed = next(seeds)
+                if cut:
+                    records.append({'model': model, 'method': method, 'quantile': quantile, 'status': 'cut',
+                                    'screen loss': loss})
+                else:
+                    starts = screen[i]['starts'] if method == 'RQ' else None
+                    fit_tasks.append((in_size, model, method, quantile, loss, starts,
+                                      dict(model_params, random_state=seed)))
+    return fit_tasks, records
+
+
+def _fit_combination(returns, in_size, model, method, quantile, screen_loss, starts, model_params):
+    """
+    Fit one combination on the in-sample returns and evaluate it on the rest.
+
+    :returns: record (dict); never raises
+    """
+    # var_tests imports pandas and scipy.stats, which import caviar does not pay for
+    from var_tests import kupiec_pof_test
+
+    in_samples, out_of_samples = returns[:in_size], returns[in_size:]
+    record = {'model': model, 'method': method, 'quantile': quantile, 'status': 'ok', 'screen loss': screen_loss}
+
+    s = perf_counter()
+    try:
+        caviar_model = CaviarModel(quantile, model, method, **model_params)
+        caviar_model.fit(in_samples, initial_beta=starts)
+        VaRs = caviar_model.predict(out_of_samples, 'out')[:-1]
+        residuals = out_of_samples - VaRs
+        record['loss (in)'] = caviar_model.training_loss
+        record['loss (out)'] = residuals @ (quantile - (out_of_samples < VaRs)) / len(out_of_samples)
+        record['hit rate (out)'] = np.mean(out_of_samples < VaRs)
+        record['DQ pval (out)'] = caviar_model.dq_test(out_of_samples, 'out')
+        record['Kupiec pval (out)'] = kupiec_pof_test(out_of_samples, VaRs, quantile)
+        record['beta'] = caviar_model.beta
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = f'{type(e).__name__}: {e}'
+
+    record['seconds'] = perf_counter() - s
+    return record
@@ -0,0 +1,160 @@
+# Author: Lee Yat Shun, Jasper
+# Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
+
+import logging
+import numpy as np
+from contextlib import contextmanager
+from time import perf_counter
+
+# silent unless the application configures logging, e.g. logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('caviar')
+logger.addHandler(logging.NullHandler())
+
+# per-start and per-iteration records are logged at DEBUG, the summaries at INFO
+DEBUG_EVENTS = {'update', 'start', 'race_round', 'mle_attempt', 'ticker', 'combination'}
+
+
+def make_sink(callback=None, verbose=False, profiler=None):
+    """
+    :param: callback (callable): called with every record (dict). Default is None.
+    :param: verbose (bool): if True, every record is also printed. Default is False.
+    :param: profiler (PhaseProfiler): also called with every record. Default is None.
+    :returns: sink(record), or None if no callback, no profiler, no printing and the "caviar" logger is disabled,
+              in which case no record is built at all
+    """
+    if callback is None and profiler is None and not verbose and not logger.isEnabledFor(logging.INFO):
+        return None
+
+    def sink(record):
+        if profiler is not None:
+            profiler(record)
+        if callback is not None:
+            callback(record)
+        if verbose:
+            print(format_record(record))
+        level = logging.DEBUG if record['event'] in DEBUG_EVENTS else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, format_record(record), extra={'caviar_record': record})
+    return sink
+
+
+def report(sink, event, **fields):
+    """
+    :param: sink (callable): from make_sink, or None
+    :param: event (str): kind of record, e.g. "start" or "fit"
+    :param: fields: content of the record
+    """
+    if sink is not None:
+        sink(dict(event=event, **fields))
+
+
+def tag(sink, **fields):
+    """
+    :returns: a sink adding fields (e.g. the index of the start) to every record before passing it on
+    """
+    if sink is None:
+        return None
+    return lambda record: sink(dict(record, **fields))
+
+
+def format_record(record):
+    """
+    :returns: one line, e.g. "start: start=1, loss=0.1234, seconds=0.05"
+    """
+    fields = []
+    for name, value in record.items():
+        if name == 'event':
+            continue
+        if isinstance(value, (float, np.floating)):
+            value = f'{value:.6g}'
+        elif isinstance(value, np.ndarray):
+            value = np.array2string(value, precision=4)
+        fields.append(f'{name}={value}')
+    return f"{record['event']}: " + ', '.join(fields)
+
+
+class CountCalls:
+    """counts the calls of an objective and the seconds spent in them"""
+    def __init__(self, func):
+        self.func = func
+        self.n_calls = 0
+        self.seconds = 0.
+
+    def __call__(self, *args, **kwargs):
+        s = perf_counter()
+        result = self.func(*args, **kwargs)
+        self.seconds += perf_counter() - s
+        self.n_calls += 1
+        return result
+
+
+class PhaseProfiler:
+    def __init__(self):
+        """
+        Wall time and call counts per phase of one fit. The phases inside the optimizer (the search and every
+        start) are read from the records of the fit, the others are timed with phase.
+        """
+        self.phases = []
+        self.objective_calls = 0
+        self.objective_seconds = 0.
+
+    def add(self, phase, seconds, calls=1):
+        self.phases.append({'phase': phase, 'calls': calls, 'seconds': seconds})
+
+    def __call__(self, record):
+        event = record['event']
+        if event == 'search':
+            self.add('initialize_betas', record['seconds'])
+        elif event == 'race_round':
+            self.add(f"race round of {record['starts']} starts", record['seconds'], record['starts'])
+        elif event == 'start':
+            self.add(f"optimize start {record['start']}", record['seconds'], record['updates'])
+        elif event == 'mle_attempt':
+            self.add(f"mle attempt {record['attempt']}", record['seconds'], record['rounds'])
+        if event in ['race_round', 'start', 'mle_attempt']:
+            self.objective_calls += record['evaluations']
+            self.objective_seconds += record['objective_seconds']
+
+
+@contextmanager
+def phase(profiler, name):
+    """
+    time the body as phase name of profiler; does nothing if profiler is None
+    """
+    if profiler is None:
+        yield
+        return
+    s = perf_counter()
+    yield
+    profiler.add(name, perf_counter() - s)
+
+
+class FitRecorder:
+    def __init__(self, events=None):
+        """
+        Callback collecting the records of one or several fits, e.g. CaviarModel(callback=FitRecorder()).
+
+        :param: events (iterable): kinds of records to keep, e.g. {"start", "fit"}. Default is None (all).
+        """
+        self.events = None if events is None else set(events)
+        self.records = []
+
+    def __repr__(self):
+        return f"FitRecorder(events={self.events}, n_records={len(self.records)})"
+
+    def __call__(self, record):
+        if self.events is None or record['event'] in self.events:
+            self.records.append(record)
+
+    def to_frame(self, event=None):
+        """
+        :param: event (str): only the records of this kind. Default is None (all).
+        :returns: records (pd.DataFrame): one row per record
+        """
+        import pandas as pd
+
+        records = self.records if event is None else [r for r in self.records if r['event'] == event]
+        return pd.DataFrame(records)
+
+    def clear(self):
+        self.records = []
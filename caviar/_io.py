@@ -0,0 +1,164 @@
+# Author: Lee Yat Shun, Jasper
+# Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
+
+import os
+import json
+import hashlib
+import numpy as np
+from ._kernels import get_caviar_function, resolve_backend
+
+# file layout: MAGIC | header length (uint64, little endian) | JSON header | arrays, each 64-byte aligned
+MAGIC = b'CAVIAR\x00\x01'
+ALIGNMENT = 64
+# arrays from this size on (the (T, p) gradient and the in-sample paths) are memory-mapped on load
+MMAP_MIN_BYTES = 4096
+
+
+def save_models(path, models):
+    """
+    Save one or several CaviarModels in one file: a JSON header with the config and scalar results,
+    followed by the raw arrays (beta, vc_matrix, D, gradient, in-sample VaRs, ...).
+    The phase timings of profile=True (profile_phases) are kept in the JSON header.
+    The caviar function is not saved; it is restored from the model name and backend (the numpy kernels if the
+    file was saved with numba and is loaded where numba is not installed). The callback is not saved.
+
+    :param: path (str): file path, e.g. "book.caviar"
+    :param: models (CaviarModel or dict): a model, or {name: model}
+    """
+    single = not isinstance(models, dict)
+    items = [('model', models)] if single else list(models.items())
+
+    entries, arrays, offset = [], [], 0
+    for name, caviar_model in items:
+        entry = {'name': str(name), 'class': type(caviar_model).__name__, 'scalars': {}, 'arrays': {}}
+        for attr, value in caviar_model.__dict__.items():
+            if attr in ('caviar', 'callback'):
+                continue
+            if isinstance(value, np.ndarray):
+                value = np.ascontiguousarray(value)
+                offset = -(-offset // ALIGNMENT) * ALIGNMENT
+                entry['arrays'][attr] = {'offset': offset, 'shape': list(value.shape), 'dtype': value.dtype.str}
+                arrays.append((offset, value))
+                offset += value.nbytes
+            elif isinstance(value, np.generic):
+                entry['scalars'][attr] = value.item()
+            elif value is None or isinstance(value, (bool, int, float, str)):
+                entry['scalars'][attr] = value
+            elif attr == 'profile_phases':
+                # [{'phase', 'calls', 'seconds'}]: the counts may be numpy integers
+                entry['scalars'][attr] = [{key: item.item() if isinstance(item, np.generic) else item
+                                           for key, item in row.items()} for row in value]
+            else:
+                # e.g. a np.random.Generator as random_state: not reproducible from a file
+                entry['scalars'][attr] = None
+        entries.append(entry)
+
+    header = json.dumps({'single': single, 'models': entries}).encode()
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    # write then rename: the arrays of a loaded model may be memory-mapped from path itself
+    tmp_path = os.fspath(path) + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(np.uint64(len(header)).tobytes())
+            f.write(header)
+            for array_offset, value in arrays:
+                f.seek(start + array_offset)
+                f.write(value.tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_models(path, mmap=True):
+    """
+    :param: path (str): a file written by save_models
+    :param: mmap (bool): if True, large arrays (e.g. gradient) are memory-mapped read-only and only read from disk
+                         when used, otherwise they are read into memory. Default is True.
+    :returns: a CaviarModel, or {name: CaviarModel} if a dict was saved
+    """
+    from ._caviar_model import CaviarModel
+
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a saved CaviarModel file.')
+        header_size = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(header_size))
+    start = -(-(len(MAGIC) + 8 + header_size) // ALIGNMENT) * ALIGNMENT
+
+    models = {}
+    for entry in header['models']:
+        if entry['class'] != CaviarModel.__name__:
+            raise ValueError(f'Unknown model class {entry["class"]}.')
+        caviar_model = CaviarModel.__new__(CaviarModel)
+        caviar_model.callback = None
+        caviar_model.__dict__.update(entry['scalars'])
+        for attr, spec in entry['arrays'].items():
+            dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+            if mmap and int(np.prod(shape)) * dtype.itemsize >= MMAP_MIN_BYTES:
+                value = np.memmap(path, dtype=dtype, mode='r', offset=start + spec['offset'], shape=shape)
+            else:
+                value = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)),
+                                    offset=start + spec['offset']).reshape(shape)
+            setattr(caviar_model, attr, value)
+        try:
+            resolve_backend(caviar_model.backend)
+        except ImportError:
+            # saved where numba is installed (the resolved backend of "auto"): the other kernels give the same VaRs
+            caviar_model.backend = resolve_backend('auto')
+        caviar_model.caviar = None if caviar_model.beta is None else \
+            get_caviar_function(caviar_model.model, caviar_model.backend, caviar_model.dtype)
+        models[entry['name']] = caviar_model
+
+    if header['single']:
+        return models['model']
+    return models
+
+
+def as_returns(returns, dtype='float64'):
+    """
+    :param: returns (array-like or str): a series of returns, or the path of a .npy file or of a raw float64 file
+                                         (native byte order), which is memory-mapped read-only
+    :param: dtype (str): "float64" or "float32". Default is "float64".
+    :returns: a one-dimensional array of dtype; an array of dtype (e.g. a np.memmap) or pd.Series is not copied
+    """
+    if isinstance(returns, (str, os.PathLike)):
+        path = os.fspath(returns)
+        if path.endswith('.npy'):
+            returns = np.load(path, mmap_mode='r')
+        else:
+            returns = np.memmap(path, dtype=np.float64, mode='r')
+    returns = np.asarray(returns, dtype=dtype)
+    if returns.ndim != 1:
+        raise ValueError('returns must be a one-dimensional series.')
+    return returns
+
+
+def returns_digest(returns):
+    """
+    :param: returns (np.array): a one-dimensional array, e.g. from as_returns
+    :returns: hex digest of the dtype and the buffer of returns (str), hashed without a copy if contiguous
+    """
+    digest = hashlib.blake2b(returns.dtype.str.encode(), digest_size=16)
+    digest.update(np.ascontiguousarray(returns).data)
+    return digest.hexdigest()
+
+
+def open_output(out, length):
+    """
+    :param: out (np.array or str): an array of length, or the path of a file to create: a .npy file if the
+                                   path ends with .npy, otherwise a raw float64 file
+    :returns: a writable float64 array of length (a np.memmap if out is a path)
+    """
+    if isinstance(out, (str, os.PathLike)):
+        path = os.fspath(out)
+        if path.endswith('.npy'):
+            return np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=(length,))
+        return np.memmap(path, dtype=np.float64, mode='w+', shape=(length,))
+    if out.shape != (length,):
+        raise ValueError(f'out must have shape ({length},), got {out.shape}.')
+    return out
@@ -0,0 +1,661 @@
+# Author: Lee Yat Shun, Jasper
+# Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
+
+import math
+import warnings
+import numpy as np
+from functools import partial
+from . import _caviar_function
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:  # numba is optional
+    njit = None
+    HAS_NUMBA = False
+
+BACKENDS = ['auto', 'numba', 'numpy', 'python']
+DTYPES = ['float64', 'float32']
+
+
+def _as_float_array(returns, dtype=np.float64):
+    """
+    :param: returns (array-like): a series of returns
+    :param: dtype (str or np.dtype): float64 or float32. Default is float64.
+    :returns: a contiguous array of dtype (no copy if already contiguous of dtype)
+    """
+    return np.ascontiguousarray(returns, dtype=dtype)
+
+
+def resolve_dtype(dtype):
+    """
+    :param: dtype (str or np.dtype): float64 or float32
+    :returns: the dtype name, "float64" or "float32"
+    """
+    try:
+        name = np.dtype(dtype).name
+    except TypeError:
+        name = None
+    if name not in DTYPES:
+        raise ValueError('dtype must be either "float64" or "float32".')
+    return name
+
+
+def warn_float32_fit(dtype, model, quantile):
+    """
+    Warn if a fit in float32 is likely to end far from the float64 one: on the paper's series, the adaptive and
+    symmetric specifications at the 1% level landed in another minimum (benchmarks/bench_dtype.py).
+
+    :param: dtype (str): "float64" or "float32"
+    :param: model (str): one of CAViaR models
+    :param: quantile (float): a value between 0 and 1
+    """
+    if resolve_dtype(dtype) == 'float32' and model in ('adaptive', 'symmetric') \
+            and (quantile <= 0.01 or quantile >= 0.99):
+        warnings.warn(f'A float32 fit of the {model} model at the {quantile} quantile can end far from the '
+                      f'float64 fit. Fit with dtype="float64" unless you have compared both on your data.')
+
+
+def finite_difference_step(dtype):
+    """
+    :param: dtype (str or np.dtype): dtype of the returns the criterion is computed on
+    :returns: eps option of L-BFGS-B: scipy's default 1e-8 for float64, 1e-5 for float32, as smaller steps
+              change a float32 criterion by less than its rounding while larger ones smooth over the kinks of the
+              check loss (1e-5 came closest to the float64 fits on the paper's series)
+    """
+    if resolve_dtype(dtype) == 'float64':
+        return 1e-8
+    return 1e-5
+
+
+# ------------------------------------------------------------------
+# numpy backend
+# the linear specifications are first order linear filters
+#     f_t = b2 * f_t-1 + x_t-1,
+# so they are solved by scipy.signal.lfilter in compiled code, in the
+# precision of x. the non-linear ones (adaptive, igarch) loop over python
+# floats which is an order of magnitude faster than indexing numpy scalars.
+# the floats are taken LOOP_CHUNK at a time: a python float list costs about
+# 32 bytes per value, so a list of the whole series would not stay bounded
+# for a memory-mapped one.
+# ------------------------------------------------------------------
+
+LOOP_CHUNK = 2 ** 16
+
+
+def _iter_floats(x):
+    """yields the elements of x as python floats, converted LOOP_CHUNK at a time"""
+    for start in range(0, x.shape[0], LOOP_CHUNK):
+        yield from x[start:start + LOOP_CHUNK].tolist()
+
+def _first_order_filter(x, b2, axis=-1, zi=None):
+    """
+    :returns: y_t = b2 * y_t-1 + x_t by lfilter, computed in the dtype of x (and zf if zi is given)
+    """
+    # scipy.signal costs about half a second to import and only the numpy backend needs it
+    from scipy.signal import lfilter
+    
+    b, a = np.ones(1, x.dtype), np.array([1., -b2], x.dtype)
+    if zi is None:
+        return lfilter(b, a, x, axis=axis)
+    return lfilter(b, a, x, axis=axis, zi=np.asarray(zi, x.dtype))
+
+
+def _linear_filter(x, b2, VaR0):
+    """
+    :param: x (np.array): the exogenous part of the recursion from day 0 to T
+    :param: b2 (float): coefficient of the lagged VaR
+    :param: VaR0 (float): initial VaR
+    :returns: VaR from day 0 to day T + 1, of the dtype of x
+    """
+    VaRs = np.empty(x.shape[0] + 1, x.dtype)
+    VaRs[0] = VaR0
+    VaRs[1:], _ = _first_order_filter(x, b2, zi=[b2 * VaR0])
+    return VaRs
+
+
+def _sigmoid(x):
+    """1 / (1 + e^x) without raising OverflowError"""
+    return 0. if x > 709. else 1 / (1 + math.exp(x))
+
+
+def adaptive_numpy(returns, beta, quantile, VaR0, G=10, dtype=np.float64):
+    returns = _as_float_array(returns, dtype)
+    b1 = float(beta[0])
+    VaR = float(VaR0)
+
+    VaRs = np.empty(returns.shape[0] + 1, dtype)
+    VaRs[0] = VaR
+    for start in range(0, returns.shape[0], LOOP_CHUNK):
+        chunk = []
+        for r in returns[start:start + LOOP_CHUNK].tolist():
+            VaR = VaR + b1 * (_sigmoid(G * (r - VaR)) - quantile)
+            chunk.append(VaR)
+        VaRs[start + 1:start + 1 + len(chunk)] = chunk
+    return VaRs
+
+
+def symmetric_abs_val_numpy(returns, beta, quantile, VaR0, G=0, dtype=np.float64):
+    returns = _as_float_array(returns, dtype)
+    b1, b2, b3 = (float(b) for b in beta)
+    return _linear_filter(b1 + b3 * np.abs(returns), b2, VaR0)
+
+
+def asymmetric_slope_numpy(returns, beta, quantile, VaR0, G=0, dtype=np.float64):
+    returns = _as_float_array(returns, dtype)
+    b1, b2, b3, b4 = (float(b) for b in beta)
+    x = b1 + b3 * np.maximum(returns, 0) + b4 * np.minimum(returns, 0)
+    return _linear_filter(x, b2, VaR0)
+
+
+def igarch_numpy(returns, beta, quantile, VaR0, G=0, dtype=np.float64):
+    returns = _as_float_array(returns, dtype)
+    b1, b2, b3 = (float(b) for b in beta)
+    VaR = - float(VaR0)
+
+    sqrt = math.sqrt
+    VaRs = np.empty(returns.shape[0] + 1, dtype)
+    VaRs[0] = VaR
+    for start in range(0, returns.shape[0], LOOP_CHUNK):
+        chunk = []
+        for news in (b3 * returns[start:start + LOOP_CHUNK] ** 2).tolist():
+            v = b1 + b2 * (VaR * VaR) + news
+            VaR = sqrt(v) if v >= 0 else math.nan
+            chunk.append(VaR)
+        VaRs[start + 1:start + 1 + len(chunk)] = chunk
+
+    if quantile < 0.5:
+        VaRs *= -1
+    return VaRs
+
+
+# ------------------------------------------------------------------
+# numba backend
+# same recursions as _caviar_function, compiled on first use for each
+# dtype of returns. the VaR is carried in a float64 register and only
+# stored in that dtype: a float32 round trip on every step would lengthen
+# the dependency chain of the recursion.
+# ------------------------------------------------------------------
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _adaptive_kernel(returns, b1, quantile, VaR0, G):
+        VaRs = np.empty(returns.shape[0] + 1, returns.dtype)
+        VaR = VaR0
+        VaRs[0] = VaR
+        for t in range(returns.shape[0]):
+            VaR = VaR + b1 * (1 / (1 + np.exp(G * (returns[t] - VaR))) - quantile)
+            VaRs[t + 1] = VaR
+        return VaRs
+
+    @njit(cache=True)
+    def _symmetric_abs_val_kernel(returns, b1, b2, b3, VaR0):
+        VaRs = np.empty(returns.shape[0] + 1, returns.dtype)
+        VaR = VaR0
+        VaRs[0] = VaR
+        for t in range(returns.shape[0]):
+            VaR = b1 + b2 * VaR + b3 * abs(returns[t])
+            VaRs[t + 1] = VaR
+        return VaRs
+
+    @njit(cache=True)
+    def _asymmetric_slope_kernel(returns, b1, b2, b3, b4, VaR0):
+        VaRs = np.empty(returns.shape[0] + 1, returns.dtype)
+        VaR = VaR0
+        VaRs[0] = VaR
+        for t in range(returns.shape[0]):
+            VaR = b1 + b2 * VaR + b3 * max(returns[t], 0.) + b4 * min(returns[t], 0.)
+            VaRs[t + 1] = VaR
+        return VaRs
+
+    @njit(cache=True)
+    def _igarch_kernel(returns, b1, b2, b3, quantile, VaR0):
+        VaRs = np.empty(returns.shape[0] + 1, returns.dtype)
+        VaR = - VaR0
+        VaRs[0] = VaR
+        for t in range(returns.shape[0]):
+            VaR = (b1 + b2 * VaR ** 2 + b3 * returns[t] ** 2) ** 0.5
+            VaRs[t + 1] = VaR
+        if quantile < 0.5:
+            VaRs *= -1
+        return VaRs
+
+    def adaptive_numba(returns, beta, quantile, VaR0, G=10, dtype=np.float64):
+        return _adaptive_kernel(_as_float_array(returns, dtype), float(beta[0]),
+                                float(quantile), float(VaR0), float(G))
+
+    def symmetric_abs_val_numba(returns, beta, quantile, VaR0, G=0, dtype=np.float64):
+        b1, b2, b3 = (float(b) for b in beta)
+        return _symmetric_abs_val_kernel(_as_float_array(returns, dtype), b1, b2, b3, float(VaR0))
+
+    def asymmetric_slope_numba(returns, beta, quantile, VaR0, G=0, dtype=np.float64):
+        b1, b2, b3, b4 = (float(b) for b in beta)
+        return _asymmetric_slope_kernel(_as_float_array(returns, dtype), b1, b2, b3, b4, float(VaR0))
+
+    def igarch_numba(returns, beta, quantile, VaR0, G=0, dtype=np.float64):
+        b1, b2, b3 = (float(b) for b in beta)
+        return _igarch_kernel(_as_float_array(returns, dtype), b1, b2, b3, float(quantile), float(VaR0))
+
+
+_CAVIAR_FUNCTIONS = {
+    'python': {
+        'adaptive': _caviar_function.adaptive,
+        'symmetric': _caviar_function.symmetric_abs_val,
+        'asymmetric': _caviar_function.asymmetric_slope,
+        'igarch': _caviar_function.igarch,
+    },
+    'numpy': {
+        'adaptive': adaptive_numpy,
+        'symmetric': symmetric_abs_val_numpy,
+        'asymmetric': asymmetric_slope_numpy,
+        'igarch': igarch_numpy,
+    },
+}
+
+if HAS_NUMBA:
+    _CAVIAR_FUNCTIONS['numba'] = {
+        'adaptive': adaptive_numba,
+        'symmetric': symmetric_abs_val_numba,
+        'asymmetric': asymmetric_slope_numba,
+        'igarch': igarch_numba,
+    }
+
+
+def resolve_backend(backend):
+    """
+    :param: backend (str): one of {"auto", "numba", "numpy", "python"}
+    :returns: the concrete backend name. "auto" picks numba when it is installed, otherwise numpy.
+    """
+    if backend not in BACKENDS:
+        raise ValueError('Backend must be one of {"auto", "numba", "numpy", "python"}')
+    if backend == 'auto':
+        return 'numba' if HAS_NUMBA else 'numpy'
+    if backend == 'numba' and not HAS_NUMBA:
+        raise ImportError('backend="numba" requires numba to be installed.')
+    return backend
+
+
+def get_caviar_function(model, backend='auto', dtype='float64'):
+    """
+    :param: model (str): one of {"adaptive", "symmetric", "asymmetric", "igarch"}
+    :param: backend (str): one of {"auto", "numba", "numpy", "python"}
+    :param: dtype (str): "float64", or "float32" to run the recursion on float32 returns and VaRs.
+                         Default is "float64".
+    :returns: caviar (callable): caviar(returns, beta, quantile, VaR0, G) -> VaR from day 0 to day T + 1
+    """
+    functions = _CAVIAR_FUNCTIONS[resolve_backend(backend)]
+    if model not in functions:
+        raise ValueError('Model must be one of {"adaptive", "symmetric", "asymmetric", "igarch"}')
+    if resolve_dtype(dtype) == 'float64':
+        return functions[model]
+    # a partial of a module-level function, so it still pickles to worker processes
+    return partial(functions[model], dtype=np.float32)
+
+
+# ------------------------------------------------------------------
+# batched RQ criterion
+# evaluates T^-1 sum (quantile - I(y_t < f_t)) (y_t - f_t) for an (n, p)
+# matrix of betas, and optionally several quantile levels in the same pass.
+# The loss is accumulated along the recursion so no (n, T) VaR matrix is
+# ever materialised. The loss is always accumulated in float64. With
+# float32 returns, the numpy engine also advances float32 betas and VaR
+# states; the numba kernel keeps its per-candidate state in float64
+# registers, as the recursions above.
+# ------------------------------------------------------------------
+
+_SPEC_CODES = {'adaptive': 0, 'symmetric': 1, 'asymmetric': 2, 'igarch': 3}
+
+
+def _rq_loss_batch_numpy(spec, returns, betas, quantiles, VaR0s, G, chunk_size):
+    """
+    :param: spec (int): specification code, see _SPEC_CODES
+    :param: returns (np.array): a series of returns from day 0 to T
+    :param: betas (np.array): (n, p) matrix of candidate betas
+    :param: quantiles (np.array): (Q,) quantile levels
+    :param: VaR0s (np.array): (Q,) initial VaR of every quantile level
+    :param: chunk_size (int): number of betas advanced together
+    :returns: (Q, n) array of RQ criteria
+    """
+    T = returns.shape[0]
+    losses = np.empty((quantiles.shape[0], betas.shape[0]))
+    quantile = quantiles[:, None].astype(returns.dtype)
+    sign = np.where((spec == 3) & (quantile < 0.5), -1., 1.).astype(returns.dtype)
+    VaR0s = VaR0s.astype(returns.dtype)
+
+    for start in range(0, betas.shape[0], chunk_size):
+        b = betas[start:start + chunk_size].T
+        VaR = np.repeat(-VaR0s[:, None] if spec == 3 else VaR0s[:, None], b.shape[1], axis=1)
+        loss = np.zeros(VaR.shape)
+
+        with np.errstate(over='ignore', invalid='ignore'):
+            for r in _iter_floats(returns):
+                f = sign * VaR
+                loss += (r - f) * (quantile - (r < f))
+
+                if spec == 0:
+                    VaR = VaR + b[0] * (1 / (1 + np.exp(G * (r - VaR))) - quantile)
+                elif spec == 1:
+                    VaR = b[0] + b[1] * VaR + b[2] * abs(r)
+                elif spec == 2:
+                    VaR = b[0] + b[1] * VaR + b[2] * max(r, 0.) + b[3] * min(r, 0.)
+                else:
+                    VaR = np.sqrt(b[0] + b[1] * VaR ** 2 + b[2] * r ** 2)
+
+        losses[:, start:start + chunk_size] = loss / T
+    return losses
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _rq_loss_batch_kernel(spec, returns, betas, quantiles, VaR0s, G):
+        T = returns.shape[0]
+        Q = quantiles.shape[0]
+        losses = np.empty((Q, betas.shape[0]))
+        sign = np.ones(Q)
+        for i in range(Q):
+            if spec == 3 and quantiles[i] < 0.5:
+                sign[i] = -1.
+        VaR = np.empty(Q)
+        loss = np.empty(Q)
+
+        for j in range(betas.shape[0]):
+            b = betas[j]
+            for i in range(Q):
+                VaR[i] = -VaR0s[i] if spec == 3 else VaR0s[i]
+                loss[i] = 0.
+            for t in range(T):
+                r = returns[t]
+                for i in range(Q):
+                    quantile = quantiles[i]
+                    f = sign[i] * VaR[i]
+                    loss[i] += (r - f) * (quantile - (1. if r < f else 0.))
+
+                    if spec == 0:
+                        VaR[i] = VaR[i] + b[0] * (1 / (1 + np.exp(G * (r - VaR[i]))) - quantile)
+                    elif spec == 1:
+                        VaR[i] = b[0] + b[1] * VaR[i] + b[2] * abs(r)
+                    elif spec == 2:
+                        VaR[i] = b[0] + b[1] * VaR[i] + b[2] * max(r, 0.) + b[3] * min(r, 0.)
+                    else:
+                        VaR[i] = (b[0] + b[1] * VaR[i] ** 2 + b[2] * r ** 2) ** 0.5
+            for i in range(Q):
+                losses[i, j] = loss[i] / T
+        return losses
+
+
+def rq_loss_batch(returns, betas, model, quantile, VaR0, G=10, backend='auto', chunk_size=4096, dtype='float64'):
+    """
+    RQ criterion of many betas at once, used by the initial-candidate search.
+
+    :param: returns (array-like): a series of returns from day 0 to T
+    :param: betas (array-like): (n, p) matrix of betas
+    :param: model (str): one of {"adaptive", "symmetric", "asymmetric", "igarch"}
+    :param: quantile (float or array-like): a value between 0 and 1, or (Q,) quantile levels
+                                            evaluated in the same pass over the returns
+    :param: VaR0 (float or array-like): initial VaR, one per quantile level
+    :param: G (int): smoothing constant of the adaptive model. Default is 10.
+    :param: backend (str): one of {"auto", "numba", "numpy", "python"}. "python" uses the numpy engine.
+    :param: chunk_size (int): number of betas the numpy engine advances together. Default is 4096.
+    :param: dtype (str): "float64", or "float32" to read float32 returns; the numpy engine then also advances
+                         float32 betas and VaRs, which halves its memory traffic. Default is "float64".
+    :returns: (n,) array of RQ criteria, or (Q, n) if quantile is an array
+    """
+    if model not in _SPEC_CODES:
+        raise ValueError('Model must be one of {"adaptive", "symmetric", "asymmetric", "igarch"}')
+
+    spec = _SPEC_CODES[model]
+    returns = _as_float_array(returns, resolve_dtype(dtype))
+    betas = np.ascontiguousarray(np.atleast_2d(betas), dtype=np.float64)
+    quantiles = np.atleast_1d(np.asarray(quantile, dtype=np.float64))
+    VaR0s = np.broadcast_to(np.asarray(VaR0, dtype=np.float64), quantiles.shape).copy()
+
+    if resolve_backend(backend) == 'numba':
+        losses = _rq_loss_batch_kernel(spec, returns, betas, quantiles, VaR0s, float(G))
+    else:
+        losses = _rq_loss_batch_numpy(spec, returns, betas.astype(returns.dtype, copy=False), quantiles, VaR0s,
+                                      float(G), chunk_size)
+    return losses if np.ndim(quantile) else losses[0]
+
+
+# ------------------------------------------------------------------
+# fused RQ criterion and gradient
+# the check loss rho(u) = u (quantile - I(u < 0)) is replaced by
+#     rho_h(u) = quantile * u + h * log(1 + exp(-u / h)),
+# which tends to rho as h -> 0 and has derivative quantile - sigmoid(-u / h).
+# the VaR and its derivatives w.r.t. beta are propagated in the same pass,
+# with the derivative recursions of variance_covariance.
+# ------------------------------------------------------------------
+
+def _smooth_check(u, quantile, h):
+    """
+    :returns: rho_h(u) and d rho_h / du for arrays of residuals u
+    """
+    z = -u / h
+    loss = quantile * u + h * np.logaddexp(0, z)
+    with np.errstate(over='ignore'):
+        dloss = quantile - 1 / (1 + np.exp(-z))
+    return loss, dloss
+
+
+def _rq_loss_grad_numpy(spec, returns, beta, quantile, VaR0, G, h):
+    T = returns.shape[0]
+    beta = [float(b) for b in beta]
+    p = len(beta)
+
+    if spec in (1, 2):
+        # linear specifications: every derivative is itself a first order filter
+        #     d f_t = x_t-1 + b2 * d f_t-1, d f_0 = 0
+        b2 = beta[1]
+        if spec == 1:
+            exog = np.c_[np.ones(T, returns.dtype), np.abs(returns)]
+        else:
+            exog = np.c_[np.ones(T, returns.dtype), np.maximum(returns, 0), np.minimum(returns, 0)]
+        VaRs = _linear_filter(exog @ np.array([beta[0]] + beta[2:], returns.dtype), b2, VaR0)[:-1]
+
+        X = np.c_[exog[:, :1], VaRs, exog[:, 1:]][:-1]
+        gradient = np.zeros((T, p), returns.dtype)
+        gradient[1:] = _first_order_filter(X, b2, axis=0)
+    else:
+        VaRs = np.empty(T, returns.dtype)
+        gradient = np.zeros((T, p), returns.dtype)
+        if spec == 0:
+            b1 = beta[0]
+            VaR, d = float(VaR0), 0.
+            for t, r in enumerate(_iter_floats(returns)):
+                VaRs[t] = VaR
+                gradient[t, 0] = d
+                s = _sigmoid(G * (r - VaR))
+                d = d + (s - quantile) + b1 * G * s * (1 - s) * d
+                VaR = VaR + b1 * (s - quantile)
+        else:
+            b1, b2, b3 = beta
+            sign = -1. if quantile < 0.5 else 1.
+            g, dg = - float(VaR0), [0., 0., 0.]
+            for t, r in enumerate(_iter_floats(returns)):
+                VaRs[t] = sign * g
+                gradient[t] = dg
+                g_next = math.sqrt(b1 + b2 * g * g + b3 * r * r)
+                x = (1., g * g, r * r)
+                dg = [(x[k] + 2 * b2 * g * dg[k]) / (2 * g_next) for k in range(3)]
+                g = g_next
+            gradient *= sign
+
+    loss, dloss = _smooth_check(returns - VaRs, quantile, h)
+    return loss.sum(dtype=np.float64) / T, - dloss @ gradient / T
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _rq_loss_grad_kernel(spec, returns, beta, quantile, VaR0, G, h):
+        T = returns.shape[0]
+        p = beta.shape[0]
+        sign = -1. if (spec == 3 and quantile < 0.5) else 1.
+
+        VaR = -VaR0 if spec == 3 else VaR0
+        d = np.zeros(p)
+        x = np.zeros(p)
+        loss = 0.
+        grad = np.zeros(p)
+
+        for t in range(T):
+            r = returns[t]
+            f = sign * VaR
+            z = -(r - f) / h
+            # numerically stable softplus and sigmoid
+            if z > 0:
+                loss += quantile * (r - f) + h * (z + np.log1p(np.exp(-z)))
+                dloss = quantile - 1 / (1 + np.exp(-z))
+            else:
+                loss += quantile * (r - f) + h * np.log1p(np.exp(z))
+                dloss = quantile - np.exp(z) / (1 + np.exp(z))
+            for k in range(p):
+                grad[k] -= dloss * sign * d[k]
+
+            # advance the VaR and its derivatives to t + 1
+            if spec == 0:
+                s = 1 / (1 + np.exp(G * (r - VaR)))
+                d[0] = d[0] + (s - quantile) + beta[0] * G * s * (1 - s) * d[0]
+                VaR = VaR + beta[0] * (s - quantile)
+            elif spec == 1 or spec == 2:
+                x[0] = 1.
+                x[1] = VaR
+                if spec == 1:
+                    x[2] = abs(r)
+                else:
+                    x[2] = max(r, 0.)
+                    x[3] = min(r, 0.)
+                for k in range(p):
+                    d[k] = x[k] + beta[1] * d[k]
+                VaR = beta[0] + beta[1] * VaR + beta[2] * x[2] + (beta[3] * x[3] if spec == 2 else 0.)
+            else:
+                VaR_next = (beta[0] + beta[1] * VaR ** 2 + beta[2] * r ** 2) ** 0.5
+                x[0] = 1.
+                x[1] = VaR ** 2
+                x[2] = r ** 2
+                for k in range(p):
+                    d[k] = (x[k] + 2 * beta[1] * VaR * d[k]) / (2 * VaR_next)
+                VaR = VaR_next
+
+        return loss / T, grad / T
+
+
+def rq_loss_grad(beta, returns, model, quantile, VaR0, G=10, smoothing=1e-3, backend='auto', dtype='float64'):
+    """
+    Smoothed RQ criterion and its analytic gradient from one pass of the recursion,
+    for scipy.optimize.minimize(..., jac=True).
+
+    :param: beta (array-like): parameters of CAVIAR function
+    :param: returns (array-like): a series of returns from day 0 to T
+    :param: model (str): one of {"adaptive", "symmetric", "asymmetric", "igarch"}
+    :param: quantile (float): a value between 0 and 1
+    :param: VaR0 (float): initial VaR
+    :param: G (int): smoothing constant of the adaptive model. Default is 10.
+    :param: smoothing (float): bandwidth h of the smoothed check loss, in units of returns. Default is 1e-3.
+    :param: backend (str): one of {"auto", "numba", "numpy", "python"}. "python" uses the numpy version.
+    :param: dtype (str): "float64" or "float32", the dtype of the returns and of the intermediate arrays.
+                         The loss is accumulated in float64. Default is "float64".
+    :returns: (loss, gradient)
+    """
+    if model not in _SPEC_CODES:
+        raise ValueError('Model must be one of {"adaptive", "symmetric", "asymmetric", "igarch"}')
+
+    spec = _SPEC_CODES[model]
+    returns = _as_float_array(returns, resolve_dtype(dtype))
+    beta = np.ascontiguousarray(beta, dtype=np.float64)
+
+    if resolve_backend(backend) == 'numba':
+        return _rq_loss_grad_kernel(spec, returns, beta, float(quantile), float(VaR0), float(G), float(smoothing))
+    return _rq_loss_grad_numpy(spec, returns, beta, float(quantile), float(VaR0), float(G), float(smoothing))
+
+
+# ------------------------------------------------------------------
+# gradient of the VaR path w.r.t. beta, given the fitted VaR path
+# every specification's derivative follows a first order linear recursion
+#     d f_t = a_t * d f_t-1 + c_t,   d f_0 = 0,
+# with a_t and c_t computable from the (known) VaR path in one shot.
+# ------------------------------------------------------------------
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _linear_recursion_kernel(a, c):
+        y = np.zeros_like(c)
+        for t in range(1, c.shape[0]):
+            for k in range(c.shape[1]):
+                y[t, k] = a[t] * y[t - 1, k] + c[t, k]
+        return y
+
+
+def _linear_recursion(a, c, backend='auto', dtype=np.float64):
+    """
+    :param: a (np.array): (T,) coefficients of the lagged value
+    :param: c (np.array): (T, p) innovations
+    :param: dtype (str or np.dtype): dtype of the recursion. Default is float64.
+    :returns: (T, p) array y with y_0 = 0 and y_t = a_t * y_t-1 + c_t
+    """
+    c = np.ascontiguousarray(c, dtype=dtype)
+    if resolve_backend(backend) == 'numba':
+        return _linear_recursion_kernel(np.ascontiguousarray(a, dtype=dtype), c)
+
+    y = np.zeros_like(c)
+    if np.all(a[1:] == a[1]):
+        # constant coefficient: a plain linear filter
+        y[1:] = _first_order_filter(c[1:], a[1], axis=0)
+    else:
+        # column by column over python floats, LOOP_CHUNK at a time, as the numpy caviar functions
+        for k in range(c.shape[1]):
+            value = 0.
+            for start in range(1, c.shape[0], LOOP_CHUNK):
+                chunk = []
+                for a_t, c_t in zip(a[start:start + LOOP_CHUNK].tolist(), c[start:start + LOOP_CHUNK, k].tolist()):
+                    value = a_t * value + c_t
+                    chunk.append(value)
+                y[start:start + len(chunk), k] = chunk
+    return y
+
+
+def caviar_gradient(returns, beta, model, quantile, VaRs, G=10, backend='auto', dtype='float64'):
+    """
+    :param: returns (array-like): a series of returns from day 0 to T - 1
+    :param: beta (np.array): fitted beta
+    :param: model (str): one of {"adaptive", "symmetric", "asymmetric", "igarch"}
+    :param: quantile (float): a value between 0 and 1
+    :param: VaRs (np.array): fitted VaR from day 0 to T - 1
+    :param: G (int): smoothing constant of the adaptive model. Default is 10.
+    :param: backend (str): one of {"auto", "numba", "numpy", "python"}
+    :param: dtype (str): "float64" or "float32", the dtype of the recursion and of the gradient.
+                         Default is "float64".
+    :returns: (T, p) gradient of VaR_t w.r.t. beta
+    """
+    dtype = resolve_dtype(dtype)
+    returns = _as_float_array(returns, dtype)
+    VaRs = _as_float_array(VaRs, dtype)
+    beta = [float(b) for b in beta]
+    T = returns.shape[0]
+
+    a = np.empty(T, dtype)
+    c = np.zeros((T, len(beta)), dtype)
+    y, f = returns[:-1], VaRs[:-1]
+    ones = np.ones(T - 1, dtype)
+
+    if model == 'adaptive':
+        # f_t = f_t-1 + b1 * ([1 + exp(G * (y_t-1 - f_t-1))]^-1 - quantile)
+        with np.errstate(over='ignore'):
+            sigmoid = 1 / (1 + np.exp(G * (y - f)))
+        a[1:] = 1 + beta[0] * G * sigmoid * (1 - sigmoid)
+        c[1:, 0] = sigmoid - quantile
+    elif model == 'symmetric':
+        # f_t = b1 + b2 * f_t-1 + b3 * |y_t-1|
+        a[:] = beta[1]
+        c[1:] = np.c_[ones, f, np.abs(y)]
+    elif model == 'asymmetric':
+        # f_t = b1 + b2 * f_t-1 + b3 * max(y_t-1, 0) + b4 * min(y_t-1, 0)
+        a[:] = beta[1]
+        c[1:] = np.c_[ones, f, np.maximum(y, 0), np.minimum(y, 0)]
+    elif model == 'igarch':
+        # f_t = (b1 + b2 * f_t-1 ** 2 + b3 * y_t-1 ** 2) ** 0.5
+        a[1:] = beta[1] * f / VaRs[1:]
+        c[1:] = np.c_[ones, f ** 2, y ** 2] / (2 * VaRs[1:, None])
+    else:
+        raise ValueError('Wrong model!')
+
+    return _linear_recursion(a, c, backend, dtype)
@@ -0,0 +1,128 @@
+# Author: Lee Yat Shun, Jasper
+# Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
+
+import numpy as np
+from ._caviar_model import CaviarModel
+from ._exceptions import InputSizeError, NotFittedError
+from ._instrument import make_sink, report, tag
+from ._io import as_returns
+from ._kernels import rq_loss_batch
+from ._parallel import check_random_state
+from ._quantreg import search_size, select_best
+from time import perf_counter
+
+
+class MultiQuantileCaviarModel:
+    def __init__(self, quantiles=(0.01, 0.025, 0.05, 0.1), model='symmetric', method='RQ', extra_starts=1,
+                 **params):
+        """
+        Joint fit of one CAViaR specification at several quantile levels.
+        
+        The random-start search runs once for all levels (every candidate beta is evaluated at every level in
+        the same pass over the returns). The lowest level starts from its m best candidates as in CaviarModel;
+        every following level starts from the solution of its neighbour plus its extra_starts best candidates.
+        
+        :param: quantiles (iterable): Quantile values between 0 and 1 exclusively. Default is (0.01, 0.025, 0.05, 0.1).
+        :param: model (str): Type of CAViaR model. Model must be one of {"adaptive", "symmetric", "asymmetric", "igarch"}.
+        :param: method (str): Estimation method. Must be one of {"RQ", "mle"}. Default is "RQ".
+        :param: extra_starts (int): Number of candidates from the shared search optimized next to the
+                                    neighbour's solution. Default is 1.
+        :param: params: other parameters of CaviarModel, e.g. backend, jac, n_jobs. The callback receives
+                        the records of every level (tagged with its quantile), a "search" and a "multi_quantile" record.
+        """
+        self.quantiles = sorted(quantiles)
+        if len(self.quantiles) == 0 or len(set(self.quantiles)) != len(self.quantiles):
+            raise ValueError('quantiles must be a non-empty collection of distinct values.')
+        
+        callback = params.get('callback')
+        self.models = {q: CaviarModel(q, model, method, **dict(params, callback=tag(callback, quantile=q)))
+                       for q in self.quantiles}
+        self.model = model
+        self.method = method
+        self.extra_starts = extra_starts
+        self.params = params
+    
+    def __repr__(self):
+        return (f"MultiQuantileCaviarModel(quantiles={self.quantiles}, model={self.model}, "
+                f"method={self.method}, extra_starts={self.extra_starts})")
+    
+    def __getitem__(self, quantile):
+        return self.models[quantile]
+    
+    def _check_fitted(self):
+        if any(caviar_model.beta is None for caviar_model in self.models.values()):
+            msg = ('This MultiQuantileCaviarModel instance is not fitted yet. '
+                   'Call "fit" with appropriate arguments before using this estimator.')
+            raise NotFittedError(msg)
+    
+    def fit(self, returns):
+        """
+        :param: returns (array-like or str): a series of returns (100x), or the path of a .npy or raw float64 file
+        """
+        reference = self.models[self.quantiles[0]]
+        # converted once, so every level reuses the same array of its dtype
+        returns = as_returns(returns, reference.dtype)
+        if len(returns) < 300:
+            raise InputSizeError('The size of return array must not be less than 300.')
+        
+        sink = make_sink(self.params.get('callback'), reference.verbose)
+        
+        s = perf_counter()
+        if self.method == 'RQ':
+            # the empirical quantiles of every level from one sort, and
+            # the RQ criterion of every candidate at every level from one pass
+            VaR0s = np.quantile(returns[:300], self.quantiles)
+            n, m, p = search_size(self.model)
+            random_betas = check_random_state(self.params.get('random_state')).uniform(0, 1, (n, p))
+            losses = rq_loss_batch(returns, random_betas, self.model, self.quantiles, VaR0s,
+                                   reference.G, reference.backend, dtype=reference.dtype)
+            report(sink, 'search', n=n, m=m, quantiles=len(self.quantiles), seconds=perf_counter() - s)
+        
+        previous = None
+        for i, quantile in enumerate(self.quantiles):
+            caviar_model = self.models[quantile]
+            if self.method == 'RQ':
+                k = m if previous is None else self.extra_starts
+                starts = [candidate['beta'] for candidate in select_best(random_betas, losses[i], k)]
+                if previous is not None:
+                    starts = [previous] + starts
+                caviar_model.fit(returns, initial_beta=np.array(starts))
+            else:
+                caviar_model.fit(returns, initial_beta=previous)
+            previous = caviar_model.beta
+        
+        report(sink, 'multi_quantile', model=self.model, method=self.method, quantiles=len(self.quantiles),
+               seconds=perf_counter() - s)
+    
+    def beta_summary(self):
+        """
+        :returns: statistics of beta of every quantile level (pd.DataFrame indexed by quantile and beta)
+        """
+        import pandas as pd
+        
+        self._check_fitted()
+        return pd.concat({q: self.models[q].beta_summary() for q in self.quantiles}, names=['quantile', 'beta'])
+    
+    def predict(self, returns, predict_mode='out'):
+        """
+        :param: returns (array-like): a series of returns
+        :param: predict_mode (str): either 'in' or 'out'
+        :returns: negative VaRs (pd.DataFrame): one column per quantile level, including the forecast
+        """
+        import pandas as pd
+        
+        self._check_fitted()
+        return pd.DataFrame({q: self.models[q].predict(returns, predict_mode) for q in self.quantiles})
+    
+    def dq_test(self, returns, test_mode):
+        """
+        :param: returns (array-like): a series of returns
+        :param: test_mode (str): either 'in' or 'out'
+        :returns: p-value of the Dynamic Quantile test of every quantile level (pd.Series)
+        """
+        import pandas as pd
+        
+        self._check_fitted()
+        return pd.Series({q: self.models[q].dq_test(returns, test_mode) for q in self.quantiles},
+                         name='DQ pval')
+
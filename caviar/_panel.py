@@ -0,0 +1,129 @@
+# Author: Lee Yat Shun, Jasper
+# Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
+
+import signal
+import threading
+import numpy as np
+from time import perf_counter
+from ._caviar_model import CaviarModel
+from ._instrument import make_sink, report
+from ._parallel import check_random_state, draw_entropy, effective_n_jobs, map_shared_returns, spawn_seeds
+
+
+def fit_panel(returns, timeout=None, n_jobs=-1, **model_params):
+    """
+    Fit one CaviarModel per instrument over a shared process pool.
+    A ticker that fails (or runs out of time) is reported in the results instead of aborting the batch.
+    
+    :param: returns (pd.DataFrame or dict): wide frame with one column per ticker, or {ticker: returns}.
+                                            Leading and trailing missing values (e.g. before listing)
+                                            are trimmed per ticker; a ticker with missing values inside
+                                            its series is reported as failed.
+    :param: timeout (float): wall-clock budget of each fit in seconds. Default is None (no limit).
+                             Enforced with SIGALRM, i.e. on POSIX only.
+    :param: n_jobs (int): number of processes. -1 means all cores. Default is -1.
+    :param: model_params: passed to CaviarModel, e.g. quantile, model, method. A callback is not passed on
+                          (it cannot cross processes): it receives a "ticker" record per ticker and a "panel"
+                          summary instead.
+    :returns: results (pd.DataFrame): one row per ticker with status, error, number of observations,
+                                      training loss, beta, standard errors, p values of beta,
+                                      in-sample DQ p value and seconds taken.
+                                      results.attrs['fits_per_second'] holds the throughput.
+    """
+    import pandas as pd
+    
+    if isinstance(returns, pd.DataFrame):
+        tickers = list(returns.columns)
+        columns = [returns[ticker].to_numpy(dtype=np.float64) for ticker in tickers]
+    else:
+        tickers = list(returns.keys())
+        columns = [np.asarray(returns[ticker], dtype=np.float64) for ticker in tickers]
+    
+    # one (n_tickers, T) buffer, NaN-padded, so every ticker is a contiguous row of shared memory
+    panel = np.full((len(tickers), max(len(column) for column in columns)), np.nan)
+    for i, column in enumerate(columns):
+        panel[i, :len(column)] = column
+    
+    # one seed per ticker (see spawn_seeds)
+    seeds = spawn_seeds(len(tickers), draw_entropy(check_random_state(model_params.pop('random_state', None))))
+    sink = make_sink(model_params.pop('callback', None), model_params.get('verbose', False))
+    tasks = [(i, timeout, dict(model_params, random_state=seed)) for i, seed in enumerate(seeds)]
+    n_jobs = effective_n_jobs(n_jobs, len(tasks))
+    
+    s = perf_counter()
+    if n_jobs > 1:
+        records = map_shared_returns(_fit_one, panel, tasks, n_jobs)
+    else:
+        records = [_fit_one(panel, *task) for task in tasks]
+    elapsed = perf_counter() - s
+    
+    results = pd.DataFrame(records, index=pd.Index(tickers, name='ticker'))
+    results.attrs['fits_per_second'] = len(tickers) / elapsed
+    
+    if sink is not None:
+        for ticker, record in zip(tickers, records):
+            report(sink, 'ticker', ticker=ticker, status=record['status'], T=record['T'],
+                   loss=record.get('loss'), seconds=record['seconds'])
+        report(sink, 'panel', tickers=len(tickers), ok=int((results['status'] == 'ok').sum()), seconds=elapsed,
+               fits_per_second=results.attrs['fits_per_second'])
+    return results
+
+
+class _FitTimeout(BaseException):
+    # not an Exception, so no `except Exception` inside scipy or numpy can swallow it
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _FitTimeout()
+
+
+def _fit_one(panel, i, timeout, model_params):
+    """
+    :returns: record (dict) of the i-th ticker; never raises
+    """
+    returns = panel[i]
+    # trim the missing values before listing, after delisting and of the padding, not those inside the series
+    observed = np.flatnonzero(~np.isnan(returns))
+    returns = returns[observed[0]:observed[-1] + 1] if observed.size else returns[:0]
+    record = {'status': 'ok', 'error': None, 'T': len(returns)}
+    
+    use_alarm = (timeout is not None and hasattr(signal, 'setitimer')
+                 and threading.current_thread() is threading.main_thread())
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    
+    s = perf_counter()
+    try:
+        try:
+            if np.isnan(returns).any():
+                # dropping them would join days that are not adjacent in the recursion
+                raise ValueError('returns have missing values inside the series; only leading and trailing '
+                                 'ones are trimmed.')
+            caviar_model = CaviarModel(**model_params)
+            caviar_model.fit(returns)
+            record['loss'] = caviar_model.training_loss
+            for j, (beta, se, pval) in enumerate(zip(caviar_model.beta,
+                                                     caviar_model.beta_standard_errors,
+                                                     caviar_model.beta_pvals)):
+                record[f'beta{j+1}'] = beta
+                record[f'S.E. of beta{j+1}'] = se
+                record[f'pval of beta{j+1}'] = pval
+            record['DQ pval (in)'] = caviar_model.dq_test(returns, 'in')
+        finally:
+            # cancelled inside the outer try: an alarm that fires before this line is still caught below
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except _FitTimeout:
+        record['status'] = 'timeout'
+        record['error'] = f'fit exceeded {timeout}s'
+    except Exception as e:
+        record['status'] = 'failed'
+        record['error'] = f'{type(e).__name__}: {e}'
+    finally:
+        if use_alarm:
+            signal.signal(signal.SIGALRM, previous)
+    
+    record['seconds'] = perf_counter() - s
+    return record
@@ -0,0 +1,126 @@
+# Author: Lee Yat Shun, Jasper
+# Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
+
+import os
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, util
+
+# set in every worker by _attach_returns
+_worker_shm = None
+_worker_returns = None
+
+
+def effective_n_jobs(n_jobs, n_tasks):
+    """
+    :param: n_jobs (int): number of processes. -1 means all cores.
+    :param: n_tasks (int): number of independent tasks
+    :returns: number of worker processes actually worth starting
+    """
+    if n_jobs is None or n_jobs == 0:
+        raise ValueError('n_jobs must be a positive integer or -1.')
+    if n_jobs < 0:
+        n_jobs = max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+    return max(min(n_jobs, n_tasks), 1)
+
+
+def check_random_state(random_state):
+    """
+    :param: random_state (None, int, np.random.SeedSequence, np.random.Generator or np.random.RandomState):
+            None uses the global numpy RNG, so np.random.seed keeps working.
+    :returns: an object with a numpy-style uniform(low, high, size) sampler
+    """
+    if random_state is None:
+        return np.random.mtrand._rand
+    if isinstance(random_state, (np.random.Generator, np.random.RandomState)):
+        return random_state
+    return np.random.default_rng(random_state)
+
+
+def draw_entropy(rng):
+    """
+    :param: rng (np.random.Generator or np.random.RandomState)
+    :returns: a non-negative int to seed a SeedSequence with
+    """
+    if isinstance(rng, np.random.Generator):
+        return int(rng.integers(2 ** 63))
+    return int(rng.randint(2 ** 31))
+
+
+def spawn_seeds(n, entropy):
+    """
+    :param: n (int): number of independent streams
+    :param: entropy (int): root seed
+    :returns: list of n 32-bit seeds from SeedSequence(entropy).spawn(n)
+    
+    fit_panel, grid_search and walk_forward pass one of these as the random_state of every task: the streams are
+    independent, and a task draws the same numbers whether the tasks run serially or on a process pool,
+    whatever n_jobs and the order in which the workers pick them up.
+    """
+    children = np.random.SeedSequence(entropy).spawn(n)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def _attach_returns(name, shape, dtype):
+    """worker initializer: map the shared return buffer instead of receiving a copy"""
+    global _worker_shm, _worker_returns
+    _worker_shm = shared_memory.SharedMemory(name=name)
+    _worker_returns = np.ndarray(shape, dtype=dtype, buffer=_worker_shm.buf)
+    # run when the worker exits, unlike atexit, which a forked worker skips
+    util.Finalize(None, _detach_returns, exitpriority=0)
+
+
+def _detach_returns():
+    """worker exit: drop the view on the shared buffer, then close the handle (the parent unlinks it)"""
+    global _worker_shm, _worker_returns
+    _worker_returns = None
+    if _worker_shm is not None:
+        _worker_shm.close()
+        _worker_shm = None
+
+
+def _run_task(func, args):
+    return func(_worker_returns, *args)
+
+
+def map_shared_returns(func, returns, tasks, n_jobs):
+    """
+    Run func(returns, *args) for every args in tasks on a process pool.
+    The return series is written once into shared memory and every worker maps it.
+
+    :param: func (callable): picklable, module-level function
+    :param: returns (np.array): a series of returns shared by all tasks
+    :param: tasks (list of tuple): extra positional arguments of each task
+    :param: n_jobs (int): number of processes
+    :returns: list of results in the order of tasks
+    """
+    with shared_returns_pool(returns, n_jobs) as pool_map:
+        return pool_map(func, tasks)
+
+
+@contextmanager
+def shared_returns_pool(returns, n_jobs):
+    """
+    Keep one shared return buffer and one process pool alive for several rounds of tasks.
+
+    :param: returns (np.array): a series of returns shared by all tasks, float32 (kept as is) or float64
+    :param: n_jobs (int): number of processes
+    :returns: pool_map(func, tasks), with the arguments of map_shared_returns
+    """
+    returns = np.asarray(returns)
+    dtype = np.float32 if returns.dtype == np.float32 else np.float64
+    returns = np.ascontiguousarray(returns, dtype=dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(returns.nbytes, 1))
+    try:
+        np.ndarray(returns.shape, dtype=dtype, buffer=shm.buf)[:] = returns
+        with ProcessPoolExecutor(max_workers=n_jobs,
+                                 initializer=_attach_returns,
+                                 initargs=(shm.name, returns.shape, dtype)) as pool:
+            def pool_map(func, tasks):
+                futures = [pool.submit(_run_task, func, args) for args in tasks]
+                return [future.result() for future in futures]
+            yield pool_map
+    finally:
+        shm.close()
+        shm.unlink()
@@ -2,10 +2,17 @@
 # Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
 
 import numpy as np
-from scipy.optimize import minimize
+from functools import partial
+from time import perf_counter
+from scipy.optimize import linprog, minimize
+from ._instrument import CountCalls, report, tag
+from ._kernels import caviar_gradient, finite_difference_step, rq_loss_batch, rq_loss_grad
+from ._parallel import check_random_state, effective_n_jobs, map_shared_returns
 
 
-def rq_fit(returns, model, quantile, caviar, obj, tol, VaR0):
+def rq_fit(returns, model, quantile, caviar, obj, tol, VaR0, G=10, backend='auto', n_jobs=1, jac=True,
+           smoothing=1e-3, initial_beta=None, racing=False, solver='L-BFGS-B', random_state=None, sink=None,
+           dtype='float64'):
     """
     following Engle & Manganelli (2004) approach
     :param: returns (np.array): a series of returns
@@ -15,42 +22,141 @@ def rq_fit(returns, model, quantile, caviar, obj, tol, VaR0):
     :param: quantile (float): a value between 0 and 1
     :param: tol (float): a very small positive number. Default is 1e-10
     :param: VaR0 (float): initial estimate of VaR_0
+    :param: G (int): smoothing constant of the adaptive model. Default is 10.
+    :param: backend (str): kernel backend of the candidate search. Default is "auto".
+    :param: n_jobs (int): number of processes the m starts are spread over. -1 means all cores. Default is 1.
+    :param: jac (bool): if True, L-BFGS-B minimizes the smoothed RQ criterion with its analytic gradient,
+                        otherwise scipy finite-differences obj. Default is True.
+    :param: smoothing (float): bandwidth of the smoothed check loss. Default is 1e-3.
+    :param: initial_beta (array-like): warm start, a beta or a (k, p) array of betas. If given, the
+                                       random-start search is skipped and only these betas are optimized.
+                                       Default is None.
+    :param: racing (bool): if True, the starts are raced by successive halving (see race) instead of
+                           being optimized to convergence one by one. Runs in the calling process.
+                           Default is False.
+    :param: solver (str): "L-BFGS-B", or "lp" to iterate exact linear-programming quantile regressions of the
+                          linearised recursion (symmetric and asymmetric only, see optimize_lp).
+                          Default is "L-BFGS-B".
+    :param: random_state (None, int or np.random.Generator): source of the random-start search.
+                                                             Default is None (global numpy RNG).
+    :param: sink (callable): receives the structured records of the search and of every start (see make_sink).
+                             Default is None (silent).
+    :param: dtype (str): "float64" or "float32", the dtype of the returns and of the recursions of the search,
+                         the smoothed criterion and the lp linearisation; caviar must match it. Default is "float64".
     :returns: estimated beta
     """
     # compute the daily returns as 100 times the difference of the log of the prices.
-    returns = np.array(returns)
+    # no copy of an array of dtype, e.g. a np.memmap
+    returns = np.asarray(returns, dtype=dtype)
     
-    initial_betas = initialize_betas(returns, model, caviar, obj, quantile, VaR0)
+    if initial_beta is None:
+        initial_betas = initialize_betas(returns, model, caviar, obj, quantile, VaR0, G, backend, random_state,
+                                         sink, dtype)
+    else:
+        initial_betas = [{'loss': obj(beta, returns, quantile, caviar, VaR0), 'beta': beta}
+                         for beta in np.atleast_2d(np.array(initial_beta, dtype=np.float64))]
     result = []
     
-    # print('Optimizing by simplex method and quasi-newton method...')
-    print('Optimizing...')
+    loss_grad = None
+    if jac:
+        loss_grad = partial(rq_loss_grad, model=model, quantile=quantile, VaR0=VaR0, G=G,
+                            smoothing=smoothing, backend=backend, dtype=dtype)
+    
+    if solver == 'L-BFGS-B':
+        run = partial(optimize, loss_grad=loss_grad)
+    elif solver == 'lp':
+        if model not in ['symmetric', 'asymmetric']:
+            raise ValueError('The lp solver only supports the "symmetric" and "asymmetric" models.')
+        if racing:
+            raise ValueError('racing is only available with the L-BFGS-B solver.')
+        run = partial(optimize_lp, G=G, backend=backend, dtype=dtype)
+    else:
+        raise ValueError('solver must be either "L-BFGS-B" or "lp".')
     
-    for m, initial_beta in enumerate(initial_betas):
-        print(f'when m = {m+1}')
-        beta, loss = optimize(initial_beta, returns, model, quantile, obj, caviar, tol, VaR0)
-        result.append(
-            {
-                'beta': beta,
-                'loss': loss
-            }
-        )
+    n_jobs = effective_n_jobs(n_jobs, len(initial_betas))
+    if racing and len(initial_betas) > 1:
+        beta, loss = race(initial_betas, returns, model, quantile, obj, caviar, tol, VaR0, loss_grad, sink=sink)
+        result.append({'beta': beta, 'loss': loss})
+    elif n_jobs > 1:
+        # every start is an independent, deterministic run: the result does not depend on n_jobs
+        tasks = [(run, m + 1, initial_beta, model, quantile, obj, caviar, tol, VaR0, sink is not None)
+                 for m, initial_beta in enumerate(initial_betas)]
+        for beta, loss, records in map_shared_returns(_optimize_shared, returns, tasks, n_jobs):
+            # a sink cannot cross processes: the workers collect the records and they are passed on here
+            for record in records:
+                sink(record)
+            result.append({'beta': beta, 'loss': loss})
+    else:
+        for m, initial_beta in enumerate(initial_betas):
+            beta, loss = run(initial_beta, returns, model, quantile, obj, caviar, tol, VaR0,
+                             sink=tag(sink, start=m + 1))
+            result.append(
+                {
+                    'beta': beta,
+                    'loss': loss
+                }
+            )
 
+    # stable sort: ties are broken by the order of the starts, not by which worker finished first
     result = sorted(result, key=lambda x: x['loss'])
     return result[0]['beta']
 
 
-def initialize_betas(returns, model, caviar, obj, quantile, VaR0):
+def rq_criterion(beta, returns, quantile, caviar, VaR0, G=10):
+    """
+    Module-level RQ criterion: unlike the bound CaviarModel.obj it pickles without the model (and its callback)
+    when the starts are optimized on other processes.
+    
+    :param: beta (array-like): parameters of CAVIAR function
+    :param: returns (array-like): a series of returns from day 0 to T
+    :param: quantile (float): a value between 0 and 1
+    :param: caviar (callable function): a CAVIAR function
+    :param: VaR0 (float): initial estimate of VaR_0
+    :param: G (int): smoothing constant of the adaptive model. Default is 10.
+    :return: quantile regression loss
+    """
+    # VaR from day 0 to T+1
+    VaRs = caviar(returns, beta, quantile, VaR0, G)
+    residuals = returns - VaRs[:-1]
+    hit = quantile - (returns < VaRs[:-1])
+    T = len(returns)
+    return residuals @ hit / T
+
+
+def initialize_betas(returns, model, caviar, obj, quantile, VaR0, G=10, backend='auto', random_state=None,
+                     sink=None, dtype='float64'):
     """
     :param: returns (np.array): a series of returns
     :param: model (str): a type of CAViaR models
     :param: caviar (callable): a CAViaR function
     :param: obj (callable): RQ criterion
     :param: quantile (float): a value between 0 and 1
+    :param: VaR0 (float): initial estimate of VaR_0
+    :param: G (int): smoothing constant of the adaptive model. Default is 10.
+    :param: backend (str): "python" evaluates obj one beta at a time,
+                           otherwise all n betas are evaluated by the batched kernel.
+    :param: random_state (None, int or np.random.Generator): Default is None (global numpy RNG).
+    :param: sink (callable): receives a "search" record. Default is None.
+    :param: dtype (str): "float64" or "float32", the dtype of the batched recursions. Default is "float64".
     :returns: m betas that produced the lowest RQ criterion as initial values
               for the optimization routine
     """
+    n, m, p = search_size(model)
+    
+    s = perf_counter()
+    random_betas = check_random_state(random_state).uniform(0, 1, (n, p))
+
+    if backend == 'python':
+        losses = np.array([obj(beta, returns, quantile, caviar, VaR0) for beta in random_betas])
+    else:
+        losses = rq_loss_batch(returns, random_betas, model, quantile, VaR0, G, backend, dtype=dtype)
 
+    best = select_best(random_betas, losses, m)
+    report(sink, 'search', n=n, m=m, loss=best[0]['loss'], seconds=perf_counter() - s)
+    return best
+
+
+def search_size(model):
     """
     For below parameters n, m, p:
     n (int): We generated n vectors using a uniform random number generator between 0 and 1.
@@ -58,6 +164,9 @@ def initialize_betas(returns, model, caviar, obj, quantile, VaR0):
              selected the m vectors that produced the lowest RQ criterion as initial values
              for the optimization routine
     p (int): Number of betas in the vector
+    
+    :param: model (str): a type of CAViaR models
+    :returns: n, m, p
     """
     if model == 'adaptive':
         n = 10 ** 4
@@ -75,60 +184,141 @@ def initialize_betas(returns, model, caviar, obj, quantile, VaR0):
         n = 10 ** 4
         m = 10
         p = 3
-    
-    # for faster version
-    n = 1
-    m = 1
-    
-    print(f'Generating {m} best initial betas out of {n}...')
-    random_betas = np.random.uniform(0, 1, (n, p))
+    return n, m, p
 
-    best_initial_betas = []
 
-    # if have time, can try heap instead of sorted list
-    for i in range(n):
-        loss = obj(random_betas[i], returns, quantile, caviar, VaR0)
+def select_best(betas, losses, m):
+    """
+    :param: betas (np.array): (n, p) candidate betas
+    :param: losses (np.array): (n,) their RQ criteria
+    :param: m (int): number of betas to keep
+    :returns: the m betas with the lowest losses as [{'loss', 'beta'}], best first
+    """
+    # keep the m lowest losses by partial selection, then order only those m
+    m = min(m, len(losses))
+    best = np.argpartition(losses, m - 1)[:m]
+    best = best[np.argsort(losses[best], kind='stable')]
+    return [{'loss': losses[i], 'beta': betas[i]} for i in best]
 
-        best_initial_betas.append(
-            {'loss': loss, 'beta': random_betas[i]}
-        )
 
-        best_initial_betas = sorted(best_initial_betas, key=lambda x: x['loss'])
+def _optimize_shared(returns, run, start, initial_beta, model, quantile, obj, caviar, tol, VaR0, record):
+    """
+    :returns: optimized beta, its RQ criterion and the records of the start (empty unless record)
+    """
+    records = []
+    sink = tag(records.append, start=start) if record else None
+    beta, loss = run(initial_beta, returns, model, quantile, obj, caviar, tol, VaR0, sink=sink)
+    return beta, loss, records
 
-        if len(best_initial_betas) == m+1:
-            best_initial_betas.pop()
 
-    return best_initial_betas
+def get_bounds(model, p):
+    """
+    :param: model (str): a type of CAViaR models
+    :param: p (int): number of betas
+    :returns: L-BFGS-B bounds of beta
+    """
+    if model == 'igarch':
+        return [(1e-10, None)] + [(1e-10, 1) for _ in range(p-1)]
+    return [(None, None)] + [(-1, 1) for _ in range(p-1)]
 
 
-def optimize(initial_beta, returns, model, quantile, obj, caviar, tol, VaR0):
+def race(initial_betas, returns, model, quantile, obj, caviar, tol, VaR0, loss_grad=None, budget=10, sink=None):
+    """
+    Successive halving over the starts: every surviving start gets budget L-BFGS-B iterations
+    from where it stopped, the worse half (by RQ criterion) is dropped and the budget of the survivors
+    is doubled, until one start is left. It is then optimized to convergence by optimize.
+    
+    :param: initial_betas (list of dict): [{'beta', 'loss'}] starting betas
+    :param: loss_grad (callable): as in optimize. Default is None.
+    :param: budget (int): iterations of every start in the first round. Default is 10.
+    :param: sink (callable): receives a "race_round" record per round, the records of the final optimize
+                             and a "race" summary. Default is None.
+    :returns: optimized beta of the last surviving start and its RQ criterion
     """
+    bounds = get_bounds(model, len(initial_betas[0]['beta']))
+    eps = finite_difference_step(returns.dtype)
+    
+    survivors = [dict(start, evaluations=0, start=m + 1) for m, start in enumerate(initial_betas)]
+    race_starts = survivors
+    while len(survivors) > 1:
+        s = perf_counter()
+        evaluations = sum(start['evaluations'] for start in survivors)
+        round_obj, round_grad = obj, loss_grad
+        if sink is not None:
+            round_obj = CountCalls(obj)
+            round_grad = CountCalls(loss_grad) if loss_grad is not None else None
+        for start in survivors:
+            if loss_grad is None:
+                res = minimize(round_obj, start['beta'], args=(returns, quantile, caviar, VaR0), bounds=bounds,
+                               method='L-BFGS-B', options={'maxiter': budget, 'eps': eps})
+            else:
+                res = minimize(round_grad, start['beta'], args=(returns,), jac=True, bounds=bounds,
+                               method='L-BFGS-B', options={'maxiter': budget})
+            start['beta'] = res.x
+            start['loss'] = round_obj(res.x, returns, quantile, caviar, VaR0)
+            start['evaluations'] += res.nfev + 1
+        if sink is not None:
+            counters = [round_obj] if loss_grad is None else [round_obj, round_grad]
+            report(sink, 'race_round', starts=len(survivors), budget=budget,
+                   evaluations=sum(start['evaluations'] for start in survivors) - evaluations,
+                   objective_seconds=sum(c.seconds for c in counters),
+                   best_loss=min(start['loss'] for start in survivors), seconds=perf_counter() - s)
+        # stable sort: ties keep the order of the starts
+        survivors = sorted(survivors, key=lambda x: x['loss'])[:(len(survivors) + 1) // 2]
+        budget *= 2
     
+    obj = CountCalls(obj)
+    loss_grad = CountCalls(loss_grad) if loss_grad is not None else None
+    beta, loss = optimize(survivors[0], returns, model, quantile, obj, caviar, tol, VaR0, loss_grad,
+                          sink=tag(sink, start=survivors[0]['start']))
+    final = obj.n_calls + (loss_grad.n_calls if loss_grad is not None else 0)
+    
+    # saved relative to giving every start the evaluations the winner got
+    used = sum(start['evaluations'] for start in race_starts) + final
+    winner = survivors[0]['evaluations'] + final
+    report(sink, 'race', starts=len(race_starts), winner=survivors[0]['start'], evaluations=used,
+           winner_evaluations=winner, saved=len(race_starts) * winner - used)
+    return beta, loss
+
+
+def optimize(initial_beta, returns, model, quantile, obj, caviar, tol, VaR0, loss_grad=None, sink=None):
+    """
+    :param: initial_beta (dict): {'beta': starting beta, 'loss': its RQ criterion}
+    :param: loss_grad (callable): loss_grad(beta, returns) -> (smoothed loss, gradient).
+                                  If None, scipy finite-differences obj. Default is None.
+    :param: sink (callable): receives an "update" record per L-BFGS-B run and a "start" record with the
+                             iterations, objective evaluations (obj and loss_grad) and their seconds, and the
+                             seconds of the start. Default is None.
+    :returns: optimized beta and its RQ criterion
     """
+    s = perf_counter()
+    if sink is not None:
+        obj = CountCalls(obj)
+        loss_grad = CountCalls(loss_grad) if loss_grad is not None else None
     current_beta = initial_beta['beta']
     current_loss = initial_beta['loss']
-    
-    # with bounds
-    if model == 'igarch':
-        bounds = [(1e-10, None)] + [(1e-10, 1) for _ in range(len(current_beta)-1)]
-    else:
-        bounds = [(None, None)] + [(-1, 1) for _ in range(len(current_beta)-1)]
+    bounds = get_bounds(model, len(current_beta))
     
     # # with no bound
     # bounds = [(None, None) for _ in range(len(current_beta))]
     
-    count = 0
-    print(f'Update {count}:', current_loss)
+    count = iterations = 0
     
     while True:
         # Minimize the function directly using the L-BFGS-B algorithm
-        res = minimize(obj, current_beta, args=(returns, quantile, caviar, VaR0), bounds=bounds, method='L-BFGS-B')
+        if loss_grad is None:
+            res = minimize(obj, current_beta, args=(returns, quantile, caviar, VaR0), bounds=bounds, method='L-BFGS-B',
+                           options={'eps': finite_difference_step(returns.dtype)})
+            loss = res.fun
+        else:
+            # one forward pass per iteration; the stopping rule still uses the exact RQ criterion
+            res = minimize(loss_grad, current_beta, args=(returns,), jac=True, bounds=bounds, method='L-BFGS-B')
+            loss = obj(res.x, returns, quantile, caviar, VaR0)
         current_beta = res.x
-
-        loss = res.fun
         
-        count += 1   
-        print(f'Update {count}:',loss)
+        count += 1
+        iterations += res.nit
+        report(sink, 'update', update=count, loss=loss, iterations=res.nit, evaluations=res.nfev)
         
         if current_loss - loss < tol or count >= 5:
             break
@@ -162,5 +352,91 @@ def optimize(initial_beta, returns, model, quantile, obj, caviar, tol, VaR0):
 #             break
 #         else:
 #             current_loss = loss
+    
+    if sink is not None:
+        counters = [obj] if loss_grad is None else [obj, loss_grad]
+        report(sink, 'start', initial_loss=initial_beta['loss'], loss=loss, updates=count, iterations=iterations,
+               evaluations=sum(c.n_calls for c in counters), objective_seconds=sum(c.seconds for c in counters),
+               seconds=perf_counter() - s)
+    return current_beta, loss
+
+def optimize_lp(initial_beta, returns, model, quantile, obj, caviar, tol, VaR0, G=10, backend='auto',
+                max_iter=50, sink=None, dtype='float64'):
+    """
+    Iterated linear-programming quantile regression: the VaR recursion is linearised around the current beta,
+    VaR_t(beta + delta) ~ VaR_t(beta) + gradient_t @ delta, and the quantile regression of y_t - VaR_t(beta)
+    on gradient_t is solved exactly as an LP (HiGHS). The step, projected onto the bounds, is halved until
+    the exact RQ criterion improves, and the linearisation is repeated until the improvement is below tol.
+    
+    :param: initial_beta (dict): {'beta': starting beta, 'loss': its RQ criterion}
+    :param: G (int): smoothing constant of the adaptive model. Default is 10.
+    :param: backend (str): kernel backend of the gradient recursion. Default is "auto".
+    :param: max_iter (int): maximum number of linearisations. Default is 50.
+    :param: sink (callable): receives an "update" record per accepted step and a "start" record, as in optimize.
+                             Default is None.
+    :param: dtype (str): "float64" or "float32", the dtype of the gradient recursion. Default is "float64".
+    :returns: optimized beta and its RQ criterion
+    """
+    s = perf_counter()
+    if sink is not None:
+        obj = CountCalls(obj)
+    current_beta = np.array(initial_beta['beta'], dtype=np.float64)
+    current_loss = initial_beta['loss']
+    bounds = get_bounds(model, len(current_beta))
+    lower = np.array([-np.inf if low is None else low for low, _ in bounds])
+    upper = np.array([np.inf if high is None else high for _, high in bounds])
+    
+    count = iterations = 0
+    
+    while count < max_iter:
+        VaRs = caviar(returns, current_beta, quantile, VaR0, G)[:-1]
+        gradient = caviar_gradient(returns, current_beta, model, quantile, VaRs, G, backend, dtype)
+        delta = quantile_regression_lp(gradient, returns - VaRs, quantile)
+        iterations += 1
+        if delta is None:
+            break
         
-    return current_beta, loss
\ No newline at end of file
+        # the linearisation is only local: halve the step until the exact RQ criterion improves.
+        # the step is projected onto the bounds coordinate by coordinate, so a coordinate on its bound
+        # stays there while the free ones move
+        step = 1.
+        while step > 1e-6:
+            beta = np.clip(current_beta + step * delta, lower, upper)
+            loss = obj(beta, returns, quantile, caviar, VaR0)
+            if loss < current_loss:
+                break
+            step /= 2
+        else:
+            break
+        
+        count += 1
+        report(sink, 'update', update=count, loss=loss, step=step)
+        
+        improvement = current_loss - loss
+        current_beta, current_loss = beta, loss
+        if improvement < tol:
+            break
+    
+    # iterations are the linear programs solved, evaluations the exact RQ criteria of the step halving
+    if sink is not None:
+        report(sink, 'start', initial_loss=initial_beta['loss'], loss=current_loss, updates=count,
+               iterations=iterations, evaluations=obj.n_calls, objective_seconds=obj.seconds,
+               seconds=perf_counter() - s)
+    return current_beta, current_loss
+
+
+def quantile_regression_lp(X, y, quantile):
+    """
+    Solve min_b sum(rho_quantile(y - X @ b)) exactly by linear programming (HiGHS).
+    The dual max y'd s.t. X'd = (1 - quantile) X'1, 0 <= d <= 1 has only p equality constraints,
+    and b is read off its multipliers.
+    
+    :param: X (np.array): (T, p) regressors
+    :param: y (np.array): (T,) response
+    :param: quantile (float): a value between 0 and 1
+    :returns: b (np.array), or None if the LP is not solved
+    """
+    res = linprog(-y, A_eq=X.T, b_eq=(1 - quantile) * X.sum(axis=0), bounds=(0, 1), method='highs')
+    if res.status != 0:
+        return None
+    return -res.eqlin.marginals
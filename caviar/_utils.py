@@ -2,14 +2,16 @@
 # Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
 
 import numpy as np
-import matplotlib.pyplot as plt
 
 
 def plot_caviar(returns, VaR, quantile, model, x_axis=None):
+    # pyplot is only imported when something is plotted
+    import matplotlib.pyplot as plt
+    
     if x_axis is not None:
         x_lbl = 'date'
     else:
-        x_axis = range(len(returns))
+        x_axis = np.arange(len(returns))
         x_lbl = 'time'
     
     fig, axes = plt.subplots(2, 1, figsize=(10, 8*2))
@@ -36,6 +38,8 @@ def plot_caviar(returns, VaR, quantile, model, x_axis=None):
     
     
 def plot_news_impact_curve(beta, model, quantile, VaR, G):
+    import matplotlib.pyplot as plt
+    
     y = np.linspace(-10, 10, 100)
     
     if model == 'symmetric':
@@ -0,0 +1,124 @@
+# Author: Lee Yat Shun, Jasper
+# Copyright (c) 2023 Lee Yat Shun, Jasper. All rights reserved.
+
+import numpy as np
+from ._caviar_model import CaviarModel
+from ._parallel import check_random_state, draw_entropy, effective_n_jobs, map_shared_returns, spawn_seeds
+
+
+def walk_forward(returns, window=1000, scheme='rolling', refit_every=20, search_tol=0.05, n_jobs=1,
+                 **model_params):
+    """
+    Walk-forward refitting of a CaviarModel: fit on a window, forecast the next refit_every periods
+    out of sample, move forward and refit.
+    
+    Every refit is warm-started from the previous beta. The random-start search is only rerun when the
+    warm-started training loss is worse than the previous one by more than search_tol (relative).
+    
+    :param: returns (array-like): a series of returns (100x). A pd.Series keeps its index in the output.
+    :param: window (int): size of the first training window, and of every window if scheme is "rolling".
+                          Must not be less than 300. Default is 1000.
+    :param: scheme (str): either "rolling" (fixed window size) or "expanding" (from day 0). Default is "rolling".
+    :param: refit_every (int): number of out-of-sample periods between refits. Default is 20.
+    :param: search_tol (float): relative loss deterioration that triggers a new random-start search. Default is 0.05.
+    :param: n_jobs (int): number of processes. The refits are split into n_jobs contiguous blocks. A serial pass
+                          first refits the window before every block, each warm-started from the previous one,
+                          so that every block starts from the beta a serial run would have about reached there.
+                          Where the loss has several near-equal minima, a block may still settle in another one.
+                          -1 means all cores. Default is 1.
+    :param: model_params: passed to CaviarModel, e.g. quantile, model, method. A callback receives the records
+                          of every refit if n_jobs is 1; it cannot cross processes and is dropped otherwise.
+    :returns: VaRs (np.array or pd.Series): contiguous out-of-sample VaR from day window to the last day
+    :returns: refits (pd.DataFrame): one row per refit with the training window (first and last day), beta,
+                                     loss and whether the random-start search was run
+    """
+    import pandas as pd
+    
+    if scheme not in ['rolling', 'expanding']:
+        raise ValueError('scheme must be either "rolling" or "expanding".')
+    if refit_every < 1:
+        raise ValueError('refit_every must be a positive integer.')
+    
+    index = getattr(returns, 'index', None)
+    returns = np.ascontiguousarray(returns, dtype=np.float64)
+    if len(returns) <= window:
+        raise ValueError('The return series must be longer than the first window.')
+    
+    # end of every training window = start of its out-of-sample block
+    ends = list(range(window, len(returns), refit_every))
+    
+    n_jobs = effective_n_jobs(n_jobs, len(ends))
+    blocks = [list(block) for block in np.array_split(ends, n_jobs)]
+    # one seed per block (see spawn_seeds)
+    seeds = spawn_seeds(n_jobs, draw_entropy(check_random_state(model_params.pop('random_state', None))))
+    starts = [(None, None)]
+    if n_jobs > 1:
+        model_params.pop('callback', None)
+        # the refit before every block but the first, warm-started in turn from the first refit, which draws
+        # the same starts as the first refit of a serial run
+        boundaries = [ends[0]] + [block[0] - refit_every for block in blocks[1:]]
+        _, boundary_refits = _walk_block(returns, boundaries, window, scheme, refit_every, search_tol, seeds[0],
+                                         model_params)
+        starts += [(refit['beta'], refit['loss']) for refit in boundary_refits[1:]]
+    tasks = [(block, window, scheme, refit_every, search_tol, seed, model_params, beta, loss)
+             for block, seed, (beta, loss) in zip(blocks, seeds, starts)]
+    
+    if n_jobs > 1:
+        results = map_shared_returns(_walk_block, returns, tasks, n_jobs)
+    else:
+        results = [_walk_block(returns, *task) for task in tasks]
+    
+    VaRs = np.concatenate([VaR for block_VaRs, _ in results for VaR in block_VaRs])
+    refits = pd.DataFrame([refit for _, block_refits in results for refit in block_refits])
+    
+    if index is not None:
+        VaRs = pd.Series(VaRs, index=index[window:], name='VaR')
+        refits['train_start'] = index[refits['train_start']]
+        refits['train_end'] = index[refits['train_end']]
+    return VaRs, refits
+
+
+def _walk_block(returns, ends, window, scheme, refit_every, search_tol, seed, model_params, beta=None, loss=None):
+    """
+    Refit sequentially at every end in ends, warm-starting from the previous refit of the same block.
+    
+    :param: beta (np.array): warm start of the first refit, e.g. the beta of the refit before the block.
+                             Default is None (random-start search).
+    :param: loss (float): training loss of beta, for search_tol. Default is None.
+    :returns: list of out-of-sample VaR arrays, list of refit records
+    """
+    VaRs, refits = [], []
+    rng = np.random.default_rng(seed)
+    
+    for end in ends:
+        start = end - window if scheme == 'rolling' else 0
+        train = returns[start:end]
+        test = returns[end:end + refit_every]
+        
+        caviar_model = CaviarModel(random_state=rng, **model_params)
+        caviar_model.fit(train, initial_beta=beta)
+        searched = beta is None
+        
+        # the warm start got stuck: fall back to the random-start search
+        if not searched and caviar_model.training_loss > (1 + search_tol) * loss:
+            cold_model = CaviarModel(random_state=rng, **model_params)
+            cold_model.fit(train)
+            searched = True
+            if cold_model.training_loss < caviar_model.training_loss:
+                caviar_model = cold_model
+        
+        beta, loss = caviar_model.beta, caviar_model.training_loss
+        
+        # VaR_t for every test day t; the first one is the forecast made at the end of the window
+        test_VaRs = caviar_model.predict(test, 'out')[:-1]
+        test_VaRs[0] = caviar_model.VaR0_out
+        VaRs.append(test_VaRs)
+        refits.append({
+            'train_start': start,
+            'train_end': end - 1,
+            'beta': beta,
+            'loss': loss,
+            'searched': searched,
+        })
+    
+    return VaRs, refits
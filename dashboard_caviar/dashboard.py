@@ -6,12 +6,19 @@ sys.path.insert(0, "..")
 import numpy as np
 import pandas as pd
 import streamlit as st
-from caviar import CaviarModel
+from caviar import CaviarModel, FitCache
 from var_tests import *
 import yfinance as yf
 
 st.set_option('deprecation.showPyplotGlobalUse', False)
 
+
+@st.cache_resource
+def get_fit_cache():
+    # one cache per server process: reruns with the same ticker and options skip the fit
+    return FitCache(maxsize=32, directory='~/.cache/caviar')
+
+
 ticker = None
 
 st.title('CAViaR')
@@ -77,8 +84,8 @@ if ticker:
             options=['RQ', 'mle']
         )
 
-    caviar_model = CaviarModel(option_quantile, model=option_caviar, method=option_method)
-    caviar_model.fit(in_samples)
+    caviar_model = CaviarModel(option_quantile, model=option_caviar, method=option_method, random_state=0)
+    get_fit_cache().fit(caviar_model, in_samples)
     
     if np.isnan(caviar_model.training_loss):
         st.write('Fail to optimize. Try other ticker/specification/quantile/method.')
@@ -0,0 +1,58 @@
+import numpy as np
+from caviar import CaviarModel, FitCache
+
+
+def test_hit_keeps_the_settings_of_the_caller():
+    returns = np.random.default_rng(0).standard_t(5, 1000)
+    cache = FitCache()
+
+    first = cache.fit(CaviarModel(0.05, 'symmetric', random_state=0, n_jobs=1, profile=True), returns)
+    second = cache.fit(CaviarModel(0.05, 'symmetric', random_state=0, n_jobs=2, profile=False), returns)
+
+    assert cache.info().hits == 1
+    np.testing.assert_array_equal(second.beta, first.beta)
+    np.testing.assert_array_equal(second.predict(returns, 'in'), first.predict(returns, 'in'))
+    assert second.n_jobs == 2
+    assert second.profile is False
+    assert second.profile_phases is None
+    assert first.profile_phases is not None
+
+
+def test_disk_hit_reads_a_saved_model_file(tmp_path):
+    returns = np.random.default_rng(0).standard_t(5, 1000)
+    first = FitCache(directory=tmp_path).fit(CaviarModel(0.05, 'asymmetric', random_state=0), returns)
+    assert [path.suffix for path in tmp_path.iterdir()] == ['.caviar']
+
+    cache = FitCache(directory=tmp_path)
+    second = cache.fit(CaviarModel(0.05, 'asymmetric', random_state=0), returns)
+
+    assert cache.info().disk_hits == 1
+    np.testing.assert_array_equal(second.beta, first.beta)
+    np.testing.assert_array_equal(second.gradient, first.gradient)
+    np.testing.assert_array_equal(second.predict(returns, 'in'), first.predict(returns, 'in'))
+
+
+def test_fit_without_a_seed_is_not_cached():
+    returns = np.random.default_rng(0).standard_t(5, 1000)
+    cache = FitCache()
+
+    cache.fit(CaviarModel(0.05, 'symmetric'), returns)
+    cache.fit(CaviarModel(0.05, 'symmetric'), returns)
+
+    assert cache.info() == (0, 0, 0, 0, 0)
+
+
+def test_unreadable_disk_entry_is_a_miss(tmp_path, monkeypatch):
+    returns = np.random.default_rng(0).standard_t(5, 1000)
+    first = FitCache(directory=tmp_path).fit(CaviarModel(0.05, 'symmetric', random_state=0), returns)
+
+    def load_models(path, mmap=True):
+        raise ImportError('backend="numba" requires numba to be installed.')
+
+    monkeypatch.setattr('caviar._cache.load_models', load_models)
+    cache = FitCache(directory=tmp_path)
+    second = cache.fit(CaviarModel(0.05, 'symmetric', random_state=0), returns)
+
+    assert cache.info().disk_hits == 0
+    assert cache.info().misses == 1
+    np.testing.assert_array_equal(second.beta, first.beta)
@@ -0,0 +1,45 @@
+import json
+import numpy as np
+import pytest
+from caviar import CaviarModel
+from caviar._exceptions import NotFittedError
+from caviar._kernels import HAS_NUMBA
+
+
+def test_restored_online_state_predicts_out_of_sample():
+    returns = np.random.default_rng(0).standard_t(5, 1200)
+    in_samples, out_of_samples = returns[:1000], returns[1000:]
+    caviar_model = CaviarModel(0.05, 'asymmetric', random_state=0)
+    caviar_model.fit(in_samples)
+
+    restored = CaviarModel(0.05, 'asymmetric')
+    restored.set_online_state(json.loads(json.dumps(caviar_model.get_online_state())))
+
+    np.testing.assert_allclose(restored.predict(out_of_samples, 'out'), caviar_model.predict(out_of_samples, 'out'))
+    assert restored.update(out_of_samples) == pytest.approx(caviar_model.update(out_of_samples))
+    with pytest.raises(NotFittedError):
+        restored.predict(in_samples, 'in')
+    with pytest.raises(NotFittedError):
+        restored.plot_caviar(in_samples, 'in')
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'numba'] if HAS_NUMBA else ['numpy'])
+@pytest.mark.parametrize('model', ['adaptive', 'symmetric', 'asymmetric', 'igarch'])
+def test_chunked_predict_matches_one_pass(tmp_path, backend, model):
+    returns = np.random.default_rng(0).standard_t(5, 1500)
+    caviar_model = CaviarModel(0.05, model, backend=backend, random_state=0)
+    caviar_model.fit(returns[:1000])
+    # a memory-mapped series, whose length is not a multiple of chunk_size
+    path = tmp_path / 'returns.npy'
+    np.save(path, returns[1000:])
+    out_of_samples = np.load(path, mmap_mode='r')
+
+    for predict_mode in ['out', 'in']:
+        expected = caviar_model.predict(out_of_samples, predict_mode)
+        out = np.empty(len(out_of_samples) + 1)
+        np.testing.assert_array_equal(caviar_model.predict(out_of_samples, predict_mode, out=out, chunk_size=64),
+                                      expected)
+        np.testing.assert_array_equal(out, expected)
+        written = caviar_model.predict(out_of_samples, predict_mode, out=tmp_path / 'VaRs.npy', chunk_size=64)
+        assert isinstance(written, np.memmap)
+        np.testing.assert_array_equal(np.load(tmp_path / 'VaRs.npy'), expected)
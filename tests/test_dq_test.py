@@ -0,0 +1,108 @@
+import os
+import numpy as np
+import pytest
+from numpy.linalg import inv
+from scipy.stats import chi2
+from caviar._dq_test import dq_test, variance_covariance
+from caviar._kernels import HAS_NUMBA, get_caviar_function
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'poc', 'dataCAViaR.txt')
+BACKENDS = ['numpy', 'numba'] if HAS_NUMBA else ['numpy']
+# betas of the order of the paper's estimates; the 95% VaR is positive, so the signs flip
+BETAS = {
+    (0.05, 'adaptive'): [0.3],
+    (0.05, 'symmetric'): [-0.15, 0.89, -0.11],
+    (0.05, 'asymmetric'): [-0.08, 0.93, -0.04, 0.12],
+    (0.05, 'igarch'): [0.33, 0.9, 0.12],
+    (0.95, 'adaptive'): [0.3],
+    (0.95, 'symmetric'): [0.15, 0.89, 0.11],
+    (0.95, 'asymmetric'): [0.08, 0.93, 0.12, -0.04],
+    (0.95, 'igarch'): [0.33, 0.9, 0.12],
+}
+G = 10
+
+
+def fitted_path(quantile, model, T=400):
+    returns = np.loadtxt(DATA)[:T, 0]
+    beta = np.array(BETAS[quantile, model])
+    VaRs = get_caviar_function(model, 'python')(returns, beta, quantile, np.quantile(returns, quantile), G)[:-1]
+    return returns, beta, VaRs
+
+
+def reference_variance_covariance(beta, model, T, returns, quantile, VaRs):
+    """the row by row recursion and sums of Manganelli's matlab code"""
+    residuals = returns - VaRs
+    bandwidth = np.sort(abs(residuals))[int(np.sqrt(T))]
+    gradient = np.zeros((T, len(beta)))
+    A = np.zeros((len(beta), len(beta)))
+    D = np.zeros((len(beta), len(beta)))
+    for i in range(1, T):
+        y, f, previous = returns[i - 1], VaRs[i - 1], gradient[i - 1]
+        if model == 'adaptive':
+            sigmoid = 1 / (1 + np.exp(G * (y - f)))
+            gradient[i] = previous + (sigmoid - quantile) + beta[0] * (sigmoid ** 2 - sigmoid) * G * (-previous)
+        elif model == 'symmetric':
+            gradient[i] = np.array([1, f, abs(y)]) + beta[1] * previous
+        elif model == 'asymmetric':
+            gradient[i] = np.array([1, f, max(y, 0), min(y, 0)]) + beta[1] * previous
+        else:
+            gradient[i] = (np.array([1, f ** 2, y ** 2]) + beta[1] * 2 * f * previous) / (2 * VaRs[i])
+        A += np.outer(gradient[i], gradient[i])
+        if abs(residuals[i]) <= bandwidth:
+            D += np.outer(gradient[i], gradient[i])
+    A = A / T
+    D = D / (2 * bandwidth * T)
+    return (quantile * (1 - quantile) / T) * (inv(D) @ A @ inv(D)), D, gradient
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('quantile, model', list(BETAS))
+def test_variance_covariance_matches_the_loop_formulas(backend, quantile, model):
+    returns, beta, VaRs = fitted_path(quantile, model)
+    T = len(returns)
+
+    expected = reference_variance_covariance(beta, model, T, returns, quantile, VaRs)
+    result = variance_covariance(beta, model, T, returns, quantile, VaRs, G, backend)
+
+    for value, expected_value in zip(result, expected):
+        np.testing.assert_allclose(value, expected_value, rtol=1e-10, atol=1e-14)
+
+
+def reference_dq_test(in_sample_mode, returns, quantile, VaRs, D, gradient, LAGS=4):
+    """the lag matrix, sums and inverses of Manganelli's matlab code"""
+    T = len(returns)
+    hit = (returns < VaRs) - quantile
+    residuals = returns - VaRs
+    bandwidth = np.sort(abs(residuals))[int(np.sqrt(T))]
+    HIT = hit[LAGS:]
+
+    Z = np.zeros((T - LAGS, LAGS))
+    for i in range(LAGS):
+        Z[:, i] = hit[i:T - LAGS + i]
+
+    if in_sample_mode:
+        X = Z
+        XHNABLA = np.zeros((X.shape[1], gradient.shape[1]))
+        for i in range(1, X.shape[0]):
+            if abs(residuals[i]) <= bandwidth:
+                XHNABLA += X[[i], :].T @ gradient[[i], :]
+        XHNABLA = XHNABLA / (2 * bandwidth * T)
+        M = X.T - XHNABLA @ inv(D) @ gradient[LAGS:, :].T
+        stat = HIT.T @ X @ inv(M @ M.T) @ X.T @ HIT / (quantile * (1 - quantile))
+    else:
+        X = np.c_[np.ones(T - LAGS), VaRs[LAGS:], Z]
+        stat = HIT.T @ X @ inv(X.T @ X) @ X.T @ HIT / (quantile * (1 - quantile))
+    return chi2.sf(stat, df=X.shape[1])
+
+
+@pytest.mark.parametrize('in_sample_mode', [True, False])
+@pytest.mark.parametrize('quantile, model', list(BETAS))
+def test_dq_test_matches_the_loop_formulas(in_sample_mode, quantile, model):
+    returns, beta, VaRs = fitted_path(quantile, model)
+    T = len(returns)
+    _, D, gradient = variance_covariance(beta, model, T, returns, quantile, VaRs, G)
+
+    expected = reference_dq_test(in_sample_mode, returns, quantile, VaRs, D, gradient)
+    pval = dq_test(in_sample_mode, model, returns, quantile, VaRs, D, gradient, T)
+
+    np.testing.assert_allclose(pval, expected, rtol=1e-10)
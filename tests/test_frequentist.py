@@ -0,0 +1,39 @@
+import os
+import numpy as np
+import pytest
+from caviar import CaviarModel
+from caviar._exceptions import ConvergenceError
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'poc', 'dataCAViaR.txt')
+
+
+@pytest.mark.parametrize('model', ['adaptive', 'symmetric', 'asymmetric', 'igarch'])
+def test_profiled_tau_reaches_the_unprofiled_optimum(model):
+    # GM in sample, as in Engle & Manganelli (2004)
+    returns = np.loadtxt(DATA)[:-500, 0]
+
+    for seed in range(6):
+        losses = []
+        for profile_tau in [False, True]:
+            caviar_model = CaviarModel(0.05, model, method='mle', profile_tau=profile_tau, random_state=seed)
+            caviar_model.fit(returns)
+            losses.append(caviar_model.training_loss * caviar_model.T)
+        unprofiled, profiled = losses
+        assert profiled <= unprofiled + 0.1, f'random_state={seed}'
+
+
+@pytest.mark.parametrize('profile_tau', [False, True])
+def test_convergence_error_once_the_attempts_run_out(profile_tau):
+    # a NaN return: every start has a NaN likelihood
+    returns = np.loadtxt(DATA)[:-500, 0].copy()
+    returns[100] = np.nan
+
+    caviar_model = CaviarModel(0.05, 'symmetric', method='mle', profile_tau=profile_tau, max_attempts=1,
+                               random_state=0)
+    with pytest.raises(ConvergenceError, match='after 1 attempts'):
+        caviar_model.fit(returns)
+
+    caviar_model = CaviarModel(0.05, 'symmetric', method='mle', profile_tau=profile_tau, max_attempts=10 ** 6,
+                               timeout=0.2, random_state=0)
+    with pytest.raises(ConvergenceError, match='timeout=0.2'):
+        caviar_model.fit(returns)
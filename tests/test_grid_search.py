@@ -0,0 +1,26 @@
+import os
+import numpy as np
+from caviar import _grid_search
+from caviar._kernels import get_caviar_function
+from caviar._quantreg import rq_criterion
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'poc', 'dataCAViaR.txt')
+
+
+def test_screen_optimizes_like_the_fit_and_hands_over_its_optimum(monkeypatch):
+    returns = np.loadtxt(DATA)[:-500, 0]
+    calls, screen_rq_fit = [], _grid_search.rq_fit
+
+    def rq_fit(*args, **kwargs):
+        calls.append(kwargs)
+        return screen_rq_fit(*args, **kwargs)
+
+    monkeypatch.setattr(_grid_search, 'rq_fit', rq_fit)
+    screens = _grid_search._screen(returns, len(returns), 'symmetric', [0.05], 10, 1e-10, 'auto', 'float64',
+                                   False, 'lp', 0)
+
+    assert calls[0]['solver'] == 'lp' and calls[0]['jac'] is False
+    # the first start of the fit is the screened optimum, not the raw candidate
+    VaR0 = np.quantile(returns[:300], 0.05)
+    loss = rq_criterion(screens[0]['starts'][0], returns, 0.05, get_caviar_function('symmetric'), VaR0, 10)
+    assert loss == screens[0]['loss']
@@ -0,0 +1,64 @@
+import numpy as np
+from caviar import CaviarModel, load_models, save_models
+
+
+def test_save_over_the_file_a_model_was_loaded_from(tmp_path):
+    returns = np.random.default_rng(0).standard_t(5, 1000)
+    caviar_model = CaviarModel(0.05, 'asymmetric', random_state=0)
+    caviar_model.fit(returns)
+    path = tmp_path / 'model.caviar'
+    caviar_model.save(path)
+
+    loaded = CaviarModel.load(path)
+    assert isinstance(loaded.gradient, np.memmap)
+    loaded.save(path)
+
+    reloaded = CaviarModel.load(path, mmap=False)
+    np.testing.assert_array_equal(reloaded.beta, caviar_model.beta)
+    np.testing.assert_array_equal(reloaded.gradient, caviar_model.gradient)
+    np.testing.assert_array_equal(reloaded.VaRs_in, caviar_model.VaRs_in)
+
+
+def test_round_trip_of_several_models(tmp_path):
+    returns = np.random.default_rng(1).standard_t(5, 1000)
+    models = {}
+    for model in ['adaptive', 'asymmetric']:
+        models[model] = CaviarModel(0.05, model, random_state=0)
+        models[model].fit(returns)
+    path = tmp_path / 'book.caviar'
+    save_models(path, models)
+
+    for mmap in [True, False]:
+        loaded = load_models(path, mmap=mmap)
+        assert list(loaded) == list(models)
+        for name, caviar_model in models.items():
+            for attr, value in caviar_model.__dict__.items():
+                if attr in ('caviar', 'callback'):
+                    continue
+                if isinstance(value, np.ndarray):
+                    loaded_value = getattr(loaded[name], attr)
+                    np.testing.assert_array_equal(loaded_value, value)
+                    assert loaded_value.dtype == value.dtype
+                    # only the large arrays are memory-mapped
+                    assert isinstance(loaded_value, np.memmap) == (mmap and value.nbytes >= 4096), attr
+                else:
+                    assert getattr(loaded[name], attr) == value, attr
+            np.testing.assert_array_equal(loaded[name].predict(returns, 'in'), caviar_model.predict(returns, 'in'))
+            assert loaded[name].dq_test(returns, 'in') == caviar_model.dq_test(returns, 'in')
+
+
+def test_load_a_numba_model_without_numba(tmp_path, monkeypatch):
+    returns = np.random.default_rng(2).standard_t(5, 1000)
+    caviar_model = CaviarModel(0.05, 'asymmetric', random_state=0)
+    caviar_model.fit(returns)
+    # as saved on a machine where backend="auto" resolved to numba
+    caviar_model.backend = 'numba'
+    path = tmp_path / 'model.caviar'
+    caviar_model.save(path)
+
+    monkeypatch.setattr('caviar._kernels.HAS_NUMBA', False)
+    loaded = load_models(path)
+    assert loaded.backend == 'numpy'
+    np.testing.assert_allclose(loaded.predict(returns, 'in'), caviar_model.predict(returns, 'in'), rtol=1e-12)
+    np.testing.assert_allclose(loaded.predict(returns[:10], 'out'), caviar_model.predict(returns[:10], 'out'),
+                               rtol=1e-12)
@@ -0,0 +1,68 @@
+import os
+import numpy as np
+import pytest
+from caviar._kernels import HAS_NUMBA, LOOP_CHUNK, _linear_recursion, get_caviar_function, rq_loss_grad
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'poc', 'dataCAViaR.txt')
+BACKENDS = ['numpy', 'numba'] if HAS_NUMBA else ['numpy']
+# betas of the order of the paper's estimates; the 95% VaR is positive, so the signs flip
+BETAS = {
+    (0.05, 'adaptive'): [0.3],
+    (0.05, 'symmetric'): [-0.15, 0.89, -0.11],
+    (0.05, 'asymmetric'): [-0.08, 0.93, -0.04, 0.12],
+    (0.05, 'igarch'): [0.33, 0.9, 0.12],
+    (0.95, 'adaptive'): [0.3],
+    (0.95, 'symmetric'): [0.15, 0.89, 0.11],
+    (0.95, 'asymmetric'): [0.08, 0.93, 0.12, -0.04],
+    (0.95, 'igarch'): [0.33, 0.9, 0.12],
+}
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('quantile, model', list(BETAS))
+def test_backend_matches_the_python_recursion(backend, quantile, model):
+    returns = np.loadtxt(DATA)[:, 0]
+    beta = np.array(BETAS[quantile, model])
+    VaR0 = np.quantile(returns[:300], quantile)
+
+    expected = get_caviar_function(model, 'python')(returns, beta, quantile, VaR0, 10)
+    VaRs = get_caviar_function(model, backend)(returns, beta, quantile, VaR0, 10)
+
+    assert VaRs.shape == (len(returns) + 1,)
+    assert np.all(np.isfinite(expected))
+    np.testing.assert_allclose(VaRs, expected, rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('quantile, model', list(BETAS))
+def test_rq_loss_grad_matches_finite_differences(backend, quantile, model):
+    returns = np.loadtxt(DATA)[:, 0]
+    beta = np.array(BETAS[quantile, model])
+    VaR0 = np.quantile(returns[:300], quantile)
+
+    _, gradient = rq_loss_grad(beta, returns, model, quantile, VaR0, backend=backend)
+
+    # central differences of the same smoothed criterion
+    step = 1e-6
+    expected = []
+    for i in range(len(beta)):
+        shift = np.eye(len(beta))[i] * step
+        upper, _ = rq_loss_grad(beta + shift, returns, model, quantile, VaR0, backend=backend)
+        lower, _ = rq_loss_grad(beta - shift, returns, model, quantile, VaR0, backend=backend)
+        expected.append((upper - lower) / (2 * step))
+    np.testing.assert_allclose(gradient, expected, rtol=1e-4, atol=1e-7)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_linear_recursion_with_a_varying_coefficient(backend):
+    # longer than one chunk of the numpy loop
+    rng = np.random.default_rng(0)
+    T = LOOP_CHUNK + 1000
+    a = 1 + 0.01 * rng.standard_normal(T)
+    c = rng.standard_normal((T, 3))
+
+    expected = np.zeros_like(c)
+    for t in range(1, T):
+        expected[t] = a[t] * expected[t - 1] + c[t]
+
+    np.testing.assert_array_equal(_linear_recursion(a, c, backend), expected)
@@ -0,0 +1,19 @@
+import os
+import numpy as np
+import pytest
+from caviar import CaviarModel
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'poc', 'dataCAViaR.txt')
+
+
+@pytest.mark.parametrize('method, model', [('RQ', 'symmetric'), ('RQ', 'adaptive'), ('mle', 'asymmetric'),
+                                           ('mle', 'igarch')])
+def test_parallel_fit_matches_the_serial_fit(method, model):
+    returns = np.loadtxt(DATA)[:-500, 0]
+
+    betas = []
+    for n_jobs in [1, 2]:
+        caviar_model = CaviarModel(0.05, model, method=method, n_jobs=n_jobs, random_state=0)
+        caviar_model.fit(returns)
+        betas.append(caviar_model.beta)
+    np.testing.assert_array_equal(betas[1], betas[0])
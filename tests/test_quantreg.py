@@ -0,0 +1,25 @@
+import os
+import numpy as np
+import pytest
+from caviar import CaviarModel
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'poc', 'dataCAViaR.txt')
+
+
+@pytest.mark.parametrize('series', [1, 2])
+def test_lp_solver_does_not_stop_at_the_bounds(series):
+    # IBM and SP500 at 1%: the lp direction crosses a bound at some starts
+    returns = np.loadtxt(DATA)[:2892, series]
+
+    losses = []
+    for solver in ['L-BFGS-B', 'lp']:
+        caviar_model = CaviarModel(0.01, 'symmetric', solver=solver, random_state=0)
+        caviar_model.fit(returns)
+        losses.append(caviar_model.training_loss)
+    lbfgsb, lp = losses
+    assert lp <= lbfgsb
+
+
+def test_lp_solver_rejects_racing():
+    with pytest.raises(ValueError, match='racing'):
+        CaviarModel(0.05, 'symmetric', solver='lp', racing=True)
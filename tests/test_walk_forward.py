@@ -0,0 +1,19 @@
+import os
+import numpy as np
+import pytest
+from caviar import walk_forward
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'poc', 'dataCAViaR.txt')
+
+
+@pytest.mark.parametrize('model', ['adaptive', 'asymmetric', 'igarch'])
+def test_parallel_blocks_match_the_serial_walk(model):
+    returns = np.loadtxt(DATA)[:, 0]
+
+    serial, serial_refits = walk_forward(returns, window=1500, refit_every=100, random_state=0, model=model)
+    parallel, parallel_refits = walk_forward(returns, window=1500, refit_every=100, random_state=0, model=model,
+                                             n_jobs=4)
+
+    np.testing.assert_allclose(parallel, serial, atol=0.15)
+    # only the first refit runs the random-start search, as in the serial walk
+    assert parallel_refits['searched'].tolist() == serial_refits['searched'].tolist()
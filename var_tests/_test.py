@@ -3,7 +3,8 @@
 
 import numpy as np
 import pandas as pd
-from scipy.stats import chi2, binom_test, binom, norm
+from scipy.special import xlogy
+from scipy.stats import chi2, binomtest, binom, norm
 
 
 def hit_rate(returns, VaRs):
@@ -26,7 +27,7 @@ def binomial_test(returns, VaRs, quantile):
     """
     k = np.sum(returns < VaRs) # number of failures
     n = len(returns) # num of total observations
-    return binom_test(k, n, p=quantile)
+    return binomtest(k, n, p=quantile).pvalue
 
 
 def traffic_light_test(returns, VaRs, quantile, num_obs=250, baseline=3):
@@ -76,9 +77,10 @@ def kupiec_pof_test(returns, VaRs, quantile):
     x = np.array(returns < VaRs).sum()
     N = len(returns)
     
+    # xlogy(0, 0) = 0: no (or only) failures still give a finite statistic
     LR_POF = -2 * (
-        ((N - x) * np.log(1 - p) + x * np.log(p))
-        - ((N - x) * np.log(1 - x / N) + x * np.log(x / N))
+        (xlogy(N - x, 1 - p) + xlogy(x, p))
+        - (xlogy(N - x, 1 - x / N) + xlogy(x, x / N))
     )
     
     return chi2.sf(LR_POF, 1)